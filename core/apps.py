@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "core"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .metrics import registry
+        from .views import worker_metrics
+        registry.collectors.append(worker_metrics)
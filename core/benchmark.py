@@ -0,0 +1,265 @@
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.test.utils import setup_databases, teardown_databases
+from django.urls import reverse
+from django.utils import timezone
+from .ingest import get_buffer
+from .metrics import registry
+from .models import ActivityEvent, Campaign, CampaignCycle, Doctor, FieldRepresentative, ShareRecord
+from .sync import sync_events
+
+SEED_BATCH_SIZE = 5000
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "queries_per_request", "seconds_per_100k")
+
+
+def _current_rss_kb():
+    # ru_maxrss is the process-lifetime peak, so after the first heavy scenario it would repeat for every
+    # later one; current RSS is only readable from /proc, with the lifetime peak as the fallback elsewhere.
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@contextmanager
+def rss_watch(interval=0.01):
+    usage = {"peak_rss_kb": _current_rss_kb()}
+    started = usage["peak_rss_kb"]
+    stopping = threading.Event()
+
+    def sample():
+        while not stopping.wait(interval):
+            usage["peak_rss_kb"] = max(usage["peak_rss_kb"], _current_rss_kb())
+
+    sampler = threading.Thread(target=sample, name="rss-sampler", daemon=True)
+    sampler.start()
+    try:
+        yield usage
+    finally:
+        stopping.set()
+        sampler.join()
+        usage["peak_rss_kb"] = max(usage["peak_rss_kb"], _current_rss_kb())
+        usage["rss_growth_kb"] = usage["peak_rss_kb"] - started
+
+
+def _chunks(total, size=SEED_BATCH_SIZE):
+    for start in range(0, total, size):
+        yield range(start, min(start + size, total))
+
+
+@contextmanager
+def throwaway_databases():
+    # seed() and time_sync() insert and delete rows, so runs get migrated copies in a temp directory.
+    with tempfile.TemporaryDirectory(prefix="inclinic-bench-") as directory:
+        for alias in connections:
+            connections[alias].settings_dict["TEST"]["NAME"] = os.path.join(directory, f"{alias}.sqlite3")
+        old_config = setup_databases(verbosity=0, interactive=False, serialized_aliases=set())
+        try:
+            yield directory
+        finally:
+            # Buffered beacons must land before the databases go, not at exit in the configured ones.
+            get_buffer().stop()
+            teardown_databases(old_config, verbosity=0)
+
+
+def seed(campaigns=2, reps_per_campaign=10, doctors=1000, shares=10000, events=100000, rng=None):
+    rng = rng or random.Random(0)
+    today = timezone.now().date()
+    run = uuid.uuid4().hex[:6]
+    cycles = []
+    for number in range(campaigns):
+        campaign = Campaign.objects.create(
+            name=f"Bench {run}-{number}", brand_name="Bench", start_date=today - timedelta(days=60),
+            end_date=today + timedelta(days=60), banner_top_url="https://example.com/top.png",
+        )
+        cycles.append(CampaignCycle.objects.create(
+            campaign=campaign, cycle_number=1, start_date=today - timedelta(days=30), end_date=today + timedelta(days=30),
+            title="Bench cycle", message_template="Please review", reminder_template="Reminder",
+            pdf_url="https://example.com/bench.pdf", video_vimeo_url="https://player.vimeo.com/video/1",
+        ))
+        FieldRepresentative.objects.bulk_create([
+            FieldRepresentative(campaign=campaign, name=f"Rep {i}", email=f"rep{i}@example.com", whatsapp_number=f"7{i:011d}")
+            for i in range(reps_per_campaign)
+        ])
+    reps = list(FieldRepresentative.objects.filter(campaign__in=[c.campaign_id for c in cycles]))
+    cycle_by_campaign = {cycle.campaign_id: cycle for cycle in cycles}
+
+    for chunk in _chunks(doctors):
+        Doctor.objects.bulk_create(
+            [Doctor(whatsapp_number=f"9{run}{i:08d}") for i in chunk], ignore_conflicts=True
+        )
+    doctor_ids = list(Doctor.objects.filter(whatsapp_number__startswith=f"9{run}").values_list("id", flat=True))
+
+    for chunk in _chunks(shares):
+        batch = []
+        for _ in chunk:
+            rep = rng.choice(reps)
+            batch.append(ShareRecord(
+                campaign_id=rep.campaign_id, cycle=cycle_by_campaign[rep.campaign_id], field_rep=rep,
+                doctor_id=rng.choice(doctor_ids), whatsapp_message="Please review",
+            ))
+        ShareRecord.objects.bulk_create(batch)
+    share_rows = [
+        (share.id, share.doctor_id, share.token, share.field_rep_id)
+        for share in ShareRecord.objects.filter(campaign__in=cycle_by_campaign).only("id", "doctor_id", "legacy_token", "public_id", "field_rep_id")
+    ]
+
+    event_types = [choice for choice, _ in ActivityEvent.EVENT_CHOICES]
+    for chunk in _chunks(events):
+        batch = []
+        for _ in chunk:
+            share_id, doctor_id, _, _ = rng.choice(share_rows)
+            batch.append(ActivityEvent(
+                share_id=share_id, doctor_id=doctor_id, event_type=rng.choice(event_types), value=rng.randint(1, 100)
+            ))
+        ActivityEvent.objects.bulk_create(batch)
+    return {"shares": share_rows, "reps": [rep.id for rep in reps]}
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def drive(request_factory, requests=1000, concurrency=8):
+    local = threading.local()
+
+    def one(index):
+        if not hasattr(local, "client"):
+            local.client = Client()
+        counter = _QueryCounter()
+        with connections["default"].execute_wrapper(counter), connections["reporting"].execute_wrapper(counter):
+            started = time.perf_counter()
+            response = request_factory(local.client, index)
+            elapsed = time.perf_counter() - started
+        return elapsed, counter.count, response.status_code
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        samples = [one(index) for index in range(requests)]
+    else:
+        # Worker threads get their own DB connections, which are dropped with the threads.
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(one, range(requests)))
+    summary = _summarize(samples, time.perf_counter() - started, concurrency)
+    summary["queries_per_request"] = round(statistics.fmean(count for _, count, _ in samples), 2)
+    return summary
+
+
+def drive_async(request_factory, requests=1000, concurrency=8):
+    # Runs through Django's ASGI handler; up to `concurrency` requests are in flight on one event loop.
+    async def run():
+        client, gate = AsyncClient(), asyncio.Semaphore(concurrency)
+
+        async def one(index):
+            async with gate:
+                started = time.perf_counter()
+                response = await request_factory(client, index)
+                return time.perf_counter() - started, 0, response.status_code
+
+        started = time.perf_counter()
+        samples = await asyncio.gather(*(one(index) for index in range(requests)))
+        return samples, time.perf_counter() - started
+
+    # Requests overlap on the loop, so queries are averaged from the request metrics' per-alias counts.
+    queries = sum(registry.db_queries.values())
+    samples, wall = async_to_sync(run)()
+    summary = _summarize(samples, wall, concurrency)
+    summary["queries_per_request"] = round((sum(registry.db_queries.values()) - queries) / len(samples), 2)
+    return summary
+
+
+def _summarize(samples, wall, concurrency):
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+    return {
+        "requests": len(samples),
+        "concurrency": concurrency,
+        "errors": sum(1 for _, _, status in samples if status >= 400),
+        "rps": round(len(samples) / wall, 1) if wall else 0.0,
+        "p50_ms": round(_percentile(latencies, 0.50), 3),
+        "p95_ms": round(_percentile(latencies, 0.95), 3),
+        "p99_ms": round(_percentile(latencies, 0.99), 3),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+    }
+
+
+def endpoint_scenarios(dataset):
+    shares, reps = dataset["shares"], dataset["reps"]
+    return {
+        "doctor_verify": lambda client, i: client.get(reverse("doctor_verify", args=[shares[i % len(shares)][2]])),
+        "doctor_landing": lambda client, i: client.get(reverse("doctor_landing", args=[shares[i % len(shares)][2]])),
+        "track_activity": lambda client, i: client.post(
+            reverse("track_activity", args=[shares[i % len(shares)][0], "video_progress"]), {"value": i % 100}
+        ),
+        "doctor_status_list": lambda client, i: client.get(reverse("doctor_status_list"), {"rep_id": reps[i % len(reps)]}),
+    }
+
+
+def time_sync(batch_size=5000):
+    events = ActivityEvent.objects.count()
+    started = time.perf_counter()
+    result = sync_events(batch_size=batch_size)
+    seconds = time.perf_counter() - started
+    return {
+        "events": result.moved,
+        "seconds": round(seconds, 3),
+        "seconds_per_100k": round(seconds * 100000 / events, 3) if events else 0.0,
+    }
+
+
+def run_benchmarks(dataset, requests=1000, concurrency=8, sync_batch_size=5000, only=None, servers=("wsgi",)):
+    results = {}
+    for server in servers:
+        for name, factory in endpoint_scenarios(dataset).items():
+            if only and name not in only:
+                continue
+            runner = drive if server == "wsgi" else drive_async
+            with rss_watch() as rss:
+                result = runner(factory, requests=requests, concurrency=concurrency)
+            # WSGI keys stay unsuffixed so older baselines still compare.
+            results[name if server == "wsgi" else f"{name}[{server}]"] = dict(result, **rss)
+    if not only or "sync_reporting" in only:
+        with rss_watch() as rss:
+            result = time_sync(sync_batch_size)
+        results["sync_reporting"] = dict(result, **rss)
+    return results
+
+
+def compare(baseline, current, tolerance=0.2):
+    regressions = []
+    for name, metrics in baseline.get("results", {}).items():
+        for metric in LOWER_IS_BETTER:
+            if metric not in metrics or metric not in current.get("results", {}).get(name, {}):
+                continue
+            before, after = metrics[metric], current["results"][name][metric]
+            if after > before * (1 + tolerance):
+                regressions.append(f"{name}.{metric}: {before} -> {after}")
+    return regressions
+
+
+def load_baseline(path):
+    with open(path) as handle:
+        return json.load(handle)
@@ -0,0 +1,78 @@
+from collections import Counter
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from .models import CampaignCounters, CycleCounters, FieldRepCounters, ShareRecord
+
+# (counter model, ShareRecord column, lookup from the counter row to its campaign)
+SCOPES = (
+    (CampaignCounters, "campaign_id", "campaign_id"),
+    (CycleCounters, "cycle_id", "cycle__campaign_id"),
+    (FieldRepCounters, "field_rep_id", "field_rep__campaign_id"),
+)
+COUNTER_FIELDS = ("shares_sent", "shares_read", "reminders_sent", "doctors_verified")
+TOTALS = {
+    "shares_sent": Count("id", filter=Q(is_reminder=False)),
+    "shares_read": Count("id", filter=Q(status=ShareRecord.STATUS_READ)),
+    "reminders_sent": Count("id", filter=Q(is_reminder=True)),
+    "doctors_verified": Count("id", filter=Q(verified_at__isnull=False)),
+}
+RECONCILE_BATCH_SIZE = 1000
+
+
+def share_key(share):
+    return share.campaign_id, share.cycle_id, share.field_rep_id
+
+
+def _increments(keys):
+    totals = [Counter() for _ in SCOPES]
+    for key in keys:
+        for total, scope_id in zip(totals, key):
+            total[scope_id] += 1
+    # Rows are always locked campaign, cycle, rep and then by id, so concurrent bumps cannot deadlock.
+    return [(model, sorted(total.items())) for (model, _, _), total in zip(SCOPES, totals)]
+
+
+def _create(model, pk, field, amount):
+    try:
+        with transaction.atomic():
+            model.objects.create(pk=pk, **{field: amount})
+    except IntegrityError:
+        model.objects.filter(pk=pk).update(**{field: F(field) + amount})
+
+
+def bump(field, keys):
+    for model, amounts in _increments(keys):
+        for pk, amount in amounts:
+            if not model.objects.filter(pk=pk).update(**{field: F(field) + amount}):
+                _create(model, pk, field, amount)
+
+
+async def abump(field, keys):
+    for model, amounts in _increments(keys):
+        for pk, amount in amounts:
+            if not await model.objects.filter(pk=pk).aupdate(**{field: F(field) + amount}):
+                await sync_to_async(_create)(model, pk, field, amount)
+
+
+def count_sent(shares):
+    bump("shares_sent", [share_key(s) for s in shares if not s.is_reminder])
+    bump("reminders_sent", [share_key(s) for s in shares if s.is_reminder])
+
+
+def reconcile(campaign_id=None):
+    shares = ShareRecord.objects.all() if campaign_id is None else ShareRecord.objects.filter(campaign_id=campaign_id)
+    corrected = {}
+    for model, column, campaign_lookup in SCOPES:
+        counters = model.objects.all() if campaign_id is None else model.objects.filter(**{campaign_lookup: campaign_id})
+        expected = {row.pop(column): row for row in shares.values(column).annotate(**TOTALS).order_by()}
+        current = {pk: dict(zip(COUNTER_FIELDS, values)) for pk, *values in counters.values_list("pk", *COUNTER_FIELDS)}
+        for pk in current.keys() - expected.keys():
+            expected[pk] = dict.fromkeys(COUNTER_FIELDS, 0)
+        drifted = [model(pk=pk, **values) for pk, values in expected.items() if current.get(pk) != values]
+        model.objects.bulk_create(
+            drifted, batch_size=RECONCILE_BATCH_SIZE,
+            update_conflicts=True, unique_fields=[model._meta.pk.name], update_fields=COUNTER_FIELDS,
+        )
+        corrected[model._meta.verbose_name] = len(drifted)
+    return corrected
@@ -1,20 +1,72 @@
+import random
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+
+_written = ContextVar("written_aliases", default=frozenset())
+_pinned = ContextVar("pinned_aliases", default=frozenset())
+
+
+def read_alias(alias):
+    # Replica reads only until this request (or command) writes to the alias or opens a transaction on it,
+    # and not at all while a recent write by the same client has it pinned.
+    replicas = settings.DATABASE_REPLICAS.get(alias)
+    if not replicas or alias in _written.get() or alias in _pinned.get() or connections[alias].in_atomic_block:
+        return alias
+    return random.choice(replicas)
+
+
+def written_aliases():
+    return _written.get()
+
+
+def mark_written(alias):
+    if alias not in _written.get():
+        _written.set(_written.get() | {alias})
+
+
+def reset_written():
+    return _written.set(frozenset())
+
+
+def restore_written(token):
+    _written.reset(token)
+
+
+def pin_primaries(aliases):
+    return _pinned.set(frozenset(aliases))
+
+
+def unpin_primaries(token):
+    _pinned.reset(token)
+
+
 class TransactionReportingRouter:
     reporting_labels = {"reporting"}
 
+    def _primary(self, model, hints):
+        if model._meta.app_label not in self.reporting_labels:
+            return "default"
+        from reporting.sharding import SHARDED_MODELS, shard_for
+
+        campaign_id = getattr(hints.get("instance"), "campaign_id", None)
+        if model in SHARDED_MODELS and campaign_id is not None:
+            return shard_for(campaign_id)
+        return "reporting"
+
     def db_for_read(self, model, **hints):
-        if model._meta.app_label in self.reporting_labels:
-            return "reporting"
-        return "default"
+        return read_alias(self._primary(model, hints))
 
     def db_for_write(self, model, **hints):
-        if model._meta.app_label in self.reporting_labels:
-            return "reporting"
-        return "default"
+        alias = self._primary(model, hints)
+        mark_written(alias)
+        return alias
 
     def allow_relation(self, obj1, obj2, **hints):
         return True
 
     def allow_migrate(self, db, app_label, model_name=None, **hints):
         if app_label in self.reporting_labels:
-            return db == "reporting"
+            return db in settings.REPORTING_SHARDS
         return db == "default"
+
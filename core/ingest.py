@@ -0,0 +1,327 @@
+import atexit
+import hashlib
+import logging
+import queue
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.utils import timezone
+from .models import ActivityEvent
+
+logger = logging.getLogger(__name__)
+
+DEDUPE_KEY = "beacon:{}:{}:{}"
+PREVIEW_BOT_AGENTS = re.compile(
+    r"whatsapp|facebookexternalhit|facebot|telegrambot|twitterbot|slackbot|linkedinbot|discordbot|skypeuripreview"
+    r"|googlebot|bingbot|applebot|embedly",
+    re.IGNORECASE,
+)
+
+
+class ProgressCoalescer:
+    def __init__(self, event_types, window_seconds=30.0, milestones=(25, 50, 75, 100), memory=100000):
+        self.event_types = frozenset(event_types)
+        self.window_seconds = window_seconds
+        self.milestones = sorted(milestones)
+        self.memory = memory
+        self.coalesced = 0
+        self._pending = {}
+        self._reached = OrderedDict()
+        self._lock = threading.Lock()
+
+    def handles(self, event_type):
+        return event_type in self.event_types
+
+    def add(self, event):
+        key = (event.share_id, event.event_type)
+        with self._lock:
+            reached = self._reached.get(key, 0)
+            crossed = [m for m in self.milestones if reached < m <= event.value]
+            if crossed:
+                self._remember(key, crossed[-1])
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = (event, time.monotonic())
+            else:
+                self.coalesced += 1
+                if event.value > pending[0].value:
+                    pending[0].value = event.value
+                    pending[0].created_at = event.created_at
+        return [_milestone_event(event, milestone) for milestone in crossed]
+
+    def claim(self, events):
+        # Another worker may have seen the same share cross a milestone; the first to claim it in the
+        # shared cache writes the row. Runs at flush time so the request path never waits on the cache.
+        dedupe = _dedupe_cache()
+        claimed = [
+            event for event in events
+            if not getattr(event, "milestone", False) or dedupe.add(
+                DEDUPE_KEY.format(event.share_id, event.event_type, f"milestone-{event.value:g}"),
+                1, settings.ACTIVITY_MILESTONE_SECONDS,
+            )
+        ]
+        with self._lock:
+            self.coalesced += len(events) - len(claimed)
+        return claimed
+
+    def due(self, force=False):
+        cutoff = time.monotonic() - self.window_seconds
+        ready = []
+        with self._lock:
+            # Pending keys are kept in first-seen order, so the scan stops at the first open window.
+            for key, (event, first_seen) in list(self._pending.items()):
+                if not force and first_seen > cutoff:
+                    break
+                del self._pending[key]
+                if event.value > self._reached.get(key, 0):
+                    ready.append(event)
+                else:
+                    self.coalesced += 1
+        return ready
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _remember(self, key, milestone):
+        self._reached[key] = milestone
+        self._reached.move_to_end(key)
+        while len(self._reached) > self.memory:
+            self._reached.popitem(last=False)
+
+
+def _milestone_event(event, milestone):
+    row = ActivityEvent(
+        share_id=event.share_id, doctor_id=event.doctor_id, event_type=event.event_type,
+        value=milestone, created_at=event.created_at,
+    )
+    row.milestone = True
+    return row
+
+
+class ActivityBuffer:
+    def __init__(
+        self, max_events=10000, flush_events=500, flush_seconds=1.0, block_seconds=0.05, coalescer=None, start=True
+    ):
+        self.queue = queue.Queue(maxsize=max_events)
+        self.max_events = max_events
+        self.flush_events = flush_events
+        self.flush_seconds = flush_seconds
+        self.block_seconds = block_seconds
+        self.coalescer = coalescer
+        self.autostart = start
+        self.enqueued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def record(self, share_id, doctor_id, event_type, value=1, block=True):
+        if self.autostart:
+            self._ensure_worker()
+        event = ActivityEvent(
+            share_id=share_id, doctor_id=doctor_id, event_type=event_type, value=value, created_at=timezone.now()
+        )
+        if self.coalescer is not None and self.coalescer.handles(event_type):
+            return all([self._enqueue(milestone, block) for milestone in self.coalescer.add(event)])
+        return self._enqueue(event, block)
+
+    def _enqueue(self, event, block=True):
+        try:
+            # Backpressure: wait briefly for the flusher before shedding the event.
+            # Callers on an event loop pass block=False and shed immediately instead.
+            self.queue.put(event, block=block, timeout=self.block_seconds)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def flush(self, limit=None):
+        batch = self.coalescer.due(force=True) if self.coalescer is not None else []
+        limit = limit or self.max_events
+        while len(batch) < limit:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        self._write(batch)
+        return len(batch)
+
+    def _write(self, batch):
+        if self.coalescer is not None:
+            batch = self.coalescer.claim(batch)
+        if not batch:
+            return
+        started = time.monotonic()
+        with self._flush_lock:
+            try:
+                ActivityEvent.objects.bulk_create(batch, batch_size=self.flush_events)
+                failed = 0
+            except Exception:
+                logger.exception("Flush of %s buffered activity events failed; retrying row by row", len(batch))
+                close_old_connections()
+                failed = self._write_rows(batch)
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            self.flushes += 1
+            self.flushed += len(batch) - failed
+            self.failed += failed
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+
+    def _write_rows(self, batch):
+        # Isolates the rows that broke the multi-row INSERT so the rest of the batch still lands.
+        failed = 0
+        for event in batch:
+            event.pk = None
+            try:
+                event.save(force_insert=True)
+            except Exception:
+                logger.exception("Dropping buffered activity event %s/%s", event.share_id, event.event_type)
+                close_old_connections()
+                failed += 1
+        return failed
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="activity-buffer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self.coalescer.due() if self.coalescer is not None else []
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.flush_events:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if not batch:
+                continue
+            # The flusher can sit idle past MySQL's wait_timeout, so recycle its connection around every write.
+            close_old_connections()
+            try:
+                self._write(batch)
+            finally:
+                close_old_connections()
+        close_old_connections()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        while self.flush():
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "max_events": self.max_events,
+                "enqueued": self.enqueued,
+                "flushed": self.flushed,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "flushes": self.flushes,
+                "last_flush_ms": round(self.last_flush_ms, 3),
+                "max_flush_ms": round(self.max_flush_ms, 3),
+                "coalesced": self.coalescer.coalesced if self.coalescer is not None else 0,
+                "coalesce_pending": self.coalescer.pending() if self.coalescer is not None else 0,
+            }
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                coalescer = None
+                if settings.ACTIVITY_COALESCE_EVENTS:
+                    coalescer = ProgressCoalescer(
+                        settings.ACTIVITY_COALESCE_EVENTS,
+                        window_seconds=settings.ACTIVITY_COALESCE_SECONDS,
+                        milestones=settings.ACTIVITY_PROGRESS_MILESTONES,
+                    )
+                _buffer = ActivityBuffer(
+                    max_events=settings.ACTIVITY_BUFFER_MAX_EVENTS,
+                    flush_events=settings.ACTIVITY_BUFFER_FLUSH_EVENTS,
+                    flush_seconds=settings.ACTIVITY_BUFFER_FLUSH_SECONDS,
+                    block_seconds=settings.ACTIVITY_BUFFER_BLOCK_SECONDS,
+                    coalescer=coalescer,
+                )
+                atexit.register(_buffer.stop)
+    return _buffer
+
+
+_suppressed = Counter()
+_suppressed_lock = threading.Lock()
+
+
+def is_preview_bot(user_agent):
+    return bool(user_agent) and PREVIEW_BOT_AGENTS.search(user_agent) is not None
+
+
+def suppression_stats():
+    with _suppressed_lock:
+        return {"preview_bots": _suppressed["preview_bots"], "duplicates": _suppressed["duplicates"]}
+
+
+def _suppress(reason):
+    with _suppressed_lock:
+        _suppressed[reason] += 1
+    return True
+
+
+def _dedupe_cache():
+    # The shared tier catches retries that land on another worker; without it duplicates are caught per worker.
+    return caches["shared" if "shared" in settings.CACHES else "dedupe"]
+
+
+def _dedupe_key(share_id, event_type, idempotency_key):
+    if idempotency_key:
+        digest = hashlib.md5(idempotency_key.encode()).hexdigest()
+        return DEDUPE_KEY.format(share_id, event_type, digest), settings.ACTIVITY_IDEMPOTENCY_SECONDS
+    if event_type not in settings.ACTIVITY_DEDUPE_EVENTS:
+        return None, None
+    window = settings.ACTIVITY_DEDUPE_SECONDS
+    return DEDUPE_KEY.format(share_id, event_type, int(time.time() // window)), window
+
+
+async def arecord_activity(share_id, doctor_id, event_type, value=1, idempotency_key=None, user_agent=None):
+    if is_preview_bot(user_agent):
+        return _suppress("preview_bots")
+    key, ttl = _dedupe_key(share_id, event_type, idempotency_key)
+    if key is not None and not await _dedupe_cache().aadd(key, 1, ttl):
+        return _suppress("duplicates")
+    if not settings.ACTIVITY_BUFFER_ENABLED:
+        await ActivityEvent.objects.acreate(share_id=share_id, doctor_id=doctor_id, event_type=event_type, value=value)
+        return True
+    recorded = get_buffer().record(share_id, doctor_id, event_type, value, block=False)
+    if not recorded and key is not None:
+        await _dedupe_cache().adelete(key)
+    return recorded
@@ -0,0 +1,48 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from core.benchmark import compare, load_baseline, run_benchmarks, seed, throwaway_databases
+
+
+class Command(BaseCommand):
+    help = "Seed a synthetic dataset into throwaway SQLite databases and benchmark doctor, rep and sync paths"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--campaigns", type=int, default=2)
+        parser.add_argument("--reps", type=int, default=10, help="Field reps per campaign")
+        parser.add_argument("--doctors", type=int, default=1000)
+        parser.add_argument("--shares", type=int, default=10000)
+        parser.add_argument("--events", type=int, default=100000)
+        parser.add_argument("--requests", type=int, default=1000, help="Requests per endpoint")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--server", choices=("wsgi", "asgi", "both"), default="wsgi", help="Request handler(s) to drive")
+        parser.add_argument("--only", nargs="*", help="Scenario names to run (default: all)")
+        parser.add_argument("--output", help="Write results as a JSON baseline to this path")
+        parser.add_argument("--compare", help="Fail if results regress against this JSON baseline")
+        parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (0.2 = 20%%)")
+
+    def handle(self, *args, **options):
+        if any(connections[alias].vendor != "sqlite" for alias in ("default", "reporting")):
+            raise CommandError("Benchmarks seed synthetic data; run them with USE_SQLITE=1.")
+        config = {
+            key: options[key] for key in ("campaigns", "reps", "doctors", "shares", "events", "requests", "concurrency", "server")
+        }
+        with throwaway_databases():
+            dataset = seed(
+                campaigns=options["campaigns"], reps_per_campaign=options["reps"], doctors=options["doctors"],
+                shares=options["shares"], events=options["events"],
+            )
+            results = run_benchmarks(
+                dataset, requests=options["requests"], concurrency=options["concurrency"], only=options["only"],
+                servers=("wsgi", "asgi") if options["server"] == "both" else (options["server"],),
+            )
+        report = {"config": config, "results": results}
+        self.stdout.write(json.dumps(report, indent=2))
+        if options["output"]:
+            with open(options["output"], "w") as handle:
+                json.dump(report, handle, indent=2)
+        if options["compare"]:
+            regressions = compare(load_baseline(options["compare"]), report, options["tolerance"])
+            if regressions:
+                raise CommandError("Benchmark regressions:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against baseline."))
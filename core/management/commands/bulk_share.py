@@ -0,0 +1,39 @@
+import csv
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from core.services import BULK_SHARE_BATCH_SIZE, iter_bulk_shares
+
+
+class Command(BaseCommand):
+    help = "Create share records from a CSV with field_rep_id, cycle_id, doctor_whatsapp[, is_reminder] columns"
+
+    def add_arguments(self, parser):
+        parser.add_argument("csv_path", help="CSV file path, or - for stdin")
+        parser.add_argument("--batch-size", type=int, default=BULK_SHARE_BATCH_SIZE, help="Rows written per batch")
+
+    def handle(self, *args, **options):
+        stream = sys.stdin if options["csv_path"] == "-" else open(options["csv_path"], newline="")
+        try:
+            entries = (
+                dict(row, row=number, is_reminder=row.get("is_reminder", "").strip().lower() in {"1", "true", "yes"})
+                for number, row in enumerate(csv.DictReader(stream), start=1)
+            )
+            writer = csv.writer(self.stdout, lineterminator="\n")
+            writer.writerow(["row", "doctor_whatsapp", "url", "error"])
+            created = failed = 0
+            for result in iter_bulk_shares(
+                entries,
+                lambda token: settings.PUBLIC_BASE_URL + reverse("doctor_verify", args=[token]),
+                batch_size=options["batch_size"],
+            ):
+                writer.writerow([result["row"], result["doctor_whatsapp"], result.get("url", ""), result.get("error", "")])
+                if "error" in result:
+                    failed += 1
+                else:
+                    created += 1
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stderr.write(self.style.SUCCESS(f"Created {created} shares, {failed} rows failed."))
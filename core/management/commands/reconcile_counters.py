@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from core.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = "Recount campaign, cycle and field rep share counters from ShareRecord and fix any drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--campaign", type=int, help="Only reconcile this campaign's counters")
+
+    def handle(self, *args, **options):
+        corrected = reconcile(options["campaign"])
+        for name, count in corrected.items():
+            self.stdout.write(f"{name}: {count} rows corrected")
+        self.stdout.write(self.style.SUCCESS(f"Reconciled counters, {sum(corrected.values())} rows corrected."))
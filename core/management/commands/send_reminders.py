@@ -0,0 +1,45 @@
+import csv
+import json
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.urls import reverse
+from core.profiling import ProfiledCommand
+from core.services import REMINDER_BATCH_SIZE, iter_reminder_batches
+
+
+class Command(ProfiledCommand):
+    help = "Create reminder shares for every share still unread after the reminder delay and print their WhatsApp links"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=REMINDER_BATCH_SIZE, help="Due shares processed per batch")
+        parser.add_argument(
+            "--lookback-days", type=int, default=30,
+            help="Only consider shares that became due within this many days (0 = no limit)",
+        )
+        parser.add_argument(
+            "--format", choices=["csv", "json"], default="csv",
+            help="csv: one link per row; json: one line per field rep batch",
+        )
+
+    def handle(self, *args, **options):
+        lookback = timedelta(days=options["lookback_days"]) if options["lookback_days"] else None
+        batches = iter_reminder_batches(
+            lambda token: settings.PUBLIC_BASE_URL + reverse("doctor_verify", args=[token]),
+            lookback=lookback,
+            chunk_size=options["batch_size"],
+        )
+        writer = None
+        if options["format"] == "csv":
+            writer = csv.writer(self.stdout, lineterminator="\n")
+            writer.writerow(["field_rep_id", "doctor_whatsapp", "url"])
+        per_rep = Counter()
+        for rep_id, links in batches:
+            per_rep[rep_id] += len(links)
+            if writer is None:
+                self.stdout.write(json.dumps({"field_rep_id": rep_id, "links": links}))
+            else:
+                writer.writerows([rep_id, link["doctor_whatsapp"], link["url"]] for link in links)
+        for rep_id, count in sorted(per_rep.items()):
+            self.stderr.write(f"Field rep {rep_id}: {count} reminders")
+        self.stderr.write(self.style.SUCCESS(f"Created {sum(per_rep.values())} reminders for {len(per_rep)} field reps."))
@@ -1,29 +1,63 @@
-from django.core.management.base import BaseCommand
-from django.db import transaction
-from core.models import ActivityEvent
-from reporting.models import ActivityEventReport
+import signal
+import threading
+from core.profiling import ProfiledCommand
+from core.sync import (
+    DEFAULT_BATCH_SIZE, FOLLOW_BATCH_SIZE, SyncLocked, follow_events, replication_lag, sync_events, sync_lock,
+    sync_partitioned,
+)
 
 
-class Command(BaseCommand):
+class Command(ProfiledCommand):
     help = "Move activity events from transaction DB to reporting DB"
 
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, help=f"Events copied per batch (default {DEFAULT_BATCH_SIZE}, {FOLLOW_BATCH_SIZE} with --follow)")
+        parser.add_argument("--max-runtime", type=int, default=0, help="Stop after this many seconds (0 = no limit)")
+        parser.add_argument("--workers", type=int, default=0, help="Copy disjoint id ranges in this many processes")
+        parser.add_argument("--follow", action="store_true", help="Keep tailing new events until SIGTERM")
+        parser.add_argument("--poll-min", type=float, default=0.5, help="Seconds between polls after new events (--follow)")
+        parser.add_argument("--poll-max", type=float, default=10.0, help="Longest idle poll interval in seconds (--follow)")
+
     def handle(self, *args, **options):
-        events = list(ActivityEvent.objects.using("default").all())
-        moved = 0
-        for event in events:
-            with transaction.atomic(using="reporting"):
-                ActivityEventReport.objects.using("reporting").get_or_create(
-                    source_event_id=event.id,
-                    defaults={
-                        "campaign_id": event.share.campaign_id,
-                        "cycle_id": event.share.cycle_id,
-                        "field_rep_id": event.share.field_rep_id,
-                        "doctor_id": event.doctor_id,
-                        "event_type": event.event_type,
-                        "value": event.value,
-                        "occurred_at": event.created_at,
-                    },
-                )
-            moved += 1
-        ActivityEvent.objects.using("default").all().delete()
-        self.stdout.write(self.style.SUCCESS(f"Moved {moved} events to reporting database."))
+        try:
+            with sync_lock():
+                if options["follow"]:
+                    result = self.follow(options)
+                elif options["workers"]:
+                    result = sync_partitioned(
+                        options["workers"], batch_size=options["batch_size"] or DEFAULT_BATCH_SIZE,
+                        max_runtime=options["max_runtime"] or None,
+                    )
+                else:
+                    result = sync_events(
+                        batch_size=options["batch_size"] or DEFAULT_BATCH_SIZE, max_runtime=options["max_runtime"] or None
+                    )
+        except SyncLocked as exc:
+            self.stdout.write(self.style.WARNING(f"Another sync_reporting run holds {exc}; exiting."))
+            return
+        for number, partition in enumerate(result.partitions, start=1):
+            rate = round(partition.moved / partition.seconds) if partition.seconds else partition.moved
+            self.stdout.write(
+                f"Partition {number} ids {partition.lower_id + 1}-{partition.upper_id}: moved {partition.moved} "
+                f"in {partition.batches} batches, {partition.seconds}s ({rate}/s)"
+                + (f", stopped after {partition.cursor}" if partition.timed_out else "")
+            )
+        if result.timed_out:
+            self.stdout.write(self.style.WARNING(f"Max runtime reached; resuming after event {result.last_event_id} next run."))
+        self.stdout.write(self.style.SUCCESS(f"Moved {result.moved} events to reporting database."))
+
+    def follow(self, options):
+        stop = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            # The batch in flight commits before the loop sees the flag.
+            signal.signal(signum, lambda *_: stop.set())
+
+        def on_batch(moved, last_event_id):
+            self.stdout.write(f"Moved {moved} events up to {last_event_id}; lag {replication_lag():.1f}s")
+            self.stdout.flush()
+
+        self.stdout.write(f"Following activity events (lag {replication_lag():.1f}s).")
+        return follow_events(
+            stop, batch_size=options["batch_size"] or FOLLOW_BATCH_SIZE, min_interval=options["poll_min"],
+            max_interval=options["poll_max"], on_batch=on_batch,
+        )
@@ -0,0 +1,192 @@
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def worker_identity():
+    # Resolved per call so workers forked from a preloaded master report their own pid.
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+_IN_LIST = re.compile(r"IN \((?:%s|\?)(?:, (?:%s|\?))*\)")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def normalize_sql(sql):
+    sql = sql.replace("%s", "?")
+    sql = _LITERALS.sub("?", sql)
+    return _IN_LIST.sub("IN (...)", " ".join(sql.split()))
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.total += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    def __init__(self, slow_query_capacity=100):
+        self.lock = threading.Lock()
+        self.latency = defaultdict(Histogram)
+        self.responses = defaultdict(int)
+        self.db_queries = defaultdict(int)
+        self.db_seconds = defaultdict(float)
+        self.slow_query_count = defaultdict(int)
+        self.slow_queries = deque(maxlen=slow_query_capacity)
+        self.collectors = []
+        self.snapshot_at = 0.0
+
+    def observe_request(self, view, status, seconds, db_usage):
+        with self.lock:
+            self.latency[view].observe(seconds)
+            self.responses[(view, f"{status // 100}xx")] += 1
+            for alias, (count, db_seconds) in db_usage.items():
+                self.db_queries[(view, alias)] += count
+                self.db_seconds[(view, alias)] += db_seconds
+
+    def observe_slow_query(self, view, alias, sql, seconds):
+        with self.lock:
+            self.slow_query_count[alias] += 1
+            self.slow_queries.append({
+                "view": view,
+                "alias": alias,
+                "sql": normalize_sql(sql),
+                "ms": round(seconds * 1000, 3),
+                "at": time.time(),
+                "worker": worker_identity(),
+            })
+
+    def slow_query_log(self):
+        with self.lock:
+            return list(self.slow_queries)
+
+    def collect(self):
+        # (name, type, help, samples) for this process; every sample carries its worker label.
+        worker = worker_identity()
+        families = []
+
+        def family(name, kind, help_text, samples):
+            families.append((name, kind, help_text, [(suffix, dict(labels, worker=worker), value) for suffix, labels, value in samples]))
+
+        with self.lock:
+            latency = []
+            for view, histogram in sorted(self.latency.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    latency.append(("_bucket", {"view": view, "le": bound}, cumulative))
+                latency.append(("_bucket", {"view": view, "le": "+Inf"}, histogram.total))
+                latency.append(("_sum", {"view": view}, round(histogram.sum, 6)))
+                latency.append(("_count", {"view": view}, histogram.total))
+            family("inclinic_request_duration_seconds", "histogram", "Request latency by URL name", latency)
+            family("inclinic_responses_total", "counter", "Responses by URL name and status class",
+                   [("", {"view": view, "status": status}, n) for (view, status), n in sorted(self.responses.items())])
+            family("inclinic_db_queries_total", "counter", "DB queries by URL name and database alias",
+                   [("", {"view": view, "alias": alias}, n) for (view, alias), n in sorted(self.db_queries.items())])
+            family("inclinic_db_query_seconds_total", "counter", "DB time by URL name and database alias",
+                   [("", {"view": view, "alias": alias}, round(t, 6)) for (view, alias), t in sorted(self.db_seconds.items())])
+            family("inclinic_slow_queries_total", "counter", "Queries slower than SLOW_QUERY_MS by database alias",
+                   [("", {"alias": alias}, n) for alias, n in sorted(self.slow_query_count.items())])
+        for collector in self.collectors:
+            for name, kind, help_text, value in collector():
+                family(name, kind, help_text, [("", {}, value)])
+        return families
+
+    def write_snapshot(self, directory):
+        # Atomic replace, so a concurrent reader sees either the old or the new file.
+        self.snapshot_at = time.monotonic()
+        path = os.path.join(directory, f"{worker_identity()}.json")
+        with open(path + ".tmp", "w") as handle:
+            json.dump({"families": self.collect(), "slow_queries": self.slow_query_log()}, handle)
+        os.replace(path + ".tmp", path)
+
+    def maybe_snapshot(self, directory, interval):
+        if not directory or time.monotonic() - self.snapshot_at < interval:
+            return
+        try:
+            self.write_snapshot(directory)
+        except OSError:
+            logger.exception("Could not write a metrics snapshot to %s", directory)
+
+    def gather(self, directory):
+        # Without a shared snapshot directory only this process is visible.
+        if not directory:
+            return self.collect(), self.slow_query_log()
+        self.write_snapshot(directory)
+        families, slow = [], []
+        for snapshot in _read_snapshots(directory):
+            families.extend(snapshot["families"])
+            slow.extend(snapshot["slow_queries"])
+        return families, sorted(slow, key=lambda entry: entry["at"])[-self.slow_queries.maxlen:]
+
+
+def _alive(worker):
+    host, _, pid = worker.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        pass
+    return True
+
+
+def _read_snapshots(directory):
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(directory, name)
+        if not _alive(name[:-len(".json")]):
+            # Series of a worker that exited vanish with it, as on any restart.
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(path) as handle:
+                yield json.load(handle)
+        except (FileNotFoundError, ValueError):
+            continue
+
+
+def render_text(families):
+    merged = {}
+    for name, kind, help_text, samples in families:
+        merged.setdefault(name, (kind, help_text, []))[2].extend(samples)
+    lines = []
+    for name, (kind, help_text, samples) in merged.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            rendered = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+            lines.append(f"{name}{suffix}{{{rendered}}} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
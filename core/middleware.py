@@ -0,0 +1,143 @@
+import logging
+import time
+from contextlib import ExitStack, asynccontextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from .db_router import pin_primaries, reset_written, restore_written, unpin_primaries, written_aliases
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class _QueryTimer:
+    def __init__(self, alias, request):
+        self.alias = alias
+        self.request = request
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if elapsed * 1000 >= settings.SLOW_QUERY_MS:
+                view = _view_name(self.request)
+                registry.observe_slow_query(view, self.alias, sql, elapsed)
+                logger.warning("Slow query on %s in %s (%.1f ms)", self.alias, view, elapsed * 1000)
+
+
+def _enter_wrappers(stack, wrappers):
+    for alias, wrapper in wrappers:
+        stack.enter_context(connections[alias].execute_wrapper(wrapper))
+
+
+@asynccontextmanager
+async def executor_wrappers(wrappers):
+    # The async ORM runs a request's queries on its thread-sensitive executor thread, which holds its own
+    # connections, so the wrappers are installed and removed from that thread rather than the event loop.
+    stack = ExitStack()
+    await sync_to_async(_enter_wrappers)(stack, wrappers)
+    try:
+        yield
+    finally:
+        await sync_to_async(stack.close)()
+
+
+def _view_name(request):
+    match = getattr(request, "resolver_match", None)
+    return (match.url_name or match.view_name) if match else "unresolved"
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.REQUEST_METRICS_ENABLED:
+            return self.get_response(request)
+        timers = [_QueryTimer(alias, request) for alias in settings.DATABASES]
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            _enter_wrappers(stack, [(timer.alias, timer) for timer in timers])
+            response = self.get_response(request)
+        registry.observe_request(
+            _view_name(request),
+            response.status_code,
+            time.perf_counter() - started,
+            {timer.alias: (timer.count, timer.seconds) for timer in timers if timer.count},
+        )
+        registry.maybe_snapshot(settings.METRICS_DIR, settings.METRICS_SNAPSHOT_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.REQUEST_METRICS_ENABLED:
+            return await self.get_response(request)
+        timers = [_QueryTimer(alias, request) for alias in settings.DATABASES]
+        started = time.perf_counter()
+        async with executor_wrappers([(timer.alias, timer) for timer in timers]):
+            response = await self.get_response(request)
+        registry.observe_request(
+            _view_name(request),
+            response.status_code,
+            time.perf_counter() - started,
+            {timer.alias: (timer.count, timer.seconds) for timer in timers if timer.count},
+        )
+        registry.maybe_snapshot(settings.METRICS_DIR, settings.METRICS_SNAPSHOT_SECONDS)
+        return response
+
+
+class ReadYourWritesMiddleware:
+    # A write pins the alias to its primary for the rest of the request and, through a cookie, for the client's
+    # requests in the next REPLICA_STICKY_SECONDS, so the page after a form post does not miss its own write.
+    sync_capable = True
+    async_capable = True
+    cookie_name = "db_pinned"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        tokens = self._begin(request)
+        try:
+            return self._pin(self.get_response(request))
+        finally:
+            self._end(tokens)
+
+    async def __acall__(self, request):
+        tokens = self._begin(request)
+        try:
+            return self._pin(await self.get_response(request))
+        finally:
+            self._end(tokens)
+
+    def _begin(self, request):
+        pinned = request.COOKIES.get(self.cookie_name, "").split(",")
+        return reset_written(), pin_primaries(alias for alias in pinned if settings.DATABASE_REPLICAS.get(alias))
+
+    def _pin(self, response):
+        written = sorted(alias for alias in written_aliases() if settings.DATABASE_REPLICAS.get(alias))
+        if written and settings.REPLICA_STICKY_SECONDS:
+            response.set_cookie(
+                self.cookie_name, ",".join(written), max_age=settings.REPLICA_STICKY_SECONDS, httponly=True, samesite="Lax"
+            )
+        return response
+
+    def _end(self, tokens):
+        restore_written(tokens[0])
+        unpin_primaries(tokens[1])
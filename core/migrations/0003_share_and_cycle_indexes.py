@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [("core", "0002_activityevent_created_at_default")]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='campaigncycle',
+            index=models.Index(fields=['campaign', 'start_date', 'end_date'], name='cycle_campaign_dates_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sharerecord',
+            index=models.Index(fields=['field_rep', 'shared_at'], name='share_rep_shared_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sharerecord',
+            index=models.Index(fields=['status', 'shared_at'], name='share_status_shared_idx'),
+        ),
+    ]
@@ -0,0 +1,14 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [("core", "0003_share_and_cycle_indexes")]
+
+    operations = [
+        migrations.AddField(
+            model_name='sharerecord',
+            name='reminder_of',
+            field=models.OneToOneField(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reminder', to='core.sharerecord'),
+        ),
+    ]
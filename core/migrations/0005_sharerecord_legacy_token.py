@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [("core", "0004_sharerecord_reminder_of")]
+
+    operations = [
+        # Renamed in state only: the column stays "token" so existing links resolve without a table rewrite.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RenameField(model_name='sharerecord', old_name='token', new_name='legacy_token'),
+                migrations.AlterField(
+                    model_name='sharerecord',
+                    name='legacy_token',
+                    field=models.CharField(db_column='token', editable=False, max_length=64, unique=True),
+                ),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='sharerecord',
+            name='legacy_token',
+            field=models.CharField(db_column='token', editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def counter_fields():
+    return [
+        ('shares_sent', models.BigIntegerField(default=0)),
+        ('shares_read', models.BigIntegerField(default=0)),
+        ('reminders_sent', models.BigIntegerField(default=0)),
+        ('doctors_verified', models.BigIntegerField(default=0)),
+    ]
+
+
+class Migration(migrations.Migration):
+    dependencies = [("core", "0005_sharerecord_legacy_token")]
+
+    operations = [
+        migrations.AddField(
+            model_name='sharerecord',
+            name='verified_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='CampaignCounters',
+            fields=counter_fields() + [
+                ('campaign', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counters', serialize=False, to='core.campaign')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CycleCounters',
+            fields=counter_fields() + [
+                ('cycle', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counters', serialize=False, to='core.campaigncycle')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FieldRepCounters',
+            fields=counter_fields() + [
+                ('field_rep', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counters', serialize=False, to='core.fieldrepresentative')),
+            ],
+        ),
+    ]
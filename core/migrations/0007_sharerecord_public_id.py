@@ -0,0 +1,21 @@
+from django.db import migrations, models
+import core.tokens
+
+
+class Migration(migrations.Migration):
+    dependencies = [("core", "0006_share_counters")]
+
+    operations = [
+        # Added without the default so existing rows stay NULL and keep their id-based tokens; a callable
+        # default on AddField would be evaluated once and give every existing row the same value.
+        migrations.AddField(
+            model_name='sharerecord',
+            name='public_id',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='sharerecord',
+            name='public_id',
+            field=models.BigIntegerField(default=core.tokens.new_public_id, editable=False, null=True, unique=True),
+        ),
+    ]
@@ -2,6 +2,7 @@ from datetime import timedelta
 import uuid
 from django.db import models
 from django.utils import timezone
+from .tokens import make_public_token, make_token, new_public_id
 
 
 class Campaign(models.Model):
@@ -16,6 +17,7 @@ class Campaign(models.Model):
     banner_bottom_url = models.URLField(blank=True)
     banner_bottom_target = models.URLField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
         if not self.campaign_id:
@@ -45,9 +47,11 @@ class CampaignCycle(models.Model):
     reminder_template = models.TextField()
     pdf_url = models.URLField()
     video_vimeo_url = models.URLField()
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ("campaign", "cycle_number")
+        indexes = [models.Index(fields=["campaign", "start_date", "end_date"], name="cycle_campaign_dates_idx")]
 
 
 class Doctor(models.Model):
@@ -56,6 +60,31 @@ class Doctor(models.Model):
     verified_at = models.DateTimeField(null=True, blank=True)
 
 
+REMINDER_AFTER = timedelta(days=6)
+
+
+class ShareRecordQuerySet(models.QuerySet):
+    def with_button_state(self, now=None):
+        cutoff = (now or timezone.now()) - REMINDER_AFTER
+        return self.annotate(state=models.Case(
+            models.When(status=ShareRecord.STATUS_READ, then=models.Value("green")),
+            models.When(shared_at__lte=cutoff, then=models.Value("purple")),
+            default=models.Value("yellow"),
+            output_field=models.CharField(max_length=10),
+        ))
+
+    def in_button_state(self, state, now=None):
+        # Expressed on the raw columns rather than the annotation so the filters stay index-friendly.
+        cutoff = (now or timezone.now()) - REMINDER_AFTER
+        if state == "green":
+            return self.filter(status=ShareRecord.STATUS_READ)
+        if state == "purple":
+            return self.filter(status=ShareRecord.STATUS_SENT, shared_at__lte=cutoff)
+        if state == "yellow":
+            return self.filter(status=ShareRecord.STATUS_SENT, shared_at__gt=cutoff)
+        return self
+
+
 class ShareRecord(models.Model):
     STATUS_SENT = "sent"
     STATUS_READ = "read"
@@ -65,21 +94,39 @@ class ShareRecord(models.Model):
     cycle = models.ForeignKey(CampaignCycle, on_delete=models.CASCADE)
     field_rep = models.ForeignKey(FieldRepresentative, on_delete=models.CASCADE)
     doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE)
-    token = models.CharField(max_length=64, unique=True, editable=False)
+    # uuid tokens issued before signed tokens; new shares leave it NULL and embed their id instead.
+    legacy_token = models.CharField(max_length=64, unique=True, null=True, editable=False, db_column="token")
+    # Embedded in signed tokens; NULL on shares whose signed token embeds the row id.
+    public_id = models.BigIntegerField(unique=True, null=True, default=new_public_id, editable=False)
     whatsapp_message = models.TextField()
     is_reminder = models.BooleanField(default=False)
+    reminder_of = models.OneToOneField(
+        "self", null=True, blank=True, editable=False, on_delete=models.SET_NULL, related_name="reminder"
+    )
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_SENT)
     shared_at = models.DateTimeField(auto_now_add=True)
     read_at = models.DateTimeField(null=True, blank=True)
+    verified_at = models.DateTimeField(null=True, blank=True, editable=False)
 
-    def save(self, *args, **kwargs):
-        if not self.token:
-            self.token = uuid.uuid4().hex
-        super().save(*args, **kwargs)
+    objects = ShareRecordQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["field_rep", "shared_at"], name="share_rep_shared_idx"),
+            models.Index(fields=["status", "shared_at"], name="share_status_shared_idx"),
+        ]
+
+    @property
+    def token(self):
+        if self.legacy_token:
+            return self.legacy_token
+        if self.public_id is not None:
+            return make_public_token(self.public_id)
+        return make_token(self.pk) if self.pk else None
 
     @property
     def reminder_due(self):
-        return self.status == self.STATUS_SENT and timezone.now() >= self.shared_at + timedelta(days=6)
+        return self.status == self.STATUS_SENT and timezone.now() >= self.shared_at + REMINDER_AFTER
 
     @property
     def button_state(self):
@@ -102,4 +149,32 @@ class ActivityEvent(models.Model):
     doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE)
     event_type = models.CharField(max_length=30, choices=EVENT_CHOICES)
     value = models.FloatField(default=1)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+
+class ShareCounters(models.Model):
+    # Denormalized ShareRecord totals, bumped with F() by core.counters and rebuilt by reconcile_counters.
+    shares_sent = models.BigIntegerField(default=0)
+    shares_read = models.BigIntegerField(default=0)
+    reminders_sent = models.BigIntegerField(default=0)
+    doctors_verified = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def read_percent(self):
+        sent = self.shares_sent + self.reminders_sent
+        return round(100 * self.shares_read / sent, 1) if sent else 0
+
+
+class CampaignCounters(ShareCounters):
+    campaign = models.OneToOneField(Campaign, primary_key=True, on_delete=models.CASCADE, related_name="counters")
+
+
+class CycleCounters(ShareCounters):
+    cycle = models.OneToOneField(CampaignCycle, primary_key=True, on_delete=models.CASCADE, related_name="counters")
+
+
+class FieldRepCounters(ShareCounters):
+    field_rep = models.OneToOneField(FieldRepresentative, primary_key=True, on_delete=models.CASCADE, related_name="counters")
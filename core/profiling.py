@@ -0,0 +1,183 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils.crypto import constant_time_compare
+from .metrics import normalize_sql
+from .middleware import executor_wrappers
+
+MAX_STACK_DEPTH = 128
+_capture_lock = threading.Lock()
+
+
+class StackSampler:
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class SqlTimeline:
+    def __init__(self, started):
+        self.started = started
+        self.entries = []
+
+    def wrapper(self, alias):
+        def record(execute, sql, params, many, context):
+            began = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                self.entries.append({
+                    "alias": alias,
+                    "offset_ms": round((began - self.started) * 1000, 3),
+                    "duration_ms": round((time.perf_counter() - began) * 1000, 3),
+                    "sql": normalize_sql(sql),
+                })
+        return record
+
+
+class Capture:
+    def __init__(self, name):
+        self.name = re.sub(r"[^A-Za-z0-9_-]+", "-", name).strip("-")
+        self.path = None
+        self.timeline = None
+
+
+def _write_capture(capture, sampler, timeline, elapsed):
+    directory = Path(settings.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    stem = directory / f"{time.time_ns()}-{capture.name}"
+    stem.with_suffix(".collapsed").write_text(sampler.collapsed())
+    stem.with_suffix(".sql.json").write_text(json.dumps({
+        "name": capture.name,
+        "elapsed_ms": round(elapsed * 1000, 3),
+        "samples": sum(sampler.samples.values()),
+        "queries": timeline.entries,
+    }, indent=1))
+    capture.path = str(stem.with_suffix(".collapsed"))
+    # Bounded ring: keep only the newest captures on disk.
+    collapsed = sorted(directory.glob("*.collapsed"))
+    for stale in collapsed[:-settings.PROFILE_MAX_CAPTURES]:
+        stale.unlink(missing_ok=True)
+        stale.with_suffix(".sql.json").unlink(missing_ok=True)
+
+
+@contextmanager
+def capture(name, wrap_queries=True):
+    result = Capture(name)
+    # One capture per process at a time keeps the overhead bounded on a live worker.
+    if not _capture_lock.acquire(blocking=False):
+        yield result
+        return
+    try:
+        started = time.perf_counter()
+        timeline = SqlTimeline(started)
+        sampler = StackSampler(threading.get_ident(), settings.PROFILE_INTERVAL_MS / 1000)
+        sampler.start()
+        try:
+            result.timeline = timeline
+            with ExitStack() as stack:
+                if wrap_queries:
+                    for alias in settings.DATABASES:
+                        stack.enter_context(connections[alias].execute_wrapper(timeline.wrapper(alias)))
+                yield result
+        finally:
+            sampler.stop()
+            _write_capture(result, sampler, timeline, time.perf_counter() - started)
+    finally:
+        _capture_lock.release()
+
+
+def profile_requested(request):
+    token = settings.PROFILE_TOKEN
+    if not token:
+        return False
+    supplied = request.headers.get("X-Profile") or request.GET.get("__profile") or ""
+    return constant_time_compare(supplied, token)
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not profile_requested(request):
+            return self.get_response(request)
+        with capture(f"request-{request.path}") as result:
+            response = self.get_response(request)
+        if result.path:
+            response["X-Profile-Capture"] = os.path.basename(result.path)
+        return response
+
+    async def __acall__(self, request):
+        if not profile_requested(request):
+            return await self.get_response(request)
+        # Samples the event loop thread; the SQL timeline is recorded on the ORM's executor thread.
+        with capture(f"request-{request.path}", wrap_queries=False) as result:
+            if result.timeline is None:
+                response = await self.get_response(request)
+            else:
+                wrappers = [(alias, result.timeline.wrapper(alias)) for alias in settings.DATABASES]
+                async with executor_wrappers(wrappers):
+                    response = await self.get_response(request)
+        if result.path:
+            response["X-Profile-Capture"] = os.path.basename(result.path)
+        return response
+
+
+class ProfiledCommand(BaseCommand):
+    def create_parser(self, prog_name, subcommand, **kwargs):
+        parser = super().create_parser(prog_name, subcommand, **kwargs)
+        parser.add_argument(
+            "--profile", action="store_true", help="Capture a sampling profile and SQL timeline in PROFILE_DIR"
+        )
+        return parser
+
+    def execute(self, *args, **options):
+        if not options.get("profile"):
+            return super().execute(*args, **options)
+        with capture(f"command-{self.__module__.rsplit('.', 1)[-1]}") as result:
+            output = super().execute(*args, **options)
+        if result.path:
+            self.stderr.write(f"Profile written to {result.path}")
+        return output
@@ -1,14 +1,386 @@
+import hashlib
+import json
+import threading
+from bisect import bisect_right
+from collections import Counter
+from datetime import date, timedelta
+from itertools import groupby
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+from django.template.loader import render_to_string
 from django.utils import timezone
-from .models import CampaignCycle
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+from .counters import count_sent
+from .models import REMINDER_AFTER, CampaignCycle, Doctor, FieldRepresentative, ShareRecord
+from .tokens import share_lookup
+
+BULK_SHARE_BATCH_SIZE = 500
+REMINDER_BATCH_SIZE = 1000
+SHARE_KEY = "share:v2:{}"  # v2 entries carry field_rep_id
+CAMPAIGN_KEY = "share-campaign:v2:{}"  # v2 entries carry updated_at
+CYCLE_KEY = "share-cycle:v2:{}"
+CALENDAR_KEY = "cycle-calendar:{}"
+LANDING_KEY = "landing:{}:{}:{}"
+SHARE_SLOT = "<!--share-slot-->"
+CAMPAIGN_FIELDS = ("banner_top_url", "banner_top_target", "banner_bottom_url", "banner_bottom_target", "updated_at")
+CYCLE_FIELDS = ("title", "pdf_url", "video_vimeo_url", "updated_at")
+
+_stats_lock = threading.Lock()
+_share_cache_stats = {"hits": 0, "misses": 0}
+
+
+class CycleCalendar:
+    def __init__(self, cycles, today):
+        self.cycles = sorted(cycles, key=lambda cycle: (cycle.start_date, cycle.cycle_number))
+        self.starts = [cycle.start_date for cycle in self.cycles]
+        boundaries = [
+            day for cycle in self.cycles for day in (cycle.start_date, cycle.end_date + timedelta(days=1)) if day > today
+        ]
+        self.loaded_on = today
+        self.valid_until = min(boundaries, default=date.max)
+
+    def is_fresh(self, today):
+        return self.loaded_on <= today < self.valid_until
+
+    def current(self, today):
+        started = self.cycles[:bisect_right(self.starts, today)]
+        return min((cycle for cycle in started if cycle.end_date >= today), key=lambda cycle: cycle.cycle_number, default=None)
+
+    def active(self, today):
+        current = self.current(today)
+        if current is None:
+            return []
+        return sorted(
+            (cycle for cycle in self.cycles if cycle.cycle_number <= current.cycle_number),
+            key=lambda cycle: cycle.cycle_number,
+        )
+
+
+def get_cycle_calendar(campaign_id, today=None):
+    today = today or timezone.now().date()
+    key = CALENDAR_KEY.format(campaign_id)
+    calendar = _cache_get_many([key]).get(key)
+    if calendar is None or not calendar.is_fresh(today):
+        calendar = CycleCalendar(CampaignCycle.objects.filter(campaign_id=campaign_id), today)
+        _cache_set_many({key: calendar})
+    return calendar
 
 
 def get_current_cycle(campaign):
     today = timezone.now().date()
-    return campaign.cycles.filter(start_date__lte=today, end_date__gte=today).order_by("cycle_number").first()
+    return get_cycle_calendar(campaign.pk, today).current(today)
 
 
 def get_active_collaterals(campaign):
-    current = get_current_cycle(campaign)
-    if not current:
-        return campaign.cycles.none()
-    return CampaignCycle.objects.filter(campaign=campaign, cycle_number__lte=current.cycle_number).order_by("cycle_number")
+    today = timezone.now().date()
+    return get_cycle_calendar(campaign.pk, today).active(today)
+
+
+def invalidate_cycle_calendar(campaign_id):
+    _cache_delete_many([CALENDAR_KEY.format(campaign_id)])
+
+
+def _shared_cache():
+    return caches["shared"] if "shared" in settings.CACHES else None
+
+
+def _cache_get_many(keys):
+    found = caches["default"].get_many(keys)
+    missing = [key for key in keys if key not in found]
+    shared = _shared_cache()
+    if missing and shared is not None:
+        promoted = shared.get_many(missing)
+        if promoted:
+            caches["default"].set_many(promoted, settings.SHARE_CACHE_LOCAL_TIMEOUT)
+            found.update(promoted)
+    return found
+
+
+def _cache_set_many(values):
+    # The local tier stays short-lived because invalidations cannot reach other workers' memory.
+    caches["default"].set_many(values, settings.SHARE_CACHE_LOCAL_TIMEOUT)
+    shared = _shared_cache()
+    if shared is not None:
+        shared.set_many(values, settings.SHARE_CACHE_TIMEOUT)
+
+
+def _cache_delete_many(keys):
+    caches["default"].delete_many(keys)
+    shared = _shared_cache()
+    if shared is not None:
+        shared.delete_many(keys)
+
+
+# Async variants for the ASGI views: the local-memory tier never blocks, so only the shared tier is awaited.
+async def _acache_get_many(keys):
+    found = caches["default"].get_many(keys)
+    missing = [key for key in keys if key not in found]
+    shared = _shared_cache()
+    if missing and shared is not None:
+        promoted = await shared.aget_many(missing)
+        if promoted:
+            caches["default"].set_many(promoted, settings.SHARE_CACHE_LOCAL_TIMEOUT)
+            found.update(promoted)
+    return found
+
+
+async def _acache_set_many(values):
+    caches["default"].set_many(values, settings.SHARE_CACHE_LOCAL_TIMEOUT)
+    shared = _shared_cache()
+    if shared is not None:
+        await shared.aset_many(values, settings.SHARE_CACHE_TIMEOUT)
+
+
+async def _acache_delete_many(keys):
+    caches["default"].delete_many(keys)
+    shared = _shared_cache()
+    if shared is not None:
+        await shared.adelete_many(keys)
+
+
+def _count(outcome):
+    with _stats_lock:
+        _share_cache_stats[outcome] += 1
+
+
+def _share_context(share):
+    entry = {
+        "id": share.id,
+        "token": share.token,
+        "status": share.status,
+        "doctor_id": share.doctor_id,
+        "doctor_whatsapp": share.doctor.whatsapp_number,
+        "campaign_id": share.campaign_id,
+        "cycle_id": share.cycle_id,
+        "field_rep_id": share.field_rep_id,
+    }
+    campaign = {field: getattr(share.campaign, field) for field in CAMPAIGN_FIELDS}
+    cycle = {field: getattr(share.cycle, field) for field in CYCLE_FIELDS}
+    values = {
+        SHARE_KEY.format(share.token): entry,
+        CAMPAIGN_KEY.format(share.campaign_id): campaign,
+        CYCLE_KEY.format(share.cycle_id): cycle,
+    }
+    return values, dict(entry, campaign=campaign, cycle=cycle)
+
+
+def _cached_context(entry, parts):
+    campaign = parts.get(CAMPAIGN_KEY.format(entry["campaign_id"]))
+    cycle = parts.get(CYCLE_KEY.format(entry["cycle_id"]))
+    if campaign is None or cycle is None:
+        return None
+    return dict(entry, campaign=campaign, cycle=cycle)
+
+
+async def aget_share_context(token):
+    lookup = share_lookup(token)
+    if lookup is None:
+        return None
+    share_key = SHARE_KEY.format(token)
+    entry = (await _acache_get_many([share_key])).get(share_key)
+    if entry is not None:
+        context = _cached_context(
+            entry, await _acache_get_many([CAMPAIGN_KEY.format(entry["campaign_id"]), CYCLE_KEY.format(entry["cycle_id"])])
+        )
+        if context is not None:
+            _count("hits")
+            return context
+    _count("misses")
+    share = await ShareRecord.objects.select_related("doctor", "campaign", "cycle").filter(**lookup).afirst()
+    if share is None:
+        return None
+    values, context = _share_context(share)
+    await _acache_set_many(values)
+    return context
+
+
+def invalidate_share(token):
+    _cache_delete_many([SHARE_KEY.format(token)])
+
+
+async def ainvalidate_share(token):
+    await _acache_delete_many([SHARE_KEY.format(token)])
+
+
+def invalidate_campaign(campaign_id):
+    _cache_delete_many([CAMPAIGN_KEY.format(campaign_id)])
+
+
+def invalidate_cycle(cycle_id):
+    _cache_delete_many([CYCLE_KEY.format(cycle_id)])
+
+
+def share_cache_stats():
+    with _stats_lock:
+        hits, misses = _share_cache_stats["hits"], _share_cache_stats["misses"]
+    return {"hits": hits, "misses": misses, "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0}
+
+
+def get_landing_fragment(context):
+    # Keyed by a digest of the cached campaign and cycle assets, so an edit that refreshes the share
+    # context (see core.signals) moves every worker to a new entry without explicit deletes.
+    assets = json.dumps([context["campaign"], context["cycle"]], sort_keys=True, default=str)
+    key = LANDING_KEY.format(context["campaign_id"], context["cycle_id"], hashlib.md5(assets.encode()).hexdigest())
+    fragment = caches["default"].get(key)
+    if fragment is None:
+        page = render_to_string("core/doctor_landing.html", {
+            "campaign": context["campaign"], "cycle": context["cycle"], "share_slot": mark_safe(SHARE_SLOT),
+        })
+        head, _, tail = page.partition(SHARE_SLOT)
+        fragment = {
+            "head": head,
+            "tail": tail,
+            "etag": hashlib.md5(page.encode()).hexdigest(),
+            # From the rows, not the render, so every worker (and every re-render) reports the same date.
+            "last_modified": int(max(context["campaign"]["updated_at"], context["cycle"]["updated_at"]).timestamp()),
+        }
+        caches["default"].set(key, fragment, settings.LANDING_CACHE_TIMEOUT)
+    return fragment
+
+
+def render_landing(fragment, context):
+    return "".join((
+        fragment["head"], format_html("<div id='share' data-share-id='{}' hidden></div>", context["id"]), fragment["tail"]
+    ))
+
+
+def whatsapp_url(number, message, verify_url):
+    return f"https://wa.me/{number}?text={message} {verify_url}"
+
+
+def normalize_whatsapp(number):
+    # JSON clients may send numbers as integers; any other non-string is an invalid row.
+    if isinstance(number, int) and not isinstance(number, bool):
+        number = str(number)
+    if not isinstance(number, str):
+        return None
+    number = "".join(ch for ch in number if ch not in " -()").lstrip("+")
+    if not number.isdigit() or len(number) > Doctor._meta.get_field("whatsapp_number").max_length:
+        return None
+    return number
+
+
+def iter_bulk_shares(entries, build_verify_url, batch_size=BULK_SHARE_BATCH_SIZE):
+    reps, cycles, chunk = {}, {}, []
+    for entry in entries:
+        chunk.append(entry)
+        if len(chunk) >= batch_size:
+            yield from _bulk_share_chunk(chunk, reps, cycles, build_verify_url)
+            chunk = []
+    if chunk:
+        yield from _bulk_share_chunk(chunk, reps, cycles, build_verify_url)
+
+
+def _bulk_share_chunk(chunk, reps, cycles, build_verify_url):
+    missing_reps = {int(e["field_rep_id"]) for e in chunk if str(e.get("field_rep_id", "")).isdigit()} - reps.keys()
+    reps.update(FieldRepresentative.objects.in_bulk(missing_reps))
+    missing_cycles = {int(e["cycle_id"]) for e in chunk if str(e.get("cycle_id", "")).isdigit()} - cycles.keys()
+    cycles.update(CampaignCycle.objects.in_bulk(missing_cycles))
+
+    results, pending = [], []
+    for entry in chunk:
+        rep_id, cycle_id = str(entry.get("field_rep_id", "")), str(entry.get("cycle_id", ""))
+        rep = reps.get(int(rep_id)) if rep_id.isdigit() else None
+        cycle = cycles.get(int(cycle_id)) if cycle_id.isdigit() else None
+        number = normalize_whatsapp(entry.get("doctor_whatsapp"))
+        error = None
+        if rep is None or not rep.is_active:
+            error = "Unknown or inactive field rep"
+        elif cycle is None or cycle.campaign_id != rep.campaign_id:
+            error = "Cycle does not belong to the field rep's campaign"
+        elif number is None:
+            error = "Invalid WhatsApp number"
+        if error:
+            results.append({"row": entry["row"], "doctor_whatsapp": entry.get("doctor_whatsapp"), "error": error})
+        else:
+            pending.append((entry, rep, cycle, number))
+    if not pending:
+        return results
+
+    numbers = {number for _, _, _, number in pending}
+    with transaction.atomic():
+        Doctor.objects.bulk_create(
+            [Doctor(whatsapp_number=n) for n in numbers], ignore_conflicts=True, batch_size=BULK_SHARE_BATCH_SIZE
+        )
+        doctors = dict(Doctor.objects.filter(whatsapp_number__in=numbers).values_list("whatsapp_number", "id"))
+        shares = [
+            ShareRecord(
+                campaign_id=rep.campaign_id,
+                cycle=cycle,
+                field_rep=rep,
+                doctor_id=doctors[number],
+                whatsapp_message=cycle.message_template,
+                is_reminder=bool(entry.get("is_reminder")),
+            )
+            for entry, rep, cycle, number in pending
+        ]
+        # Tokens embed the public id set at construction, so MySQL's missing insert ids do not matter.
+        ShareRecord.objects.bulk_create(shares, batch_size=BULK_SHARE_BATCH_SIZE)
+        count_sent(shares)
+    for (entry, _, _, number), share in zip(pending, shares):
+        results.append({
+            "row": entry["row"],
+            "doctor_whatsapp": number,
+            "token": share.token,
+            "url": whatsapp_url(number, share.whatsapp_message, build_verify_url(share.token)),
+        })
+    results.sort(key=lambda result: result["row"])
+    return results
+
+
+def iter_due_reminders(now=None, lookback=None, chunk_size=REMINDER_BATCH_SIZE):
+    cutoff = (now or timezone.now()) - REMINDER_AFTER
+    due = ShareRecord.objects.filter(
+        status=ShareRecord.STATUS_SENT, shared_at__lte=cutoff, is_reminder=False,
+        reminder__isnull=True, field_rep__is_active=True,
+    )
+    if lookback is not None:
+        due = due.filter(shared_at__gt=cutoff - lookback)
+    due = due.order_by("shared_at", "id").values_list(
+        "id", "shared_at", "campaign_id", "cycle_id", "field_rep_id", "doctor_id", "cycle__reminder_template",
+        "doctor__whatsapp_number",
+    )
+    after = None
+    while True:
+        chunk = due
+        if after is not None:
+            chunk = chunk.filter(Q(shared_at__gt=after[0]) | Q(shared_at=after[0], id__gt=after[1]))
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        after = (rows[-1][1], rows[-1][0])
+
+
+def iter_reminder_batches(build_verify_url, now=None, lookback=None, chunk_size=REMINDER_BATCH_SIZE):
+    # Yields (field_rep_id, links) per rep and chunk, one link for every reminder this run created.
+    for rows in iter_due_reminders(now, lookback, chunk_size):
+        rows = sorted(rows, key=lambda row: row[4])
+        reminders = [
+            ShareRecord(
+                campaign_id=campaign_id, cycle_id=cycle_id, field_rep_id=field_rep_id, doctor_id=doctor_id,
+                whatsapp_message=reminder_template, is_reminder=True, reminder_of_id=share_id,
+            )
+            for share_id, _, campaign_id, cycle_id, field_rep_id, doctor_id, reminder_template, _ in rows
+        ]
+        # reminder_of is unique, so a concurrent or repeated run cannot create a second reminder.
+        # Rows skipped on conflict keep a public id nobody stored, which is how they are told apart.
+        with transaction.atomic():
+            ShareRecord.objects.bulk_create(reminders, ignore_conflicts=True)
+            stored = set(ShareRecord.objects.filter(
+                public_id__in=[reminder.public_id for reminder in reminders]
+            ).values_list("public_id", flat=True))
+            created = [(reminder, row[7]) for reminder, row in zip(reminders, rows) if reminder.public_id in stored]
+            count_sent([reminder for reminder, _ in created])
+        for rep_id, group in groupby(created, key=lambda pair: pair[0].field_rep_id):
+            yield rep_id, [
+                {
+                    "doctor_whatsapp": number,
+                    "token": reminder.token,
+                    "url": whatsapp_url(number, reminder.whatsapp_message, build_verify_url(reminder.token)),
+                }
+                for reminder, number in group
+            ]
@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Campaign, CampaignCycle, ShareRecord
+from .services import invalidate_campaign, invalidate_cycle, invalidate_cycle_calendar, invalidate_share
+
+
+@receiver([post_save, post_delete], sender=Campaign)
+def campaign_changed(sender, instance, **kwargs):
+    invalidate_campaign(instance.pk)
+    invalidate_cycle_calendar(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=CampaignCycle)
+def cycle_changed(sender, instance, **kwargs):
+    invalidate_cycle(instance.pk)
+    invalidate_cycle_calendar(instance.campaign_id)
+
+
+@receiver([post_save, post_delete], sender=ShareRecord)
+def share_changed(sender, instance, **kwargs):
+    invalidate_share(instance.token)
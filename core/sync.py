@@ -0,0 +1,270 @@
+import fcntl
+import multiprocessing
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+from .models import ActivityEvent
+from reporting.models import ActivityEventReport, SyncState
+from reporting.rollups import apply_reports
+from reporting.sharding import shard_for
+
+STATE_NAME = "activity_events"
+DEFAULT_BATCH_SIZE = 5000
+FOLLOW_BATCH_SIZE = 500
+PARTITION_RETRIES = 8
+EVENT_FIELDS = (
+    "id", "share_id", "share__campaign_id", "share__cycle_id", "share__field_rep_id",
+    "doctor_id", "event_type", "value", "created_at",
+)
+
+
+@dataclass
+class SyncResult:
+    moved: int = 0
+    batches: int = 0
+    last_event_id: int = 0
+    timed_out: bool = False
+    partitions: list = field(default_factory=list)
+
+
+@dataclass
+class PartitionResult:
+    lower_id: int
+    upper_id: int
+    moved: int = 0
+    batches: int = 0
+    cursor: int = 0
+    seconds: float = 0.0
+    timed_out: bool = False
+
+
+class SyncLocked(Exception):
+    pass
+
+
+@contextmanager
+def sync_lock(path=None):
+    # flock is dropped by the kernel if the holder dies, so a crashed run never wedges cron.
+    handle = open(path or settings.SYNC_LOCK_FILE, "a")
+    try:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise SyncLocked(path or settings.SYNC_LOCK_FILE)
+        yield
+    finally:
+        handle.close()
+
+
+def get_state(name=STATE_NAME):
+    state, _ = SyncState.objects.using("reporting").get_or_create(name=name)
+    return state
+
+
+def fetch_batch(after_id, batch_size, upper_id=None):
+    # One keyset query per batch; the share FKs come back through the join.
+    qs = ActivityEvent.objects.using("default").filter(id__gt=after_id)
+    if upper_id is not None:
+        qs = qs.filter(id__lte=upper_id)
+    return list(qs.order_by("id").values_list(*EVENT_FIELDS)[:batch_size])
+
+
+def build_reports(rows):
+    return [
+        ActivityEventReport(
+            source_event_id=event_id,
+            share_id=share_id,
+            campaign_id=campaign_id,
+            cycle_id=cycle_id,
+            field_rep_id=field_rep_id,
+            doctor_id=doctor_id,
+            event_type=event_type,
+            value=value,
+            occurred_at=created_at,
+        )
+        for event_id, share_id, campaign_id, cycle_id, field_rep_id, doctor_id, event_type, value, created_at in rows
+    ]
+
+
+def _advance(state, last_id):
+    if state is not None and last_id > state.last_event_id:
+        state.last_event_id = last_id
+        state.save(using="reporting", update_fields=["last_event_id", "updated_at"])
+
+
+def load_batch(rows, state=None):
+    last_id = rows[-1][0]
+    shards = {}
+    by_shard = defaultdict(list)
+    for report in build_reports(rows):
+        if report.campaign_id not in shards:
+            shards[report.campaign_id] = shard_for(report.campaign_id, assign=True)
+        by_shard[shards[report.campaign_id]].append(report)
+    # The shard holding SyncState commits last, so the watermark never runs ahead of a shard.
+    for alias in sorted(by_shard, key=lambda alias: alias == "reporting"):
+        with transaction.atomic(using=alias):
+            copied = set(
+                ActivityEventReport.objects.using(alias)
+                .filter(source_event_id__in=[report.source_event_id for report in by_shard[alias]])
+                .values_list("source_event_id", flat=True)
+            )
+            reports = [report for report in by_shard[alias] if report.source_event_id not in copied]
+            ActivityEventReport.objects.using(alias).bulk_create(reports, ignore_conflicts=True)
+            apply_reports(reports, using=alias)
+            if alias == "reporting":
+                _advance(state, last_id)
+    if "reporting" not in by_shard:
+        _advance(state, last_id)
+    # Only the rows just copied are deleted; an id inside the range that commits late stays for sweep_stragglers.
+    ActivityEvent.objects.using("default").filter(id__in=[row[0] for row in rows]).delete()
+
+
+def sweep_stragglers(state, batch_size=DEFAULT_BATCH_SIZE):
+    # Rows at or below the watermark are late commits that keyset fetches skipped, or rows a killed run
+    # copied but did not delete. load_batch copies the former and only deletes the latter.
+    swept, after = 0, 0
+    while state.last_event_id:
+        rows = fetch_batch(after, batch_size, state.last_event_id)
+        if not rows:
+            break
+        load_batch(rows, state)
+        after = rows[-1][0]
+        swept += len(rows)
+    return swept
+
+
+def sync_events(batch_size=DEFAULT_BATCH_SIZE, max_runtime=None, state_name=STATE_NAME):
+    state = get_state(state_name)
+    sweep_stragglers(state, batch_size)
+    upper_id = ActivityEvent.objects.using("default").aggregate(m=Max("id"))["m"]
+    result = SyncResult(last_event_id=state.last_event_id)
+    if upper_id is None:
+        return result
+    deadline = time.monotonic() + max_runtime if max_runtime else None
+    cursor = state.last_event_id
+    while True:
+        if deadline is not None and time.monotonic() >= deadline:
+            result.timed_out = True
+            break
+        rows = fetch_batch(cursor, batch_size, upper_id)
+        if not rows:
+            break
+        load_batch(rows, state)
+        cursor = rows[-1][0]
+        result.moved += len(rows)
+        result.batches += 1
+    result.last_event_id = state.last_event_id
+    return result
+
+
+def replication_lag():
+    # Copied rows are trimmed, so the oldest row left in the transaction DB is the oldest unreplicated one.
+    oldest = ActivityEvent.objects.using("default").order_by("id").values_list("created_at", flat=True).first()
+    return max((timezone.now() - oldest).total_seconds(), 0.0) if oldest else 0.0
+
+
+def follow_events(stop, batch_size=FOLLOW_BATCH_SIZE, min_interval=0.5, max_interval=10.0, state_name=STATE_NAME, on_batch=None):
+    state = get_state(state_name)
+    result = SyncResult(last_event_id=state.last_event_id)
+    interval = min_interval
+    while not stop.is_set():
+        # Micro-batches overtake buffered inserts often, so stragglers are picked up on every poll.
+        sweep_stragglers(state, batch_size)
+        rows = fetch_batch(state.last_event_id, batch_size)
+        if rows:
+            load_batch(rows, state)
+            result.moved += len(rows)
+            result.batches += 1
+            result.last_event_id = state.last_event_id
+            if on_batch:
+                on_batch(len(rows), state.last_event_id)
+            interval = min_interval
+            if len(rows) == batch_size:
+                continue
+        else:
+            # Back off while idle; the first new row resets the poll to min_interval.
+            interval = min(interval * 2, max_interval)
+        stop.wait(interval)
+    return result
+
+
+def partition_ranges(lower_id, upper_id, partitions):
+    bounds = [lower_id + (upper_id - lower_id) * n // partitions for n in range(partitions + 1)]
+    return [(low, high) for low, high in zip(bounds, bounds[1:]) if high > low]
+
+
+def sync_partition(lower_id, upper_id, batch_size=DEFAULT_BATCH_SIZE, deadline=None):
+    # Copies ids in (lower_id, upper_id]; the shared watermark is advanced by the caller.
+    result = PartitionResult(lower_id, upper_id, cursor=lower_id)
+    started = time.monotonic()
+    while True:
+        if deadline is not None and time.time() >= deadline:
+            result.timed_out = True
+            break
+        rows = fetch_batch(result.cursor, batch_size, upper_id)
+        if not rows:
+            break
+        for attempt in range(PARTITION_RETRIES):
+            # Partitions may race on the same rollup rows; load_batch skips already copied ids on retry.
+            try:
+                load_batch(rows)
+                break
+            except (IntegrityError, OperationalError):
+                if attempt == PARTITION_RETRIES - 1:
+                    raise
+                time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+        result.cursor = rows[-1][0]
+        result.moved += len(rows)
+        result.batches += 1
+    if not result.timed_out:
+        result.cursor = upper_id
+    result.seconds = round(time.monotonic() - started, 3)
+    return result
+
+
+def _run_partition(task):
+    return sync_partition(*task)
+
+
+def sync_partitioned(workers, batch_size=DEFAULT_BATCH_SIZE, max_runtime=None, state_name=STATE_NAME, partitions=None):
+    state = get_state(state_name)
+    sweep_stragglers(state, batch_size)
+    upper_id = ActivityEvent.objects.using("default").aggregate(m=Max("id"))["m"]
+    result = SyncResult(last_event_id=state.last_event_id)
+    if upper_id is None or upper_id <= state.last_event_id:
+        return result
+    deadline = time.time() + max_runtime if max_runtime else None
+    tasks = [
+        (low, high, batch_size, deadline)
+        for low, high in partition_ranges(state.last_event_id, upper_id, partitions or workers)
+    ]
+    if workers == 1:
+        outcomes = [_run_partition(task) for task in tasks]
+    else:
+        # Forked children must not share the parent's sockets; each opens its own connections.
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as pool:
+            outcomes = list(pool.map(_run_partition, tasks))
+    # The watermark only covers the contiguous prefix of finished partitions; rows a timed-out partition
+    # left behind stay above it, and late commits below it are swept by the next run.
+    watermark = state.last_event_id
+    for outcome in outcomes:
+        watermark = outcome.cursor
+        if outcome.timed_out:
+            break
+    if watermark > state.last_event_id:
+        state.last_event_id = watermark
+        state.save(using="reporting", update_fields=["last_event_id", "updated_at"])
+    result.moved = sum(outcome.moved for outcome in outcomes)
+    result.batches = sum(outcome.batches for outcome in outcomes)
+    result.timed_out = any(outcome.timed_out for outcome in outcomes)
+    result.last_event_id = state.last_event_id
+    result.partitions = outcomes
+    return result
@@ -1,19 +1,50 @@
+import gzip
+import json
+import os
+import socket
+import tempfile
+import threading
 from datetime import timedelta
 from io import StringIO
-from django.core.management import call_command
-from django.test import TestCase, override_settings
+from pathlib import Path
+from unittest.mock import patch
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
-from core.db_router import TransactionReportingRouter
-from core.models import ActivityEvent, Campaign, CampaignCycle, Doctor, FieldRepresentative, ShareRecord
-from reporting.models import ActivityEventReport
+from django.utils.http import http_date, int_to_base36
+from core.benchmark import compare, run_benchmarks, seed
+from core.db_router import TransactionReportingRouter, reset_written, restore_written
+from core.ingest import ActivityBuffer, ProgressCoalescer, suppression_stats
+from core.metrics import normalize_sql, registry, worker_identity
+from core.middleware import ReadYourWritesMiddleware
+from core.models import (
+    ActivityEvent, Campaign, CampaignCounters, CampaignCycle, Doctor, FieldRepCounters, FieldRepresentative, ShareRecord,
+)
+from core.services import (
+    get_active_collaterals, get_current_cycle, iter_due_reminders, iter_reminder_batches, share_cache_stats,
+)
+from core.sync import EVENT_FIELDS, follow_events, replication_lag, sync_lock, sync_partitioned
+from core.tokens import make_token
+from reporting.analytics import compute_funnel
+from reporting.archive import Archive, archive_month, count_events
+from reporting.exports import EXPORT_FIELDS, REPORT_KEY, archived_rows, filter_reports, keyset_page
+from reporting.models import ActivityDailyRollup, ActivityEventReport, CampaignShard, SyncState
 
 
-@override_settings(USE_TZ=True)
+@override_settings(USE_TZ=True, ACTIVITY_BUFFER_ENABLED=False, REPORTING_SHARDS=["reporting"])
 class WorkflowTests(TestCase):
     databases = {"default", "reporting"}
 
     def setUp(self):
+        cache.clear()
+        caches["dedupe"].clear()
         self.campaign = Campaign.objects.create(
             name="Cardio CME",
             brand_name="BrandX",
@@ -58,6 +89,39 @@ class WorkflowTests(TestCase):
         share.refresh_from_db()
         self.assertEqual(share.status, ShareRecord.STATUS_READ)
 
+    def test_share_counters_follow_write_paths_and_reconcile(self):
+        self.client.post(reverse("share_collateral"), {
+            "field_rep_id": self.rep.id, "cycle_id": self.cycle.id, "doctor_whatsapp": "919900000014",
+        })
+        payload = {"field_rep_id": self.rep.id, "cycle_id": self.cycle.id, "doctors": ["919900000015"], "is_reminder": True}
+        self.client.post(reverse("share_collateral_bulk"), json.dumps(payload), content_type="application/json")
+        share = ShareRecord.objects.get(doctor__whatsapp_number="919900000014")
+        for _ in range(2):
+            self.client.post(reverse("doctor_verify", args=[share.token]), {"whatsapp_number": "919900000014"})
+            self.client.get(reverse("doctor_landing", args=[share.token]))
+
+        fields = ("shares_sent", "reminders_sent", "shares_read", "doctors_verified")
+        for counters in (self.campaign.counters, self.cycle.counters, self.rep.counters):
+            counters.refresh_from_db()
+            self.assertEqual([getattr(counters, f) for f in fields], [1, 1, 1, 1])
+        self.assertEqual(self.campaign.counters.read_percent, 50.0)
+
+        CampaignCounters.objects.filter(pk=self.campaign.pk).update(shares_sent=7)
+        FieldRepCounters.objects.filter(pk=self.rep.pk).delete()
+        out = StringIO()
+        call_command("reconcile_counters", f"--campaign={self.campaign.id}", stdout=out)
+        self.assertIn("Reconciled counters, 2 rows corrected", out.getvalue())
+        self.assertEqual(CampaignCounters.objects.get(pk=self.campaign.pk).shares_sent, 1)
+        self.assertEqual(FieldRepCounters.objects.get(pk=self.rep.pk).doctors_verified, 1)
+
+        for i in range(3):
+            Campaign.objects.create(
+                name=f"Extra {i}", brand_name="B", start_date=self.campaign.start_date, end_date=self.campaign.end_date
+            )
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("dashboard"))
+        self.assertContains(response, "<td>Cardio CME</td><td>BrandX</td><td>1</td><td>1</td><td>50.0%</td><td>1</td>", html=False)
+
     def test_button_color_state_logic(self):
         doctor = Doctor.objects.create(whatsapp_number="919900000002")
         share = ShareRecord.objects.create(
@@ -78,8 +142,42 @@ class WorkflowTests(TestCase):
             campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=doctor, whatsapp_message="x"
         )
         response = self.client.post(reverse("track_activity", args=[share.id, "video_progress"]), {"value": 85})
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 204)
         self.assertEqual(ActivityEvent.objects.count(), 1)
+        for event_type, value in (("video_progress", "nan"), ("video_progress", "inf"), ("video_progress", "x"), ("bogus", "1")):
+            response = self.client.post(reverse("track_activity", args=[share.id, event_type]), {"value": value})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(ActivityEvent.objects.count(), 1)
+
+    def test_duplicate_beacons_and_preview_bots_are_suppressed(self):
+        doctor = Doctor.objects.create(whatsapp_number="919900000013")
+        share = ShareRecord.objects.create(
+            campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=doctor, whatsapp_message="x"
+        )
+        before = suppression_stats()
+        track = reverse("track_activity", args=[share.id, "video_progress"])
+        for _ in range(2):
+            self.assertEqual(self.client.post(track, {"value": 40}, HTTP_IDEMPOTENCY_KEY="retry-1").status_code, 204)
+        self.client.post(track, {"value": 60, "idempotency_key": "retry-2"})
+        self.client.post(track, {"value": 70})
+        self.client.post(track, {"value": 70})
+
+        landing = reverse("doctor_landing", args=[share.token])
+        self.client.get(landing, HTTP_USER_AGENT="WhatsApp/2.23.20.0 A")
+        share.refresh_from_db()
+        self.assertEqual(share.status, ShareRecord.STATUS_SENT)
+        self.client.get(landing)
+        # Share contexts and fragments being evicted must not take the dedupe keys with them.
+        cache.clear()
+        self.client.get(landing)
+        self.assertGreaterEqual(caches["default"]._max_entries, 10000)
+
+        events = ActivityEvent.objects.filter(share=share)
+        self.assertEqual(events.filter(event_type="video_progress").count(), 4)
+        self.assertEqual(events.filter(event_type="landing_visit").count(), 1)
+        after = suppression_stats()
+        self.assertEqual((after["duplicates"] - before["duplicates"], after["preview_bots"] - before["preview_bots"]), (2, 1))
+        self.assertEqual(self.client.get(reverse("ingest_stats")).json()["suppressed"], after)
 
     def test_router_behavior(self):
         router = TransactionReportingRouter()
@@ -98,3 +196,889 @@ class WorkflowTests(TestCase):
         self.assertIn("Moved 1 events", out.getvalue())
         self.assertEqual(ActivityEvent.objects.using("default").count(), 0)
         self.assertEqual(ActivityEventReport.objects.using("reporting").count(), 1)
+
+    def test_sync_batches_and_records_watermark(self):
+        doctor = Doctor.objects.create(whatsapp_number="919900000005")
+        share = ShareRecord.objects.create(
+            campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=doctor, whatsapp_message="x"
+        )
+        events = ActivityEvent.objects.bulk_create(
+            [ActivityEvent(share=share, doctor=doctor, event_type="landing_visit") for _ in range(5)]
+        )
+
+        out = StringIO()
+        call_command("sync_reporting", "--batch-size=2", stdout=out)
+        self.assertIn("Moved 5 events", out.getvalue())
+        self.assertEqual(ActivityEvent.objects.using("default").count(), 0)
+        report = ActivityEventReport.objects.using("reporting").get(source_event_id=events[0].id)
+        self.assertEqual((report.campaign_id, report.cycle_id, report.field_rep_id), (self.campaign.id, self.cycle.id, self.rep.id))
+        state = SyncState.objects.using("reporting").get()
+        self.assertEqual(state.last_event_id, max(e.id for e in events))
+
+    def test_sync_resumes_after_interrupted_trim(self):
+        doctor = Doctor.objects.create(whatsapp_number="919900000006")
+        share = ShareRecord.objects.create(
+            campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=doctor, whatsapp_message="x"
+        )
+        copied = ActivityEvent.objects.create(share=share, doctor=doctor, event_type="pdf_download")
+        ActivityEventReport.objects.using("reporting").create(
+            source_event_id=copied.id, campaign_id=self.campaign.id, cycle_id=self.cycle.id,
+            field_rep_id=self.rep.id, doctor_id=doctor.id, event_type="pdf_download", occurred_at=copied.created_at,
+        )
+        SyncState.objects.using("reporting").create(name="activity_events", last_event_id=copied.id)
+        fresh = ActivityEvent.objects.create(share=share, doctor=doctor, event_type="landing_visit")
+
+        out = StringIO()
+        call_command("sync_reporting", stdout=out)
+        self.assertIn("Moved 1 events", out.getvalue())
+        self.assertFalse(ActivityEvent.objects.using("default").exists())
+        self.assertEqual(
+            set(ActivityEventReport.objects.using("reporting").values_list("source_event_id", flat=True)),
+            {copied.id, fresh.id},
+        )
+
+    def test_sync_copies_late_committed_ids_below_watermark(self):
+        doctor = Doctor.objects.create(whatsapp_number="919900000016")
+        share = ShareRecord.objects.create(
+            campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=doctor, whatsapp_message="x"
+        )
+        for event_id in (10, 20):
+            ActivityEvent.objects.create(id=event_id, share=share, doctor=doctor, event_type="pdf_download")
+        call_command("sync_reporting", stdout=StringIO())
+        ActivityEvent.objects.create(id=15, share=share, doctor=doctor, event_type="pdf_download")
+        call_command("sync_reporting", stdout=StringIO())
+        self.assertFalse(ActivityEvent.objects.using("default").exists())
+        self.assertEqual(
+            sorted(ActivityEventReport.objects.using("reporting").values_list("source_event_id", flat=True)), [10, 15, 20]
+        )
+
+    def test_partitioned_sync_advances_contiguous_watermark_under_lock(self):
+        doctor = Doctor.objects.create(whatsapp_number="919900000008")
+        share = ShareRecord.objects.create(
+            campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=doctor, whatsapp_message="x"
+        )
+        events = ActivityEvent.objects.bulk_create(
+            [ActivityEvent(share=share, doctor=doctor, event_type="landing_visit") for _ in range(9)]
+        )
+        result = sync_partitioned(1, batch_size=2, partitions=3)
+        self.assertEqual((result.moved, len(result.partitions)), (9, 3))
+        self.assertEqual(result.last_event_id, events[-1].id)
+        self.assertFalse(ActivityEvent.objects.using("default").exists())
+        self.assertEqual(ActivityDailyRollup.objects.using("reporting").get().event_count, 9)
+
+        ActivityEvent.objects.create(share=share, doctor=doctor, event_type="pdf_download")
+        with tempfile.NamedTemporaryFile() as lock, override_settings(SYNC_LOCK_FILE=lock.name):
+            with sync_lock():
+                out = StringIO()
+                call_command("sync_reporting", "--workers=1", stdout=out)
+                self.assertIn("holds", out.getvalue())
+            out = StringIO()
+            call_command("sync_reporting", "--workers=1", stdout=out)
+        self.assertIn(f"Partition 1 ids {events[-1].id + 1}-{events[-1].id + 1}: moved 1", out.getvalue())
+        self.assertEqual(SyncState.objects.using("reporting").get().last_event_id, events[-1].id + 1)
+
+    def test_follow_mode_tails_micro_batches_and_reports_lag(self):
+        doctor = Doctor.objects.create(whatsapp_number="919900000009")
+        share = ShareRecord.objects.create(
+            campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=doctor, whatsapp_message="x"
+        )
+        events = ActivityEvent.objects.bulk_create([
+            ActivityEvent(share=share, doctor=doctor, event_type="landing_visit", created_at=timezone.now() - timedelta(seconds=90))
+            for _ in range(3)
+        ])
+        self.assertGreaterEqual(replication_lag(), 90)
+        stop, batches = threading.Event(), []
+
+        def on_batch(moved, last_event_id):
+            batches.append((moved, last_event_id))
+            stop.set()
+
+        result = follow_events(stop, batch_size=2, min_interval=0, on_batch=on_batch)
+        self.assertEqual((result.moved, batches), (2, [(2, events[1].id)]))
+        self.assertEqual(SyncState.objects.using("reporting").get().last_event_id, events[1].id)
+        self.assertEqual(list(ActivityEvent.objects.values_list("id", flat=True)), [events[2].id])
+        self.assertIn("inclinic_reporting_replication_lag_seconds{", self.client.get(reverse("metrics")).content.decode())
+
+        stop.clear()
+        follow_events(stop, batch_size=2, min_interval=0, on_batch=on_batch)
+        self.assertEqual(batches[-1], (1, events[2].id))
+        self.assertEqual(replication_lag(), 0.0)
+
+    def test_sync_maintains_daily_rollups_incrementally(self):
+        doctor = Doctor.objects.create(whatsapp_number="919900000007")
+        share = ShareRecord.objects.create(
+            campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=doctor, whatsapp_message="x"
+        )
+        for value in (30, 60):
+            ActivityEvent.objects.create(share=share, doctor=doctor, event_type="video_progress", value=value)
+        call_command("sync_reporting", stdout=StringIO())
+        ActivityEvent.objects.create(share=share, doctor=doctor, event_type="video_progress", value=90)
+        call_command("sync_reporting", stdout=StringIO())
+
+        rollup = ActivityDailyRollup.objects.using("reporting").get()
+        self.assertEqual((rollup.event_count, rollup.value_sum, rollup.value_max), (3, 180, 90))
+        self.assertEqual(rollup.day, timezone.localdate())
+
+        out = StringIO()
+        call_command("rebuild_rollups", f"--campaign={self.campaign.id}", stdout=out)
+        self.assertIn("Rebuilt 1 rollup rows", out.getvalue())
+        rebuilt = ActivityDailyRollup.objects.using("reporting").get()
+        self.assertEqual((rebuilt.event_count, rebuilt.value_sum, rebuilt.value_max), (3, 180, 90))
+
+    def test_landing_is_served_from_share_cache(self):
+        cache.clear()
+        doctor = Doctor.objects.create(whatsapp_number="919900000008")
+        share = ShareRecord.objects.create(
+            campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=doctor, whatsapp_message="x"
+        )
+        url = reverse("doctor_landing", args=[share.token])
+        self.client.get(url)
+        self.client.get(url)
+        before = share_cache_stats()
+        # The repeat visit is deduplicated, so nothing touches the database.
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, "Cycle1")
+        self.assertEqual(share_cache_stats()["hits"], before["hits"] + 1)
+
+        self.cycle.title = "Cycle1 revised"
+        self.cycle.save()
+        self.assertContains(self.client.get(url), "Cycle1 revised")
+        self.assertEqual(self.client.get(reverse("doctor_landing", args=["missing"])).status_code, 404)
+
+    def test_signed_share_tokens_resolve_by_id_and_reject_forgeries(self):
+        cache.clear()
+        doctor = Doctor.objects.create(whatsapp_number="919900000011")
+        share = ShareRecord.objects.create(
+            campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=doctor, whatsapp_message="x"
+        )
+        self.assertIsNone(share.legacy_token)
+        self.assertTrue(share.token.startswith(f"{int_to_base36(share.public_id)}-"))
+        self.assertEqual(self.client.get(reverse("doctor_landing", args=[share.token])).status_code, 200)
+        # Links issued before public ids embed the row id and keep resolving; new shares cannot be reached that way.
+        self.assertEqual(self.client.get(reverse("doctor_landing", args=[make_token(share.id)])).status_code, 404)
+        ShareRecord.objects.filter(pk=share.pk).update(public_id=None)
+        self.assertEqual(self.client.get(reverse("doctor_landing", args=[make_token(share.id)])).status_code, 200)
+
+        forged = share.token[:-1] + ("0" if share.token[-1] != "0" else "1")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse("doctor_landing", args=[forged])).status_code, 404)
+            self.assertEqual(self.client.get(reverse("doctor_verify", args=["not-a-token"])).status_code, 404)
+
+        legacy = ShareRecord.objects.create(
+            campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=doctor, whatsapp_message="x",
+            legacy_token="ab" * 16,
+        )
+        self.assertEqual(legacy.token, "ab" * 16)
+        self.assertEqual(self.client.get(reverse("doctor_landing", args=[legacy.token])).status_code, 200)
+        with override_settings(SHARE_LEGACY_TOKENS=False):
+            cache.clear()
+            self.assertEqual(self.client.get(reverse("doctor_landing", args=[legacy.token])).status_code, 404)
+
+        payload = {"field_rep_id": self.rep.id, "cycle_id": self.cycle.id, "doctors": ["919900000012", "919900000012"]}
+        shares = self.client.post(reverse("share_collateral_bulk"), json.dumps(payload), content_type="application/json").json()["shares"]
+        created = ShareRecord.objects.filter(doctor__whatsapp_number="919900000012").order_by("id")
+        self.assertEqual([s["token"] for s in shares], [s.token for s in created])
+
+    def test_landing_body_is_fragment_cached_and_revalidated(self):
+        cache.clear()
+        doctor = Doctor.objects.create(whatsapp_number="919900000010")
+        share = ShareRecord.objects.create(
+            campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=doctor, whatsapp_message="x"
+        )
+        url = reverse("doctor_landing", args=[share.token])
+        first = self.client.get(url)
+        self.assertContains(first, f"data-share-id='{share.id}'")
+        self.assertEqual(first["Cache-Control"], "private, no-cache")
+        with patch("core.services.render_to_string") as render:
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        render.assert_not_called()
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again["ETag"], first["ETag"])
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=first["Last-Modified"]).status_code, 304)
+        updated = max(self.campaign.updated_at, self.cycle.updated_at)
+        self.assertEqual(first["Last-Modified"], http_date(updated.timestamp()))
+        cache.clear()  # another worker renders its own fragment but reports the same date
+        self.assertEqual(self.client.get(url)["Last-Modified"], first["Last-Modified"])
+        self.assertEqual(ActivityEvent.objects.filter(share=share, event_type="landing_visit").count(), 1)
+
+        self.campaign.banner_top_url = "https://cdn.example.com/new-top.png"
+        self.campaign.save()
+        edited = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(edited.status_code, 200)
+        self.assertNotEqual(edited["ETag"], first["ETag"])
+        self.assertContains(edited, "new-top.png")
+
+    def test_bulk_share_endpoint_reports_row_errors(self):
+        Doctor.objects.create(whatsapp_number="919900000009")
+        payload = {
+            "field_rep_id": self.rep.id,
+            "cycle_id": self.cycle.id,
+            "doctors": ["919900000009", "+91 9900 000010", "not-a-number", 919900000011, {"n": 1}, None],
+        }
+        response = self.client.post(reverse("share_collateral_bulk"), json.dumps(payload), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([s["doctor_whatsapp"] for s in body["shares"]], ["919900000009", "919900000010", "919900000011"])
+        self.assertTrue(body["shares"][0]["url"].startswith("https://wa.me/919900000009?text=Please review CME http"))
+        self.assertEqual([(e["row"], e["error"]) for e in body["errors"]], [(row, "Invalid WhatsApp number") for row in (2, 4, 5)])
+        self.assertEqual(ShareRecord.objects.count(), 3)
+        self.assertEqual(Doctor.objects.count(), 3)
+        for doctors in (919900000012, {"n": "919900000012"}):
+            payload["doctors"] = doctors
+            response = self.client.post(reverse("share_collateral_bulk"), json.dumps(payload), content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+
+    def test_bulk_share_is_one_insert_even_when_ids_cannot_be_returned(self):
+        payload = {"field_rep_id": self.rep.id, "cycle_id": self.cycle.id, "doctors": ["919900000013", "919900000013"]}
+        with patch.object(type(connections["default"].features), "can_return_rows_from_bulk_insert", False), \
+                CaptureQueriesContext(connections["default"]) as queries:
+            response = self.client.post(reverse("share_collateral_bulk"), json.dumps(payload), content_type="application/json")
+        self.assertEqual(sum(q["sql"].startswith('INSERT INTO "core_sharerecord"') for q in queries.captured_queries), 1)
+        tokens = [share["token"] for share in response.json()["shares"]]
+        self.assertEqual(tokens, [share.token for share in ShareRecord.objects.order_by("id")])
+        self.assertEqual(len(set(tokens)), 2)
+
+    def test_bulk_share_command_streams_csv(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as handle:
+            handle.write("field_rep_id,cycle_id,doctor_whatsapp\n")
+            handle.write(f"{self.rep.id},{self.cycle.id},919900000011\n")
+            handle.write(f"999,{self.cycle.id},919900000012\n")
+        self.addCleanup(os.remove, handle.name)
+        out, err = StringIO(), StringIO()
+        call_command("bulk_share", handle.name, "--batch-size=1", stdout=out, stderr=err)
+        lines = out.getvalue().splitlines()
+        self.assertIn("/doctor/verify/", lines[1])
+        self.assertTrue(lines[2].endswith("Unknown or inactive field rep"))
+        self.assertIn("Created 1 shares, 1 rows failed", err.getvalue())
+
+    def test_doctor_status_is_keyset_paginated_with_sql_state(self):
+        shares = ShareRecord.objects.bulk_create([
+            ShareRecord(
+                campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, whatsapp_message="x",
+                doctor=Doctor.objects.create(whatsapp_number=f"91880000{i:04d}"),
+            )
+            for i in range(55)
+        ])
+        ShareRecord.objects.filter(pk=shares[0].pk).update(shared_at=timezone.now() - timedelta(days=7))
+        ShareRecord.objects.filter(pk=shares[1].pk).update(status=ShareRecord.STATUS_READ)
+
+        with self.assertNumQueries(1):
+            first = self.client.get(reverse("doctor_status_json"), {"rep_id": self.rep.id}).json()
+        self.assertEqual(len(first["shares"]), 50)
+        second = self.client.get(first["next"]).json()
+        self.assertEqual(len(second["shares"]), 5)
+        self.assertIsNone(second["next"])
+        seen = [s["id"] for s in first["shares"] + second["shares"]]
+        self.assertEqual(sorted(seen), sorted(s.pk for s in shares))
+        self.assertEqual(second["shares"][-1]["state"], "purple")
+
+        purple = self.client.get(reverse("doctor_status_json"), {"rep_id": self.rep.id, "state": "purple"}).json()
+        self.assertEqual([s["id"] for s in purple["shares"]], [shares[0].pk])
+        green = self.client.get(reverse("doctor_status_list"), {"rep_id": self.rep.id, "state": "green"})
+        self.assertContains(green, "Read")
+        self.assertNotContains(green, "Send Reminder")
+
+    def test_send_reminders_is_bulk_and_idempotent(self):
+        def share(number, **fields):
+            record = ShareRecord.objects.create(
+                campaign=self.campaign, cycle=self.cycle, field_rep=fields.pop("rep", self.rep),
+                doctor=Doctor.objects.create(whatsapp_number=number), whatsapp_message="x",
+            )
+            ShareRecord.objects.filter(pk=record.pk).update(**fields)
+            return record
+
+        old = timezone.now() - timedelta(days=7)
+        due = share("919900000020", shared_at=old)
+        share("919900000021")
+        share("919900000022", shared_at=old, status=ShareRecord.STATUS_READ)
+        inactive = FieldRepresentative.objects.create(
+            campaign=self.campaign, name="Gone", email="g@example.com", whatsapp_number="1", is_active=False
+        )
+        share("919900000023", shared_at=old, rep=inactive)
+
+        [stale] = iter_due_reminders()
+        out, err = StringIO(), StringIO()
+        call_command("send_reminders", "--batch-size=1", stdout=out, stderr=err)
+        self.assertIn(f"Field rep {self.rep.id}: 1 reminders", err.getvalue())
+        reminder = ShareRecord.objects.get(is_reminder=True)
+        self.assertEqual((reminder.reminder_of_id, reminder.doctor_id), (due.id, due.doctor_id))
+        self.assertEqual(reminder.whatsapp_message, "Reminder CME")
+        verify_url = settings.PUBLIC_BASE_URL + reverse("doctor_verify", args=[reminder.token])
+        self.assertEqual(out.getvalue().splitlines(), [
+            "field_rep_id,doctor_whatsapp,url",
+            f"{self.rep.id},919900000020,https://wa.me/919900000020?text=Reminder CME {verify_url}",
+        ])
+        self.assertEqual(FieldRepCounters.objects.get(field_rep=self.rep).reminders_sent, 1)
+
+        # A run that lost the race to another one inserts nothing, links nothing and counts nothing.
+        with patch("core.services.iter_due_reminders", return_value=[stale]):
+            self.assertEqual(list(iter_reminder_batches(str)), [])
+        self.assertEqual(FieldRepCounters.objects.get(field_rep=self.rep).reminders_sent, 1)
+
+        share("919900000024", shared_at=old)
+        out, err = StringIO(), StringIO()
+        call_command("send_reminders", "--format=json", stdout=out, stderr=err)
+        [batch] = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(batch["field_rep_id"], self.rep.id)
+        self.assertEqual([link["doctor_whatsapp"] for link in batch["links"]], ["919900000024"])
+        self.assertIn("Created 1 reminders", err.getvalue())
+        self.assertEqual(ShareRecord.objects.filter(is_reminder=True).count(), 2)
+
+        out, err = StringIO(), StringIO()
+        call_command("send_reminders", stdout=out, stderr=err)
+        self.assertEqual(out.getvalue(), "field_rep_id,doctor_whatsapp,url\n")
+        self.assertIn("Created 0 reminders", err.getvalue())
+
+    def test_cycle_calendar_is_cached_until_cycles_change(self):
+        cache.clear()
+        self.assertEqual(get_current_cycle(self.campaign), self.cycle)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_current_cycle(self.campaign), self.cycle)
+            self.assertEqual(get_active_collaterals(self.campaign), [self.cycle])
+
+        today = timezone.now().date()
+        self.client.post(reverse("campaign_edit", args=[self.campaign.id]), {
+            "create_cycle": "1", "cycle_number": "2", "start_date": str(today - timedelta(days=1)),
+            "end_date": str(today + timedelta(days=5)), "title": "Cycle2", "message_template": "m",
+            "reminder_template": "r", "pdf_url": "https://example.com/2.pdf", "video_vimeo_url": "https://player.vimeo.com/video/2",
+        })
+        self.assertEqual([c.cycle_number for c in get_active_collaterals(self.campaign)], [1])
+        self.cycle.end_date = today - timedelta(days=1)
+        self.cycle.save()
+        self.assertEqual(get_current_cycle(self.campaign).title, "Cycle2")
+        self.assertEqual([c.cycle_number for c in get_active_collaterals(self.campaign)], [1, 2])
+
+    def test_metrics_endpoint_reports_latency_and_db_usage_per_view(self):
+        doctor = Doctor.objects.create(whatsapp_number="919900000030")
+        share = ShareRecord.objects.create(
+            campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=doctor, whatsapp_message="x"
+        )
+        with self.settings(SLOW_QUERY_MS=0), self.assertLogs("core.middleware", "WARNING"):
+            self.client.get(reverse("doctor_landing", args=[share.token]))
+        body = self.client.get(reverse("metrics")).content.decode()
+        self.assertIn("# TYPE inclinic_request_duration_seconds histogram", body)
+        self.assertRegex(body, r'inclinic_request_duration_seconds_count\{view="doctor_landing",worker="[^"]+:\d+"\} [1-9]')
+        self.assertRegex(body, r'inclinic_db_queries_total\{view="doctor_landing",alias="default",worker="[^"]+"\} [1-9]')
+        self.assertIn("inclinic_activity_buffer_depth", body)
+        self.assertIn("# TYPE inclinic_share_cache_hits_total counter", body)
+        self.assertIn("# TYPE inclinic_activity_buffer_depth gauge", body)
+
+        slow = self.client.get(reverse("slow_queries")).json()["slow_queries"]
+        self.assertTrue(any(q["view"] == "doctor_landing" and q["alias"] == "default" for q in slow))
+
+        # With a shared snapshot directory every live worker is scraped together and exited ones are dropped.
+        sibling, exited = f"{socket.gethostname()}:{os.getppid()}", f"{socket.gethostname()}:999999999"
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS_DIR=directory):
+            for worker in (sibling, exited):
+                snapshot = {
+                    "families": [["inclinic_responses_total", "counter", "Responses", [["", {"view": "home", "status": "2xx", "worker": worker}, 7]]]],
+                    "slow_queries": [{"view": "home", "alias": "default", "sql": "SELECT ?", "ms": 250.0, "at": 1.0, "worker": worker}],
+                }
+                with open(os.path.join(directory, f"{worker}.json"), "w") as handle:
+                    json.dump(snapshot, handle)
+            body = self.client.get(reverse("metrics")).content.decode()
+            self.assertEqual(body.count("# TYPE inclinic_responses_total counter"), 1)
+            self.assertIn(f'inclinic_responses_total{{view="home",status="2xx",worker="{sibling}"}} 7', body)
+            self.assertIn(f'worker="{worker_identity()}"', body)
+            self.assertNotIn(exited, body)
+            self.assertEqual(sorted(os.listdir(directory)), sorted([f"{sibling}.json", f"{worker_identity()}.json"]))
+            slow = self.client.get(reverse("slow_queries")).json()["slow_queries"]
+            self.assertEqual(slow[0]["worker"], sibling)
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x' LIMIT 21"),
+            "SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?",
+        )
+
+    async def test_async_requests_record_db_usage_per_alias(self):
+        doctor = await Doctor.objects.acreate(whatsapp_number="919900000032")
+        share = await ShareRecord.objects.acreate(
+            campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=doctor, whatsapp_message="x"
+        )
+        before = registry.db_queries[("doctor_landing", "default")]
+        with self.settings(SLOW_QUERY_MS=0), self.assertLogs("core.middleware", "WARNING"):
+            response = await self.async_client.get(reverse("doctor_landing", args=[share.token]))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(registry.db_queries[("doctor_landing", "default")], before)
+        self.assertTrue(any(q["view"] == "doctor_landing" for q in registry.slow_query_log()))
+
+    def test_profiling_is_opt_in_and_keeps_a_bounded_ring(self):
+        doctor = Doctor.objects.create(whatsapp_number="919900000031")
+        share = ShareRecord.objects.create(
+            campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=doctor, whatsapp_message="x"
+        )
+        url = reverse("doctor_landing", args=[share.token])
+        with tempfile.TemporaryDirectory() as directory, self.settings(
+            PROFILE_TOKEN="secret", PROFILE_DIR=directory, PROFILE_MAX_CAPTURES=2, PROFILE_INTERVAL_MS=1
+        ):
+            self.assertNotIn("X-Profile-Capture", self.client.get(url, HTTP_X_PROFILE="wrong"))
+            response = self.client.get(url, HTTP_X_PROFILE="secret")
+            with open(os.path.join(directory, response["X-Profile-Capture"].replace(".collapsed", ".sql.json"))) as handle:
+                timeline = json.load(handle)
+            self.assertTrue(any("core_sharerecord" in q["sql"] for q in timeline["queries"]))
+
+            err = StringIO()
+            call_command("sync_reporting", "--profile", stdout=StringIO(), stderr=err)
+            self.assertIn("command-sync_reporting.collapsed", err.getvalue())
+            self.client.get(url, {"__profile": "secret"})
+            self.assertEqual(len([f for f in os.listdir(directory) if f.endswith(".collapsed")]), 2)
+
+    def test_funnel_counts_steps_and_latency_per_segment(self):
+        other_rep = FieldRepresentative.objects.create(
+            campaign=self.campaign, name="Rep2", email="rep2@example.com", whatsapp_number="922222222222"
+        )
+        shares = [
+            ShareRecord.objects.create(
+                campaign=self.campaign, cycle=self.cycle, field_rep=rep, whatsapp_message="x",
+                doctor=Doctor.objects.create(whatsapp_number=f"91990000004{i}"),
+            )
+            for i, rep in enumerate([self.rep, self.rep, other_rep])
+        ]
+        reminder = ShareRecord.objects.create(
+            campaign=self.campaign, cycle=self.cycle, field_rep=self.rep, doctor=shares[1].doctor,
+            whatsapp_message="r", is_reminder=True, reminder_of=shares[1],
+        )
+
+        def event(share, event_type, hours, value=1):
+            ActivityEvent.objects.create(
+                share=share, doctor=share.doctor, event_type=event_type, value=value,
+                created_at=shares[0].shared_at + timedelta(hours=hours),
+            )
+
+        event(shares[0], "whatsapp_click", 1)
+        event(shares[0], "landing_visit", 2)
+        event(shares[0], "video_progress", 3, value=50)
+        event(shares[0], "video_progress", 4, value=80)
+        event(shares[0], "pdf_download", 5)
+        event(reminder, "whatsapp_click", 3)
+        event(shares[2], "landing_visit", 1)
+        call_command("sync_reporting", stdout=StringIO())
+
+        result = compute_funnel(self.campaign.id, by="field_rep")
+        by_rep = {row["field_rep"]: row for row in result["segments"]}
+        self.assertEqual(list(by_rep[self.rep.id]["counts"].values()), [2, 2, 1, 1, 1])
+        self.assertEqual(list(by_rep[other_rep.id]["counts"].values()), [1, 0, 0, 0, 0])
+        self.assertEqual(by_rep[self.rep.id]["latency_seconds"]["engaged"]["p50"], 4 * 3600)
+        self.assertEqual(by_rep[self.rep.id]["conversion"]["landing_visit"], 0.5)
+        self.assertEqual(compute_funnel(self.campaign.id, by="field_rep", chunk_size=1), result)
+        with tempfile.TemporaryDirectory() as directory:
+            archive = Archive(directory)
+            archive_month(timezone.now().strftime("%Y-%m"), archive=archive)
+            self.assertFalse(ActivityEventReport.objects.using("reporting").exists())
+            archived = compute_funnel(self.campaign.id, by="field_rep", archive=archive)
+            self.assertEqual([row["counts"] for row in archived["segments"]], [row["counts"] for row in result["segments"]])
+
+        response = self.client.get(reverse("reporting_funnel"), {"campaign_id": self.campaign.id, "video_threshold": 90})
+        self.assertEqual(response.json()["segments"][0]["counts"]["engaged"], 0)
+
+    def test_archive_moves_closed_months_and_merges_counts(self):
+        def report(source_id, event_type, occurred_at):
+            ActivityEventReport.objects.using("reporting").create(
+                source_event_id=source_id, campaign_id=self.campaign.id, cycle_id=self.cycle.id,
+                field_rep_id=self.rep.id, doctor_id=1, event_type=event_type, value=source_id, occurred_at=occurred_at,
+            )
+
+        old = timezone.now().replace(year=2024, month=1, day=15)
+        report(1, "landing_visit", old)
+        report(2, "pdf_download", old.replace(month=2))
+        report(3, "landing_visit", timezone.now())
+        with tempfile.TemporaryDirectory() as directory:
+            for compress in (False, True):
+                out = StringIO()
+                call_command("archive_reports", "--before", "2024-03", "--path", directory, *(["--compress"] if compress else []), stdout=out)
+                self.assertIn(f"Archived {0 if compress else 2} report rows", out.getvalue())
+            report(4, "landing_visit", old)
+            call_command("archive_reports", "--before", "2024-03", "--path", directory, "--compress", stdout=StringIO())
+
+            archive = Archive(directory)
+            self.assertEqual([s["name"] for s in archive.manifest()["segments"]], ["2024-01-000", "2024-02-000", "2024-01-001"])
+            self.assertEqual(ActivityEventReport.objects.using("reporting").count(), 1)
+            self.assertEqual(count_events(self.campaign.id, archive=archive), {"landing_visit": 3, "pdf_download": 1})
+            self.assertEqual(count_events(self.campaign.id, end=old.replace(month=2), archive=archive), {"landing_visit": 2})
+            self.assertEqual(count_events(self.campaign.id + 1, archive=archive), {})
+            values = sorted(v for data in archive.scan(["value"]) for v in data["value"].tolist())
+            self.assertEqual(values, [1.0, 2.0, 4.0])
+
+            # A run killed between the segment write and the delete leaves rows that must not be archived twice.
+            report(5, "pdf_download", old)
+            with patch("reporting.archive._delete"):
+                call_command("archive_reports", "--before", "2024-03", "--path", directory, stdout=StringIO())
+            call_command("archive_reports", "--before", "2024-03", "--path", directory, stdout=StringIO())
+            self.assertEqual(len(archive.manifest()["segments"]), 4)
+            self.assertEqual(ActivityEventReport.objects.using("reporting").count(), 1)
+            self.assertEqual(count_events(self.campaign.id, archive=archive), {"landing_visit": 3, "pdf_download": 2})
+
+            # A run killed between the segment rename and the manifest save leaves an unrecorded directory.
+            report(6, "pdf_download", old)
+            recorded, save = len(archive.manifest()["segments"]), Archive._save_manifest
+
+            def killed_before_manifest(archive, manifest):
+                if len(manifest["segments"]) > recorded:
+                    raise OSError("killed")
+                save(archive, manifest)
+
+            with patch.object(Archive, "_save_manifest", killed_before_manifest), self.assertRaises(OSError):
+                call_command("archive_reports", "--before", "2024-03", "--path", directory, stdout=StringIO())
+            call_command("archive_reports", "--before", "2024-03", "--path", directory, stdout=StringIO())
+            names = [s["name"] for s in archive.manifest()["segments"]]
+            self.assertEqual(len(names), recorded + 1)
+            self.assertEqual(sorted(path.name for path in Path(directory).iterdir() if path.is_dir()), sorted(names))
+            self.assertEqual(count_events(self.campaign.id, archive=archive), {"landing_visit": 3, "pdf_download": 3})
+
+            rows = list(archived_rows(campaign_id=self.campaign.id, event_types=["pdf_download"], archive=archive))
+            self.assertEqual(sorted(row[0] for row in rows), [2, 5, 6])
+            self.assertEqual((rows[0][1], rows[0][6], rows[0][8].strftime("%Y-%m")), (None, "pdf_download", "2024-02"))
+            self.assertEqual(list(archived_rows(until=old.date() - timedelta(days=30), archive=archive)), [])
+
+            ActivityDailyRollup.objects.using("reporting").create(
+                campaign_id=self.campaign.id, cycle_id=self.cycle.id, field_rep_id=self.rep.id,
+                day=old.date(), event_type="landing_visit", event_count=2,
+            )
+            with override_settings(REPORT_ARCHIVE_DIR=directory):
+                call_command("rebuild_rollups", f"--campaign={self.campaign.id}", stdout=StringIO())
+            rollups = ActivityDailyRollup.objects.using("reporting").order_by("day")
+            self.assertEqual([(r.day, r.event_count) for r in rollups], [(old.date(), 2), (timezone.localdate(), 1)])
+
+    def test_report_chunks_are_index_range_reads(self):
+        if connections["reporting"].vendor != "sqlite":
+            self.skipTest("EXPLAIN QUERY PLAN is SQLite syntax")
+        # A chunk that has to sort the whole filtered set makes keyset paging quadratic.
+        today, after = timezone.localdate(), (timezone.now(), 1)
+        events = ActivityEventReport.objects.using("reporting").filter(campaign_id=self.campaign.id, share_id__isnull=False)
+        pages = [
+            keyset_page(reports, EXPORT_FIELDS, 10, REPORT_KEY, after)
+            for reports in (*filter_reports(campaign_id=self.campaign.id, since=today), *filter_reports(until=today), events)
+        ]
+        pages.append(keyset_page(ShareRecord.objects.filter(campaign_id=self.campaign.id), ("id",), 10, after=(1,)))
+        for page in pages:
+            sql, params = page.query.sql_with_params()
+            with connections[page.db].cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+                plan = " ".join(row[-1] for row in cursor.fetchall())
+            self.assertIn("USING", plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_export_streams_filtered_reports_as_csv_jsonl_and_gzip(self):
+        now = timezone.now()
+        for source_id, event_type in enumerate(["landing_visit", "pdf_download", "landing_visit"], start=1):
+            ActivityEventReport.objects.using("reporting").create(
+                source_event_id=source_id, campaign_id=self.campaign.id, cycle_id=self.cycle.id,
+                field_rep_id=self.rep.id, doctor_id=source_id, event_type=event_type, occurred_at=now,
+            )
+        url = reverse("reporting_export")
+        response = self.client.get(url, {"campaign_id": self.campaign.id, "event_type": "landing_visit"})
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(",")[:2], ["source_event_id", "share_id"])
+        self.assertEqual([line.split(",")[0] for line in lines[1:]], ["1", "3"])
+
+        response = self.client.get(url, {"format": "jsonl", "gzip": "1", "since": now.date().isoformat(), "until": now.date().isoformat()})
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        rows = [json.loads(line) for line in gzip.decompress(b"".join(response.streaming_content)).splitlines()]
+        self.assertEqual([row["event_type"] for row in rows], ["landing_visit", "pdf_download", "landing_visit"])
+        self.assertEqual(self.client.get(url, {"since": "yesterday"}).status_code, 400)
+        empty = self.client.get(url, {"until": (now.date() - timedelta(days=1)).isoformat()})
+        self.assertEqual(b"".join(empty.streaming_content).count(b"\n"), 1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "export.csv")
+            call_command("export_reports", "--output", path, "--event-type", "pdf_download", "--chunk-size", "1")
+            with open(path) as handle:
+                self.assertEqual(len(handle.read().splitlines()), 2)
+        out = StringIO()
+        call_command("export_reports", "--format", "jsonl", "--campaign", str(self.campaign.id), stdout=out)
+        self.assertEqual([json.loads(line)["source_event_id"] for line in out.getvalue().splitlines()], [1, 2, 3])
+        with self.assertRaises(CommandError):
+            call_command("export_reports", "--gzip", stdout=StringIO())
+
+
+@override_settings(REPORTING_SHARDS=["reporting"])
+class ActivityBufferTests(TestCase):
+    databases = {"default", "reporting"}
+
+    def setUp(self):
+        campaign = Campaign.objects.create(
+            name="Buffer", brand_name="BrandX", start_date=timezone.now().date(), end_date=timezone.now().date()
+        )
+        cycle = CampaignCycle.objects.create(
+            campaign=campaign, cycle_number=1, start_date=timezone.now().date(), end_date=timezone.now().date(),
+            title="Cycle1", message_template="m", reminder_template="r",
+            pdf_url="https://example.com/doc.pdf", video_vimeo_url="https://player.vimeo.com/video/1",
+        )
+        rep = FieldRepresentative.objects.create(campaign=campaign, name="Rep", email="r@example.com", whatsapp_number="1")
+        self.doctor = Doctor.objects.create(whatsapp_number="919900000100")
+        caches["dedupe"].clear()
+        self.share = ShareRecord.objects.create(
+            campaign=campaign, cycle=cycle, field_rep=rep, doctor=self.doctor, whatsapp_message="x"
+        )
+
+    def test_buffer_flushes_in_bulk_and_sheds_when_full(self):
+        buffer = ActivityBuffer(max_events=2, block_seconds=0, start=False)
+        self.assertTrue(buffer.record(self.share.id, self.doctor.id, "video_progress", 10))
+        self.assertTrue(buffer.record(self.share.id, self.doctor.id, "video_progress", 20))
+        self.assertFalse(buffer.record(self.share.id, self.doctor.id, "video_progress", 30))
+        self.assertEqual(ActivityEvent.objects.count(), 0)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 2)
+        stats = buffer.stats()
+        self.assertEqual((stats["flushed"], stats["dropped"], stats["queue_depth"]), (2, 1, 0))
+        self.assertEqual(sorted(ActivityEvent.objects.values_list("value", flat=True)), [10, 20])
+
+    def test_failed_bulk_flush_retries_rows_individually(self):
+        buffer = ActivityBuffer(start=False)
+        for value in (10, 666, 30):
+            buffer.record(self.share.id, self.doctor.id, "video_progress", value)
+        save = ActivityEvent.save
+
+        def reject_bad_row(event, *args, **kwargs):
+            if event.value == 666:
+                raise ValueError("bad row")
+            return save(event, *args, **kwargs)
+
+        with patch.object(ActivityEvent.objects, "bulk_create", side_effect=ValueError("batch failed")), \
+                patch.object(ActivityEvent, "save", reject_bad_row), self.assertLogs("core.ingest", "ERROR") as logs:
+            buffer.flush()
+        self.assertEqual(len(logs.records), 2)
+        stats = buffer.stats()
+        self.assertEqual((stats["flushed"], stats["failed"]), (2, 1))
+        self.assertEqual(sorted(ActivityEvent.objects.values_list("value", flat=True)), [10, 30])
+
+    def test_stop_drains_pending_events(self):
+        buffer = ActivityBuffer(start=False)
+        buffer.record(self.share.id, self.doctor.id, "landing_visit")
+        buffer.stop()
+        self.assertEqual(ActivityEvent.objects.count(), 1)
+
+    def test_milestones_are_written_once_across_workers(self):
+        workers = [
+            ActivityBuffer(coalescer=ProgressCoalescer(["video_progress"], milestones=[25, 50]), start=False)
+            for _ in range(2)
+        ]
+        for buffer in workers:
+            buffer.record(self.share.id, self.doctor.id, "video_progress", 30)
+            buffer.flush()
+        milestones = ActivityEvent.objects.filter(event_type="video_progress", value=25)
+        self.assertEqual(milestones.count(), 1)
+        self.assertEqual(workers[1].stats()["coalesced"], 1)
+
+    def test_flusher_recycles_connections_around_each_write(self):
+        buffer = ActivityBuffer(flush_events=1, start=False)
+        buffer.record(self.share.id, self.doctor.id, "landing_visit")
+        calls = []
+
+        def write(batch):
+            calls.append(len(batch))
+            buffer._stopping.set()
+
+        with patch("core.ingest.close_old_connections", lambda: calls.append("close")), \
+                patch.object(buffer, "_write", write):
+            buffer._run()
+        self.assertEqual(calls[:3], ["close", 1, "close"])
+
+    def test_video_progress_is_coalesced_around_milestones(self):
+        buffer = ActivityBuffer(coalescer=ProgressCoalescer(["video_progress"], milestones=[25, 50]), start=False)
+        for value in (10, 20, 30, 40):
+            buffer.record(self.share.id, self.doctor.id, "video_progress", value)
+        buffer.record(self.share.id, self.doctor.id, "landing_visit")
+        buffer.flush()
+        buffer.record(self.share.id, self.doctor.id, "video_progress", 50)
+        buffer.flush()
+
+        progress = ActivityEvent.objects.filter(event_type="video_progress").order_by("value")
+        self.assertEqual(list(progress.values_list("value", flat=True)), [25, 40, 50])
+        self.assertEqual(ActivityEvent.objects.filter(event_type="landing_visit").count(), 1)
+
+        call_command("sync_reporting", stdout=StringIO())
+        watched = ActivityEventReport.objects.using("reporting").watch_progress().get()
+        self.assertEqual((watched["doctor_id"], watched["progress"]), (self.doctor.id, 50))
+
+
+class QueryPlanTests(TestCase):
+    databases = {"default", "reporting"}
+
+    def query_plan(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != "sqlite":
+            self.skipTest("EXPLAIN QUERY PLAN assertions are SQLite-specific")
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexed(self, queryset, index=None, ordered=False):
+        plan = self.query_plan(queryset)
+        for step in plan:
+            self.assertFalse(step.startswith("SCAN") and "USING" not in step, f"Full table scan in plan: {plan}")
+        if index:
+            self.assertTrue(any(index in step for step in plan), f"{index} not used: {plan}")
+        if ordered:
+            self.assertFalse(any("TEMP B-TREE" in step for step in plan), f"Sort not served by index: {plan}")
+
+    def test_rep_status_page_uses_rep_shared_index(self):
+        qs = ShareRecord.objects.filter(field_rep_id=1).with_button_state().select_related("doctor").order_by("-shared_at", "-id")
+        self.assertIndexed(qs[:51], "share_rep_shared_idx", ordered=True)
+
+    def test_reminder_scan_uses_status_shared_index(self):
+        qs = ShareRecord.objects.filter(status=ShareRecord.STATUS_SENT, shared_at__lte=timezone.now()).order_by("shared_at")
+        self.assertIndexed(qs, "share_status_shared_idx", ordered=True)
+
+    def test_share_token_lookup_uses_unique_index(self):
+        self.assertIndexed(ShareRecord.objects.filter(legacy_token="abc"))
+
+    def test_current_cycle_lookup_is_indexed(self):
+        today = timezone.now().date()
+        self.assertIndexed(CampaignCycle.objects.filter(campaign_id=1, start_date__lte=today, end_date__gte=today))
+
+    def test_sync_batch_reads_by_primary_key_range(self):
+        qs = ActivityEvent.objects.filter(id__gt=0, id__lte=10).order_by("id").values_list(*EVENT_FIELDS)
+        self.assertIndexed(qs[:5000], "PRIMARY KEY", ordered=True)
+
+    def test_report_campaign_timeline_uses_campaign_occurred_index(self):
+        qs = ActivityEventReport.objects.using("reporting").filter(campaign_id=1)
+        self.assertIndexed(qs[:100], "report_campaign_occurred_idx", ordered=True)
+        self.assertIndexed(ActivityEventReport.objects.using("reporting").all()[:100], "report_occurred_idx", ordered=True)
+
+
+@override_settings(ACTIVITY_BUFFER_ENABLED=False, ACTIVITY_DEDUPE_EVENTS=[], REPORTING_SHARDS=["reporting"])
+class BenchmarkTests(TestCase):
+    databases = {"default", "reporting"}
+
+    def test_benchmark_reports_percentiles_and_detects_regressions(self):
+        dataset = seed(campaigns=1, reps_per_campaign=2, doctors=5, shares=10, events=20)
+        results = run_benchmarks(dataset, requests=8, concurrency=1, servers=("wsgi", "asgi"))
+        self.assertEqual(
+            set(results),
+            {"doctor_verify", "doctor_landing", "track_activity", "doctor_status_list", "sync_reporting"}
+            | {f"{name}[asgi]" for name in ("doctor_verify", "doctor_landing", "track_activity", "doctor_status_list")},
+        )
+        self.assertEqual((results["track_activity[asgi]"]["errors"], results["doctor_landing[asgi]"]["errors"]), (0, 0))
+        self.assertEqual(results["doctor_landing"]["errors"], 0)
+        self.assertLessEqual(results["doctor_landing"]["p50_ms"], results["doctor_landing"]["p99_ms"])
+        self.assertEqual(results["sync_reporting"]["events"], 20 + 2 * 3 * 8)
+        for metrics in results.values():
+            self.assertGreaterEqual(metrics["rss_growth_kb"], 0)
+            self.assertLessEqual(metrics["rss_growth_kb"], metrics["peak_rss_kb"])
+
+        baseline = {"results": {"doctor_landing": dict(results["doctor_landing"], queries_per_request=0.5)}}
+        self.assertEqual(len(compare(baseline, {"results": results})), 1)
+        self.assertEqual(compare({"results": results}, {"results": results}), [])
+
+
+@override_settings(DATABASE_REPLICAS={"default": ["default_replica_1"], "reporting": []})
+class ReplicaRoutingTests(SimpleTestCase):
+    def test_reads_use_replicas_until_the_request_writes(self):
+        router = TransactionReportingRouter()
+        seen = []
+
+        def view(request):
+            seen.append(router.db_for_read(ShareRecord))
+            seen.append(router.db_for_write(ShareRecord))
+            seen.append(router.db_for_read(ShareRecord))
+            return HttpResponse()
+
+        token = reset_written()
+        try:
+            self.assertEqual(router.db_for_read(ActivityEventReport), "reporting")
+            ReadYourWritesMiddleware(view)(RequestFactory().get("/"))
+            self.assertEqual(seen, ["default_replica_1", "default", "default"])
+            self.assertEqual(router.db_for_read(ShareRecord), "default_replica_1")
+            self.assertFalse(router.allow_migrate("default_replica_1", "core"))
+        finally:
+            restore_written(token)
+
+    def test_a_write_pins_the_client_to_the_primary_for_a_while(self):
+        router = TransactionReportingRouter()
+        seen = []
+
+        def write(request):
+            router.db_for_write(ShareRecord)
+            return HttpResponse()
+
+        def read(request):
+            seen.append(router.db_for_read(ShareRecord))
+            return HttpResponse()
+
+        async def awrite(request):
+            await sync_to_async(router.db_for_write)(ShareRecord)
+            return HttpResponse()
+
+        token = reset_written()
+        try:
+            posted = ReadYourWritesMiddleware(write)(RequestFactory().post("/"))
+            pinned = posted.cookies["db_pinned"]
+            self.assertEqual((pinned.value, pinned["max-age"]), ("default", 10))
+            self.assertNotIn("db_pinned", ReadYourWritesMiddleware(read)(RequestFactory().get("/")).cookies)
+            self.assertEqual(seen, ["default_replica_1"])
+
+            follow_up = RequestFactory().get("/")
+            follow_up.COOKIES["db_pinned"] = pinned.value
+            ReadYourWritesMiddleware(read)(follow_up)
+            self.assertEqual(seen[-1], "default")
+            self.assertEqual(router.db_for_read(ShareRecord), "default_replica_1")
+
+            response = async_to_sync(ReadYourWritesMiddleware(awrite))(RequestFactory().post("/"))
+            self.assertEqual(response.cookies["db_pinned"].value, "default")
+        finally:
+            restore_written(token)
+
+
+@override_settings(USE_TZ=True, ACTIVITY_BUFFER_ENABLED=False, REPORTING_SHARDS=["reporting", "reporting_shard_test"], REPORTING_SHARD_MAP_TTL=0)
+class ReportingShardTests(TestCase):
+    databases = {"default", "reporting"}
+    shard = "reporting_shard_test"
+
+    def setUp(self):
+        # A real second SQLite file stands in for another reporting instance.
+        self.directory = tempfile.TemporaryDirectory()
+        connections.settings[self.shard] = dict(connections.settings["reporting"], NAME=os.path.join(self.directory.name, "shard.sqlite3"))
+        call_command("migrate", "reporting", database=self.shard, verbosity=0)
+        cache.clear()
+        today = timezone.now().date()
+        self.shares = []
+        for number in range(2):
+            campaign = Campaign.objects.create(name=f"C{number}", brand_name="B", start_date=today, end_date=today)
+            cycle = CampaignCycle.objects.create(
+                campaign=campaign, cycle_number=1, start_date=today, end_date=today, title="T",
+                message_template="m", reminder_template="r", pdf_url="https://example.com/a.pdf",
+                video_vimeo_url="https://player.vimeo.com/video/1",
+            )
+            rep = FieldRepresentative.objects.create(campaign=campaign, name="R", email="r@example.com", whatsapp_number=f"9{number}")
+            self.shares.append(ShareRecord.objects.create(
+                campaign=campaign, cycle=cycle, field_rep=rep, whatsapp_message="x",
+                doctor=Doctor.objects.create(whatsapp_number=f"91880000000{number}"),
+            ))
+        CampaignShard.objects.using("reporting").create(campaign_id=self.shares[0].campaign_id, shard="reporting")
+        CampaignShard.objects.using("reporting").create(campaign_id=self.shares[1].campaign_id, shard=self.shard)
+
+    def tearDown(self):
+        connections[self.shard].close()
+        del connections[self.shard]
+        del connections.settings[self.shard]
+        self.directory.cleanup()
+
+    def test_sync_routes_by_campaign_and_rebalance_moves_it(self):
+        first, second = self.shares
+        for share, event_types in ((first, ["landing_visit"]), (second, ["landing_visit", "whatsapp_click", "landing_visit"])):
+            for event_type in event_types:
+                ActivityEvent.objects.create(share=share, doctor=share.doctor, event_type=event_type)
+        call_command("sync_reporting", stdout=StringIO())
+
+        shard_reports = ActivityEventReport.objects.using(self.shard)
+        self.assertEqual(set(shard_reports.values_list("campaign_id", flat=True)), {second.campaign_id})
+        self.assertEqual(ActivityEventReport.objects.using("reporting").count(), 1)
+        self.assertEqual(ActivityDailyRollup.objects.using(self.shard).get(event_type="landing_visit").event_count, 2)
+        self.assertEqual(compute_funnel(second.campaign_id)["segments"][0]["counts"]["whatsapp_click"], 1)
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(count_events(archive=Archive(directory)), {"landing_visit": 3, "whatsapp_click": 1})
+        exported = b"".join(self.client.get(reverse("reporting_export")).streaming_content).decode().splitlines()
+        self.assertEqual(len(exported), 5)
+
+        out = StringIO()
+        call_command("rebalance_shard", second.campaign_id, "reporting", "--grace=0", stdout=out)
+        self.assertIn("Moved 3 reports", out.getvalue())
+        self.assertFalse(shard_reports.exists())
+        self.assertFalse(ActivityDailyRollup.objects.using(self.shard).exists())
+        self.assertEqual(ActivityEventReport.objects.using("reporting").filter(campaign_id=second.campaign_id).count(), 3)
+        self.assertEqual(CampaignShard.objects.using("reporting").get(campaign_id=second.campaign_id).shard, "reporting")
+        self.assertEqual(compute_funnel(second.campaign_id)["segments"][0]["counts"]["landing_visit"], 1)
@@ -0,0 +1,45 @@
+import re
+import secrets
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import base36_to_int, int_to_base36
+
+SALT = "inclinic.share-token"
+PUBLIC_SALT = "inclinic.share-token.public"
+MAC_LENGTH = 20
+SIGNED_TOKEN = re.compile(r"^([0-9a-z]{1,13})-([0-9a-f]{%d})$" % MAC_LENGTH)
+LEGACY_TOKEN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _mac(value, salt=SALT):
+    return salted_hmac(salt, str(value), algorithm="sha256").hexdigest()[:MAC_LENGTH]
+
+
+def new_public_id():
+    # Random rather than the row id, so a share's token exists before its INSERT and bulk inserts
+    # need no ids back (MySQL returns none).
+    return secrets.randbits(63)
+
+
+def make_token(share_id):
+    # Tokens issued before shares had a public id embed the row id.
+    return f"{int_to_base36(share_id)}-{_mac(share_id)}"
+
+
+def make_public_token(public_id):
+    return f"{int_to_base36(public_id)}-{_mac(public_id, PUBLIC_SALT)}"
+
+
+def share_lookup(token):
+    # Filter kwargs for the share behind a token, or None when it cannot be ours (no DB round trip).
+    match = SIGNED_TOKEN.match(token)
+    if match:
+        value = base36_to_int(match.group(1))
+        if constant_time_compare(match.group(2), _mac(value, PUBLIC_SALT)):
+            return {"public_id": value}
+        if constant_time_compare(match.group(2), _mac(value)):
+            return {"pk": value, "legacy_token__isnull": True, "public_id__isnull": True}
+        return None
+    if settings.SHARE_LEGACY_TOKENS and LEGACY_TOKEN.match(token):
+        return {"legacy_token": token}
+    return None
@@ -1,15 +1,35 @@
-from datetime import timedelta
-from django.http import HttpResponseBadRequest, JsonResponse
+import json
+import math
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse
+from django.core.exceptions import BadRequest
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Q
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from .counters import abump, count_sent
 from .forms import CampaignForm, FieldRepForm
+from .ingest import arecord_activity, get_buffer, is_preview_bot, suppression_stats
+from .metrics import registry, render_text, worker_identity
 from .models import ActivityEvent, Campaign, CampaignCycle, Doctor, FieldRepresentative, ShareRecord
-from .services import get_active_collaterals, get_current_cycle
+from .services import (
+    aget_share_context, ainvalidate_share, get_active_collaterals, get_current_cycle, get_landing_fragment, iter_bulk_shares,
+    render_landing, share_cache_stats, whatsapp_url,
+)
+from .sync import replication_lag
+
+
+DASHBOARD_PAGE_SIZE = 50
 
 
 def dashboard(request):
-    return render(request, "core/dashboard.html", {"campaigns": Campaign.objects.all().order_by("-id")})
+    campaigns = Paginator(Campaign.objects.select_related("counters").order_by("-id"), DASHBOARD_PAGE_SIZE)
+    return render(request, "core/dashboard.html", {"page": campaigns.get_page(request.GET.get("page"))})
 
 
 def campaign_create(request):
@@ -24,7 +44,7 @@ def campaign_create(request):
 
 
 def campaign_edit(request, campaign_id):
-    campaign = get_object_or_404(Campaign, pk=campaign_id)
+    campaign = get_object_or_404(Campaign.objects.select_related("counters"), pk=campaign_id)
     if request.method == "POST":
         if "create_cycle" in request.POST:
             CampaignCycle.objects.create(
@@ -47,7 +67,11 @@ def campaign_edit(request, campaign_id):
                 is_active=True,
             )
         return redirect("campaign_edit", campaign_id=campaign.id)
-    return render(request, "core/campaign_edit.html", {"campaign": campaign, "reps": campaign.field_reps.all(), "cycles": campaign.cycles.all()})
+    return render(request, "core/campaign_edit.html", {
+        "campaign": campaign,
+        "reps": campaign.field_reps.select_related("counters"),
+        "cycles": campaign.cycles.select_related("counters"),
+    })
 
 
 def field_rep_list(request):
@@ -67,51 +91,204 @@ def share_collateral(request):
         campaign = rep.campaign
         cycle = get_object_or_404(CampaignCycle, pk=request.POST["cycle_id"], campaign=campaign)
         doctor, _ = Doctor.objects.get_or_create(whatsapp_number=request.POST["doctor_whatsapp"])
-        share = ShareRecord.objects.create(
-            campaign=campaign,
-            cycle=cycle,
-            field_rep=rep,
-            doctor=doctor,
-            whatsapp_message=cycle.message_template,
-            is_reminder=request.POST.get("is_reminder") == "1",
-        )
-        url = f"https://wa.me/{doctor.whatsapp_number}?text={share.whatsapp_message} {request.build_absolute_uri(reverse('doctor_verify', args=[share.token]))}"
+        with transaction.atomic():
+            share = ShareRecord.objects.create(
+                campaign=campaign,
+                cycle=cycle,
+                field_rep=rep,
+                doctor=doctor,
+                whatsapp_message=cycle.message_template,
+                is_reminder=request.POST.get("is_reminder") == "1",
+            )
+            count_sent([share])
+        url = whatsapp_url(doctor.whatsapp_number, share.whatsapp_message, request.build_absolute_uri(reverse("doctor_verify", args=[share.token])))
         return render(request, "core/share_success.html", {"share": share, "url": url})
     return render(request, "core/share_form.html", {"campaigns": campaigns})
 
 
-def doctor_status_list(request):
-    rep_id = request.GET.get("rep_id")
+def share_collateral_bulk(request):
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    try:
+        payload = json.loads(request.body)
+        doctors = payload["doctors"]
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest("Expected JSON with field_rep_id, cycle_id and doctors")
+    if not isinstance(doctors, list):
+        return HttpResponseBadRequest("doctors must be a list of WhatsApp numbers")
+    entries = (
+        {
+            "row": row,
+            "field_rep_id": payload.get("field_rep_id"),
+            "cycle_id": payload.get("cycle_id"),
+            "doctor_whatsapp": number,
+            "is_reminder": bool(payload.get("is_reminder")),
+        }
+        for row, number in enumerate(doctors)
+    )
+    results = list(iter_bulk_shares(entries, lambda token: request.build_absolute_uri(reverse("doctor_verify", args=[token]))))
+    return JsonResponse({
+        "shares": [r for r in results if "error" not in r],
+        "errors": [r for r in results if "error" in r],
+    })
+
+
+DOCTOR_STATUS_PAGE_SIZE = 50
+
+
+def _doctor_status_page(params):
+    rep_id = params.get("rep_id")
     if not rep_id:
-        return render(request, "core/doctor_status.html", {"shares": []})
-    shares = ShareRecord.objects.filter(field_rep_id=rep_id).order_by("-shared_at")
-    return render(request, "core/doctor_status.html", {"shares": shares})
+        return [], None
+    now = timezone.now()
+    shares = (
+        ShareRecord.objects.filter(field_rep_id=rep_id)
+        .in_button_state(params.get("state"), now)
+        .with_button_state(now)
+        .select_related("doctor")
+        .order_by("-shared_at", "-id")
+    )
+    if params.get("cycle_id"):
+        shares = shares.filter(cycle_id=params["cycle_id"])
+    if params.get("after"):
+        try:
+            shared_at, share_id = params["after"].rsplit("_", 1)
+            shared_at, share_id = datetime.fromisoformat(shared_at), int(share_id)
+        except ValueError:
+            raise BadRequest("Invalid cursor")
+        shares = shares.filter(Q(shared_at__lt=shared_at) | Q(shared_at=shared_at, id__lt=share_id))
+    page = list(shares[:DOCTOR_STATUS_PAGE_SIZE + 1])
+    if len(page) <= DOCTOR_STATUS_PAGE_SIZE:
+        return page, None
+    page = page[:DOCTOR_STATUS_PAGE_SIZE]
+    next_params = params.copy()
+    next_params["after"] = f"{page[-1].shared_at.isoformat()}_{page[-1].id}"
+    return page, next_params.urlencode()
+
+
+def doctor_status_list(request):
+    shares, next_query = _doctor_status_page(request.GET)
+    return render(request, "core/doctor_status.html", {"shares": shares, "next_query": next_query})
+
 
+def doctor_status_json(request):
+    shares, next_query = _doctor_status_page(request.GET)
+    return JsonResponse({
+        "shares": [
+            {
+                "id": s.id,
+                "doctor_whatsapp": s.doctor.whatsapp_number,
+                "cycle_id": s.cycle_id,
+                "state": s.state,
+                "shared_at": s.shared_at.isoformat(),
+                "read_at": s.read_at.isoformat() if s.read_at else None,
+            }
+            for s in shares
+        ],
+        "next": f"{reverse('doctor_status_json')}?{next_query}" if next_query else None,
+    })
 
-def doctor_verify(request, token):
-    share = get_object_or_404(ShareRecord, token=token)
-    ActivityEvent.objects.create(share=share, doctor=share.doctor, event_type="whatsapp_click")
+
+async def doctor_verify(request, token):
+    share = await aget_share_context(token)
+    if share is None:
+        raise Http404("Share not found")
+    await arecord_activity(share["id"], share["doctor_id"], "whatsapp_click", user_agent=request.headers.get("User-Agent"))
     if request.method == "POST":
-        if request.POST["whatsapp_number"] != share.doctor.whatsapp_number:
+        if request.POST["whatsapp_number"] != share["doctor_whatsapp"]:
             return HttpResponseBadRequest("Number mismatch")
-        share.doctor.verified_at = timezone.now()
-        share.doctor.save(update_fields=["verified_at"])
+        now = timezone.now()
+        await Doctor.objects.filter(pk=share["doctor_id"]).aupdate(verified_at=now)
+        if await ShareRecord.objects.filter(pk=share["id"], verified_at__isnull=True).aupdate(verified_at=now):
+            await abump("doctors_verified", [(share["campaign_id"], share["cycle_id"], share["field_rep_id"])])
         return redirect("doctor_landing", token=token)
     return render(request, "core/doctor_verify.html", {"share": share})
 
 
-def doctor_landing(request, token):
-    share = get_object_or_404(ShareRecord, token=token)
-    ActivityEvent.objects.create(share=share, doctor=share.doctor, event_type="landing_visit")
-    if share.status != ShareRecord.STATUS_READ:
-        share.status = ShareRecord.STATUS_READ
-        share.read_at = timezone.now()
-        share.save(update_fields=["status", "read_at"])
-    return render(request, "core/doctor_landing.html", {"share": share})
+async def doctor_landing(request, token):
+    share = await aget_share_context(token)
+    if share is None:
+        raise Http404("Share not found")
+    user_agent = request.headers.get("User-Agent")
+    await arecord_activity(share["id"], share["doctor_id"], "landing_visit", user_agent=user_agent)
+    # Link-preview crawlers fetch the page as soon as the message is sent; that is not the doctor reading it.
+    if share["status"] != ShareRecord.STATUS_READ and not is_preview_bot(user_agent):
+        if await ShareRecord.objects.filter(pk=share["id"], status=ShareRecord.STATUS_SENT).aupdate(
+            status=ShareRecord.STATUS_READ, read_at=timezone.now()
+        ):
+            await abump("shares_read", [(share["campaign_id"], share["cycle_id"], share["field_rep_id"])])
+        await ainvalidate_share(token)
+    fragment = get_landing_fragment(share)
+    # The body only varies by asset version and share, so repeat visits revalidate to a 304.
+    etag = f'"{fragment["etag"]}-{share["id"]}"'
+    response = get_conditional_response(request, etag=etag, last_modified=fragment["last_modified"])
+    if response is None:
+        response = HttpResponse(render_landing(fragment, share))
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(fragment["last_modified"])
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+EVENT_TYPES = frozenset(choice for choice, _ in ActivityEvent.EVENT_CHOICES)
+
+
+async def track_activity(request, share_id, event_type):
+    # Rejected before the share lookup: one bad row would fail the buffer's whole multi-row INSERT.
+    if event_type not in EVENT_TYPES:
+        return HttpResponseBadRequest("Unknown event type")
+    try:
+        value = float(request.POST.get("value", "1"))
+    except ValueError:
+        value = math.nan
+    if not math.isfinite(value):
+        return HttpResponseBadRequest("Invalid value")
+    doctor_id = await ShareRecord.objects.filter(pk=share_id).values_list("doctor_id", flat=True).afirst()
+    if doctor_id is None:
+        raise Http404("Share not found")
+    recorded = await arecord_activity(
+        share_id, doctor_id, event_type, value,
+        idempotency_key=request.headers.get("Idempotency-Key") or request.POST.get("idempotency_key"),
+        user_agent=request.headers.get("User-Agent"),
+    )
+    if not recorded:
+        response = HttpResponse(status=503)
+        response["Retry-After"] = "1"
+        return response
+    return HttpResponse(status=204)
+
+
+def ingest_stats(request):
+    return JsonResponse(dict(get_buffer().stats(), suppressed=suppression_stats()))
+
+
+def share_cache_stats_view(request):
+    return JsonResponse(share_cache_stats())
+
+
+def worker_metrics():
+    buffer, cache_stats, suppressed = get_buffer().stats(), share_cache_stats(), suppression_stats()
+    return [
+        ("inclinic_activity_buffer_depth", "gauge", "Activity events waiting to be flushed", buffer["queue_depth"]),
+        ("inclinic_activity_buffer_dropped_total", "counter", "Activity events shed by backpressure", buffer["dropped"]),
+        ("inclinic_activity_buffer_failed_total", "counter", "Activity events lost to failed flushes", buffer["failed"]),
+        ("inclinic_activity_buffer_last_flush_seconds", "gauge", "Duration of the last buffer flush", buffer["last_flush_ms"] / 1000),
+        ("inclinic_activity_duplicates_suppressed_total", "counter", "Activity beacons dropped as duplicates", suppressed["duplicates"]),
+        ("inclinic_activity_preview_bots_filtered_total", "counter", "Activity beacons dropped from link-preview bots", suppressed["preview_bots"]),
+        ("inclinic_share_cache_hits_total", "counter", "Share context cache hits", cache_stats["hits"]),
+        ("inclinic_share_cache_misses_total", "counter", "Share context cache misses", cache_stats["misses"]),
+    ]
+
+
+def metrics(request):
+    families, _ = registry.gather(settings.METRICS_DIR)
+    # Replication lag is read from the database, so one sample from the scraped worker is enough.
+    families.append((
+        "inclinic_reporting_replication_lag_seconds", "gauge", "Age of the oldest event not yet in the reporting DB",
+        [("", {"worker": worker_identity()}, replication_lag())],
+    ))
+    return HttpResponse(render_text(families), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
-def track_activity(request, share_id, event_type):
-    share = get_object_or_404(ShareRecord, pk=share_id)
-    value = float(request.POST.get("value", "1"))
-    ActivityEvent.objects.create(share=share, doctor=share.doctor, event_type=event_type, value=value)
-    return JsonResponse({"ok": True})
+def slow_queries(request):
+    return JsonResponse({"slow_queries": registry.gather(settings.METRICS_DIR)[1]})
@@ -4,6 +4,7 @@ import os
 BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.getenv("DJANGO_SECRET_KEY", "unsafe-dev-key")
 DEBUG = os.getenv("DJANGO_DEBUG", "1") == "1"
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:8000").rstrip("/")
 ALLOWED_HOSTS = [h.strip() for h in os.getenv("DJANGO_ALLOWED_HOSTS", "*").split(",") if h.strip()]
 
 INSTALLED_APPS = [
@@ -18,6 +19,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.middleware.RequestMetricsMiddleware",
+    "core.middleware.ReadYourWritesMiddleware",
+    "core.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -67,8 +71,90 @@ DATABASES = {
     },
 }
 
+# Extra reporting shards as comma-separated name[@host[:port]] entries; "reporting" is always shard 0 and holds the shard map.
+REPORTING_SHARDS = ["reporting"]
+for number, entry in enumerate([e.strip() for e in os.getenv("REPORTING_SHARD_DBS", "").split(",") if e.strip()], start=1):
+    name, _, location = entry.partition("@")
+    host, _, port = location.partition(":")
+    shard = f"reporting_shard_{number}"
+    DATABASES[shard] = dict(
+        DATABASES["reporting"], NAME=name, HOST=host or DATABASES["reporting"]["HOST"], PORT=port or DATABASES["reporting"]["PORT"]
+    )
+    REPORTING_SHARDS.append(shard)
+REPORTING_SHARD_MAP_TTL = int(os.getenv("REPORTING_SHARD_MAP_TTL", "30"))
+
+for config in DATABASES.values():
+    config["CONN_MAX_AGE"] = int(os.getenv("DB_CONN_MAX_AGE", "60"))
+    config["CONN_HEALTH_CHECKS"] = os.getenv("DB_CONN_HEALTH_CHECKS", "1") == "1"
+
+# Comma-separated host[:port] lists; replicas reuse the primary's credentials and mirror it in tests.
+DATABASE_REPLICAS = {}
+for alias, prefix in (("default", "DB"), ("reporting", "REPORTING_DB")):
+    DATABASE_REPLICAS[alias] = []
+    hosts = [h.strip() for h in os.getenv(f"{prefix}_REPLICA_HOSTS", "").split(",") if h.strip()]
+    for number, entry in enumerate(hosts, start=1):
+        host, _, port = entry.partition(":")
+        replica = f"{alias}_replica_{number}"
+        DATABASES[replica] = dict(DATABASES[alias], HOST=host, PORT=port or DATABASES[alias]["PORT"], TEST={"MIRROR": alias})
+        DATABASE_REPLICAS[alias].append(replica)
+# After a write, the client's reads of that alias stay on the primary this long (covers replica lag).
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", "10"))
+
 DATABASE_ROUTERS = ["core.db_router.TransactionReportingRouter"]
 
+# Local-memory caches are per process and evict a tenth of their entries once full (Django's default is 300 entries).
+LOCAL_CACHE_MAX_ENTRIES = int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", "100000"))
+ACTIVITY_DEDUPE_MAX_ENTRIES = int(os.getenv("ACTIVITY_DEDUPE_MAX_ENTRIES", "200000"))
+CACHES = {
+    # Share contexts (three keys per share), cycle calendars, landing fragments and the shard map.
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "inclinic",
+        "OPTIONS": {"MAX_ENTRIES": LOCAL_CACHE_MAX_ENTRIES, "CULL_FREQUENCY": 10},
+    },
+    # Activity dedupe and idempotency keys when there is no shared cache, kept apart so a share blast cannot evict them.
+    "dedupe": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "inclinic-dedupe",
+        "OPTIONS": {"MAX_ENTRIES": ACTIVITY_DEDUPE_MAX_ENTRIES, "CULL_FREQUENCY": 10},
+    },
+}
+if os.getenv("SHARED_CACHE_URL"):
+    CACHES["shared"] = {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": os.getenv("SHARED_CACHE_URL")}
+SHARE_CACHE_TIMEOUT = int(os.getenv("SHARE_CACHE_TIMEOUT", "3600"))
+SHARE_CACHE_LOCAL_TIMEOUT = int(os.getenv("SHARE_CACHE_LOCAL_TIMEOUT", "30"))
+LANDING_CACHE_TIMEOUT = int(os.getenv("LANDING_CACHE_TIMEOUT", "3600"))
+# Accept pre-signing uuid share links; turn off once they have aged out.
+SHARE_LEGACY_TOKENS = os.getenv("SHARE_LEGACY_TOKENS", "1") == "1"
+
+REQUEST_METRICS_ENABLED = os.getenv("REQUEST_METRICS_ENABLED", "1") == "1"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_SNAPSHOT_SECONDS = float(os.getenv("METRICS_SNAPSHOT_SECONDS", "5"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/inclinic-profiles")
+PROFILE_MAX_CAPTURES = int(os.getenv("PROFILE_MAX_CAPTURES", "20"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+SYNC_LOCK_FILE = os.getenv("SYNC_LOCK_FILE", "/tmp/inclinic-sync-reporting.lock")
+REPORT_ARCHIVE_DIR = os.getenv("REPORT_ARCHIVE_DIR", str(BASE_DIR / "archive"))
+REPORT_ARCHIVE_AFTER_MONTHS = int(os.getenv("REPORT_ARCHIVE_AFTER_MONTHS", "6"))
+
+ACTIVITY_BUFFER_ENABLED = os.getenv("ACTIVITY_BUFFER_ENABLED", "1") == "1"
+ACTIVITY_BUFFER_MAX_EVENTS = int(os.getenv("ACTIVITY_BUFFER_MAX_EVENTS", "10000"))
+ACTIVITY_BUFFER_FLUSH_EVENTS = int(os.getenv("ACTIVITY_BUFFER_FLUSH_EVENTS", "500"))
+ACTIVITY_BUFFER_FLUSH_SECONDS = float(os.getenv("ACTIVITY_BUFFER_FLUSH_SECONDS", "1.0"))
+ACTIVITY_BUFFER_BLOCK_SECONDS = float(os.getenv("ACTIVITY_BUFFER_BLOCK_SECONDS", "0.05"))
+ACTIVITY_COALESCE_EVENTS = [e.strip() for e in os.getenv("ACTIVITY_COALESCE_EVENTS", "video_progress").split(",") if e.strip()]
+ACTIVITY_COALESCE_SECONDS = float(os.getenv("ACTIVITY_COALESCE_SECONDS", "30"))
+ACTIVITY_DEDUPE_EVENTS = [
+    e.strip() for e in os.getenv("ACTIVITY_DEDUPE_EVENTS", "whatsapp_click,landing_visit,pdf_last_page,pdf_download").split(",") if e.strip()
+]
+ACTIVITY_DEDUPE_SECONDS = int(os.getenv("ACTIVITY_DEDUPE_SECONDS", "300"))
+ACTIVITY_IDEMPOTENCY_SECONDS = int(os.getenv("ACTIVITY_IDEMPOTENCY_SECONDS", "86400"))
+ACTIVITY_PROGRESS_MILESTONES = [float(m) for m in os.getenv("ACTIVITY_PROGRESS_MILESTONES", "25,50,75,100").split(",") if m.strip()]
+ACTIVITY_MILESTONE_SECONDS = int(os.getenv("ACTIVITY_MILESTONE_SECONDS", "2592000"))
+
 AUTH_PASSWORD_VALIDATORS = []
 LANGUAGE_CODE = "en-us"
 TIME_ZONE = "UTC"
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.urls import path
 from core import views
+from reporting import views as reporting_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -9,8 +10,16 @@ urlpatterns = [
     path('publisher/campaign/<int:campaign_id>/edit/', views.campaign_edit, name='campaign_edit'),
     path('brand/field-reps/', views.field_rep_list, name='field_rep_list'),
     path('field/send/', views.share_collateral, name='share_collateral'),
+    path('field/send/bulk/', views.share_collateral_bulk, name='share_collateral_bulk'),
     path('field/doctors/', views.doctor_status_list, name='doctor_status_list'),
+    path('field/doctors/json/', views.doctor_status_json, name='doctor_status_json'),
     path('doctor/verify/<str:token>/', views.doctor_verify, name='doctor_verify'),
     path('doctor/landing/<str:token>/', views.doctor_landing, name='doctor_landing'),
     path('activity/<int:share_id>/<str:event_type>/', views.track_activity, name='track_activity'),
+    path('reporting/funnel/', reporting_views.funnel, name='reporting_funnel'),
+    path('reporting/export/', reporting_views.export_reports, name='reporting_export'),
+    path('internal/ingest/', views.ingest_stats, name='ingest_stats'),
+    path('internal/share-cache/', views.share_cache_stats_view, name='share_cache_stats'),
+    path('internal/metrics/', views.metrics, name='metrics'),
+    path('internal/slow-queries/', views.slow_queries, name='slow_queries'),
 ]
@@ -1,4 +1,4 @@
 from django.contrib import admin
-from .models import ActivityEventReport
+from .models import ActivityDailyRollup, ActivityEventReport, CampaignShard, SyncState
 
-admin.site.register(ActivityEventReport)
+admin.site.register([ActivityEventReport, ActivityDailyRollup, SyncState, CampaignShard])
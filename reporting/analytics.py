@@ -0,0 +1,174 @@
+from itertools import chain
+import numpy as np
+from django.db.models import Case, F, Func, IntegerField, Q, Value, When
+from core.db_router import read_alias
+from core.models import ShareRecord
+from .archive import Archive
+from .exports import REPORT_KEY, keyset_chunks
+from .models import ActivityEventReport
+from .sharding import read_shard
+
+FUNNEL_STEPS = ("shared", "whatsapp_click", "landing_visit", "engaged", "pdf_download")
+SEGMENT_FIELDS = {"campaign": "campaign_id", "cycle": "cycle_id", "field_rep": "field_rep_id"}
+PERCENTILES = (0.5, 0.9, 0.99)
+CHUNK_SIZE = 50000
+DEFAULT_VIDEO_THRESHOLD = 75
+
+
+class UnixTime(Func):
+    output_field = IntegerField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, template="EXTRACT(EPOCH FROM %(expressions)s)", **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, template="CAST(ROUND((julianday(%(expressions)s) - 2440587.5) * 86400) AS INTEGER)", **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        # TIMESTAMPDIFF ignores the session time zone, unlike UNIX_TIMESTAMP.
+        return super().as_sql(
+            compiler, connection, template="TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', %(expressions)s)", **extra_context
+        )
+
+
+def _columns(queryset, fields, chunk_size, key=("id",)):
+    # One float64 matrix per keyset chunk, without the key columns.
+    for chunk in keyset_chunks(queryset, fields, chunk_size, key):
+        yield np.array([row[len(key):] for row in chunk], dtype=np.float64)
+
+
+def _load_shares(campaign_id, cycle_id=None, field_rep_id=None, chunk_size=CHUNK_SIZE):
+    shares = ShareRecord.objects.using(read_alias("default")).filter(campaign_id=campaign_id)
+    if cycle_id is not None:
+        shares = shares.filter(cycle_id=cycle_id)
+    if field_rep_id is not None:
+        shares = shares.filter(field_rep_id=field_rep_id)
+    shares = shares.annotate(root_id=Case(When(reminder_of__isnull=False, then=F("reminder_of_id")), default=F("id")))
+    shares = shares.annotate(shared_epoch=UnixTime("shared_at")).order_by("id")
+    fields = ("id", "root_id", "cycle_id", "field_rep_id", "shared_epoch")
+    chunks = list(_columns(shares, fields, chunk_size))
+    data = np.concatenate(chunks) if chunks else np.empty((0, len(fields)))
+    ids = data[:, 0].astype(np.int64)
+    # Reminder events count toward the original share's funnel when the original is in scope.
+    root_ids = data[:, 1].astype(np.int64)
+    root = np.minimum(np.searchsorted(ids, root_ids), max(len(ids) - 1, 0))
+    root = np.where(ids[root] == root_ids, root, np.arange(len(ids))) if len(ids) else root
+    return {
+        "ids": ids,
+        "root": root,
+        "cycle_id": data[:, 2].astype(np.int64),
+        "field_rep_id": data[:, 3].astype(np.int64),
+        "shared_at": data[:, 4],
+    }
+
+
+def _event_codes(video_threshold):
+    return Case(
+        When(event_type="whatsapp_click", then=Value(1)),
+        When(event_type="landing_visit", then=Value(2)),
+        When(Q(event_type="pdf_last_page") | Q(event_type="video_progress", value__gte=video_threshold), then=Value(3)),
+        When(event_type="pdf_download", then=Value(4)),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+STEP_EVENTS = {"whatsapp_click": 1, "landing_visit": 2, "pdf_last_page": 3, "pdf_download": 4}
+
+
+def _archived_steps(data, event_types, video_threshold):
+    # Same mapping as _event_codes, applied to the archive's dictionary-encoded event types.
+    lookup = np.array([STEP_EVENTS.get(name, 0) for name in event_types] or [0], dtype=np.int64)
+    steps = lookup[data["event_type"]]
+    if "video_progress" in event_types:
+        engaged = (data["event_type"] == event_types.index("video_progress")) & (data["value"] >= video_threshold)
+        steps = np.where(engaged, 3, steps)
+    return steps
+
+
+def _first_step_times(shares, campaign_id, video_threshold, chunk_size, archive=None):
+    ids, root = shares["ids"], shares["root"]
+    first = np.full((len(FUNNEL_STEPS), len(ids)), np.inf)
+    first[0] = shares["shared_at"]
+    events = (
+        ActivityEventReport.objects.using(read_shard(campaign_id))
+        .filter(campaign_id=campaign_id, share_id__isnull=False)
+        .annotate(step=_event_codes(video_threshold), epoch=UnixTime("occurred_at"))
+        .order_by()
+    )
+    if not len(ids):
+        return first
+    archive = archive or Archive()
+    event_types = archive.manifest()["event_types"]
+    archived = (
+        (data["share_id"], _archived_steps(data, event_types, video_threshold), data["occurred_at"] // 1_000_000)
+        for data in archive.scan(["share_id", "event_type", "value", "occurred_at"], campaign_id)
+    )
+    live = (
+        (chunk[:, 0].astype(np.int64), chunk[:, 1].astype(np.int64), chunk[:, 2])
+        for chunk in _columns(events, ("share_id", "step", "epoch"), chunk_size, key=REPORT_KEY)
+    )
+    for share_ids, steps, times in chain(archived, live):
+        position = np.searchsorted(ids, share_ids)
+        position = np.minimum(position, len(ids) - 1)
+        keep = (ids[position] == share_ids) & (steps > 0)
+        np.minimum.at(first, (steps[keep], root[position[keep]]), times[keep])
+    return first
+
+
+def _segment_percentiles(segments, values, segment_count):
+    result = np.full((segment_count, len(PERCENTILES)), np.nan)
+    if not len(values):
+        return result
+    order = np.lexsort((values, segments))
+    segments, values = segments[order], values[order]
+    counts = np.bincount(segments, minlength=segment_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    populated = counts > 0
+    for column, fraction in enumerate(PERCENTILES):
+        positions = starts + np.floor(fraction * (counts - 1)).astype(np.int64)
+        result[populated, column] = values[positions[populated]]
+    return result
+
+
+def compute_funnel(campaign_id, by="campaign", cycle_id=None, field_rep_id=None,
+                   video_threshold=DEFAULT_VIDEO_THRESHOLD, chunk_size=CHUNK_SIZE, archive=None):
+    shares = _load_shares(campaign_id, cycle_id, field_rep_id, chunk_size)
+    first = _first_step_times(shares, campaign_id, video_threshold, chunk_size, archive)
+    originals = shares["root"] == np.arange(len(shares["ids"]))
+    first = first[:, originals]
+    if by == "campaign":
+        keys = np.full(int(originals.sum()), campaign_id, dtype=np.int64)
+    else:
+        keys = shares[SEGMENT_FIELDS[by]][originals]
+    segment_keys, segments = np.unique(keys, return_inverse=True)
+
+    reached = np.isfinite(first)
+    reached = np.logical_and.accumulate(reached, axis=0)
+    counts = np.stack([np.bincount(segments, weights=row, minlength=len(segment_keys)) for row in reached]).astype(np.int64)
+    latency = {}
+    for step in range(1, len(FUNNEL_STEPS)):
+        mask = reached[step]
+        latency[FUNNEL_STEPS[step]] = _segment_percentiles(
+            segments[mask], first[step][mask] - first[0][mask], len(segment_keys)
+        )
+
+    rows = []
+    for index, key in enumerate(segment_keys):
+        shared = counts[0, index]
+        rows.append({
+            by: int(key),
+            "counts": {step: int(counts[n, index]) for n, step in enumerate(FUNNEL_STEPS)},
+            "conversion": {
+                step: round(float(counts[n, index]) / shared, 4) if shared else 0.0
+                for n, step in enumerate(FUNNEL_STEPS)
+            },
+            "latency_seconds": {
+                step: {
+                    f"p{int(fraction * 100)}": None if np.isnan(value) else float(value)
+                    for fraction, value in zip(PERCENTILES, latency[step][index])
+                }
+                for step in FUNNEL_STEPS[1:]
+            },
+        })
+    return {"campaign_id": campaign_id, "by": by, "video_threshold": video_threshold, "steps": list(FUNNEL_STEPS), "segments": rows}
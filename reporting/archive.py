@@ -0,0 +1,259 @@
+import json
+import os
+import shutil
+import zlib
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from io import BytesIO
+from pathlib import Path
+import numpy as np
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+from .models import ActivityEventReport
+from .sharding import fan_out, merge_counts, read_shard, shard_aliases
+
+COLUMNS = {
+    "source_event_id": np.int64,
+    "share_id": np.int64,
+    "campaign_id": np.int64,
+    "cycle_id": np.int64,
+    "field_rep_id": np.int64,
+    "doctor_id": np.int64,
+    "event_type": np.uint8,
+    "value": np.float64,
+    "occurred_at": np.int64,
+}
+MANIFEST = "manifest.json"
+CHUNK_SIZE = 50000
+SEGMENT_ROWS = 5_000_000
+
+
+def month_bounds(month):
+    start = datetime.strptime(month, "%Y-%m").replace(tzinfo=dt_timezone.utc)
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+
+def to_micros(moment):
+    return int(moment.timestamp() * 1_000_000)
+
+
+def closed_months(before):
+    # Months that ended before the cutoff and still have rows in the hot table.
+    cutoff, _ = month_bounds(before)
+    oldest = [
+        moment for alias in shard_aliases()
+        for moment in ActivityEventReport.objects.using(alias).filter(occurred_at__lt=cutoff)
+        .order_by("occurred_at").values_list("occurred_at", flat=True)[:1]
+    ]
+    if not oldest:
+        return []
+    months, start = [], month_bounds(min(oldest).astimezone(dt_timezone.utc).strftime("%Y-%m"))[0]
+    while start < cutoff:
+        months.append(start.strftime("%Y-%m"))
+        start = month_bounds(start.strftime("%Y-%m"))[1]
+    return months
+
+
+class Archive:
+    def __init__(self, root=None):
+        self.root = Path(root or settings.REPORT_ARCHIVE_DIR)
+
+    def manifest(self):
+        path = self.root / MANIFEST
+        if not path.exists():
+            return {"event_types": [], "segments": []}
+        return json.loads(path.read_text())
+
+    def _save_manifest(self, manifest):
+        self.root.mkdir(parents=True, exist_ok=True)
+        staging = self.root / f"{MANIFEST}.tmp"
+        staging.write_text(json.dumps(manifest, indent=1))
+        os.replace(staging, self.root / MANIFEST)
+
+    def discard_orphans(self):
+        # The manifest save is the commit point: a directory a killed run renamed into place but never
+        # recorded holds rows still in the hot table, so it is dropped and those rows are archived again.
+        if not self.root.exists():
+            return
+        known = {segment["name"] for segment in self.manifest()["segments"]}
+        for path in self.root.iterdir():
+            if path.is_dir() and path.name not in known:
+                shutil.rmtree(path)
+
+    def _segment_name(self, manifest, month):
+        taken = {segment["name"] for segment in manifest["segments"]}
+        number = 0
+        while f"{month}-{number:03d}" in taken or (self.root / f"{month}-{number:03d}").exists():
+            number += 1
+        return f"{month}-{number:03d}"
+
+    def write_segment(self, month, columns, compress=False):
+        manifest = self.manifest()
+        name = self._segment_name(manifest, month)
+        staging = self.root / f".{name}.tmp"
+        staging.mkdir(parents=True, exist_ok=True)
+        for column, values in columns.items():
+            buffer = BytesIO()
+            np.save(buffer, values, allow_pickle=False)
+            payload = zlib.compress(buffer.getvalue(), 6) if compress else buffer.getvalue()
+            (staging / f"{column}.npy{'.z' if compress else ''}").write_bytes(payload)
+        os.replace(staging, self.root / name)
+        occurred = columns["occurred_at"]
+        manifest["segments"].append({
+            "name": name,
+            "month": month,
+            "rows": int(len(occurred)),
+            "compressed": compress,
+            "min_source_event_id": int(columns["source_event_id"].min()),
+            "max_source_event_id": int(columns["source_event_id"].max()),
+            "min_occurred_at": int(occurred.min()),
+            "max_occurred_at": int(occurred.max()),
+            "campaign_ids": sorted({int(c) for c in np.unique(columns["campaign_id"])}),
+        })
+        self._save_manifest(manifest)
+        return name
+
+    def event_type_codes(self, event_types):
+        # Event types are dictionary-encoded; the dictionary only ever grows so old segments stay valid.
+        manifest = self.manifest()
+        known = manifest["event_types"]
+        for event_type in event_types:
+            if event_type not in known:
+                known.append(event_type)
+        self._save_manifest(manifest)
+        return {event_type: code for code, event_type in enumerate(known)}
+
+    def read_column(self, segment, column):
+        directory = self.root / segment["name"]
+        if segment["compressed"]:
+            return np.load(BytesIO(zlib.decompress((directory / f"{column}.npy.z").read_bytes())), allow_pickle=False)
+        return np.load(directory / f"{column}.npy", mmap_mode="r", allow_pickle=False)
+
+    def segments(self, campaign_id=None, start=None, end=None):
+        for segment in self.manifest()["segments"]:
+            if campaign_id is not None and campaign_id not in segment["campaign_ids"]:
+                continue
+            if start is not None and segment["max_occurred_at"] < to_micros(start):
+                continue
+            if end is not None and segment["min_occurred_at"] >= to_micros(end):
+                continue
+            yield segment
+
+    def scan(self, columns, campaign_id=None, start=None, end=None):
+        needed = set(columns) | {"campaign_id", "occurred_at"}
+        for segment in self.segments(campaign_id, start, end):
+            data = {column: self.read_column(segment, column) for column in needed}
+            mask = np.ones(segment["rows"], dtype=bool)
+            if campaign_id is not None:
+                mask &= data["campaign_id"] == campaign_id
+            if start is not None:
+                mask &= data["occurred_at"] >= to_micros(start)
+            if end is not None:
+                mask &= data["occurred_at"] < to_micros(end)
+            yield {column: np.asarray(data[column][mask]) for column in columns}
+
+
+def archive_month(month, archive=None, compress=False, chunk_size=CHUNK_SIZE, segment_rows=SEGMENT_ROWS):
+    archive = archive or Archive()
+    archive.discard_orphans()
+    start, end = month_bounds(month)
+    segments = [segment for segment in archive.manifest()["segments"] if segment["month"] == month]
+    codes, loaded, archived = {}, {}, 0
+    for alias in shard_aliases():
+        rows = ActivityEventReport.objects.using(alias).filter(occurred_at__gte=start, occurred_at__lt=end)
+        # Rows are converted to typed column chunks as they are read, so a segment never exists as Python tuples.
+        pending, size, last_id = [], 0, 0
+        while True:
+            chunk = list(rows.filter(id__gt=last_id).order_by("id").values_list("id", *COLUMNS)[:chunk_size])
+            if chunk:
+                last_id = chunk[-1][0]
+                ids, columns = _chunk_columns(archive, chunk, codes)
+                done = _archived_mask(archive, segments, columns["source_event_id"], loaded)
+                if done.any():
+                    # A run killed after writing a segment but before deleting its rows; finish the delete only.
+                    _delete(alias, ids[done])
+                    ids, columns = ids[~done], {column: values[~done] for column, values in columns.items()}
+                if len(ids):
+                    pending.append((ids, columns))
+                    size += len(ids)
+            if size and (not chunk or size >= segment_rows):
+                archived += _flush_segment(archive, month, pending, compress, alias)
+                pending, size = [], 0
+            if not chunk:
+                break
+    return archived
+
+
+def _chunk_columns(archive, rows, codes):
+    unseen = {row[7] for row in rows} - codes.keys()
+    if unseen:
+        codes.update(archive.event_type_codes(sorted(unseen)))
+    convert = {"share_id": lambda v: -1 if v is None else v, "event_type": codes.__getitem__, "occurred_at": to_micros}
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    columns = {}
+    for position, (column, dtype) in enumerate(COLUMNS.items(), start=1):
+        cast = convert.get(column, lambda v: v)
+        columns[column] = np.fromiter((cast(row[position]) for row in rows), dtype=dtype, count=len(rows))
+    return ids, columns
+
+
+def _archived_mask(archive, segments, source_ids, loaded):
+    # Only segments whose id range overlaps the chunk are read, which normally means none.
+    mask = np.zeros(len(source_ids), dtype=bool)
+    for segment in segments:
+        overlap = (source_ids >= segment["min_source_event_id"]) & (source_ids <= segment["max_source_event_id"])
+        if not overlap.any():
+            continue
+        if segment["name"] not in loaded:
+            loaded[segment["name"]] = np.sort(archive.read_column(segment, "source_event_id"))
+        known = loaded[segment["name"]]
+        positions = np.searchsorted(known, source_ids).clip(max=len(known) - 1)
+        mask |= overlap & (known[positions] == source_ids)
+    return mask
+
+
+def _delete(alias, ids):
+    reports = ActivityEventReport.objects.using(alias)
+    for offset in range(0, len(ids), CHUNK_SIZE):
+        reports.filter(id__in=ids[offset:offset + CHUNK_SIZE].tolist()).delete()
+
+
+def _flush_segment(archive, month, pending, compress, alias):
+    ids = np.concatenate([chunk_ids for chunk_ids, _ in pending])
+    columns = {column: np.concatenate([chunk[column] for _, chunk in pending]) for column in COLUMNS}
+    archive.write_segment(month, columns, compress=compress)
+    # Rows leave the hot table only after their segment and manifest entry are durable.
+    _delete(alias, ids)
+    return len(ids)
+
+
+def first_live_day(archive=None):
+    # The first local day with no archived rows; rollups before it cannot be recomputed from the hot table.
+    ends = [month_bounds(segment["month"])[1] for segment in (archive or Archive()).manifest()["segments"]]
+    if not ends:
+        return None
+    end = timezone.localtime(max(ends))
+    return end.date() if end.time() == time.min else end.date() + timedelta(days=1)
+
+
+def count_events(campaign_id=None, start=None, end=None, archive=None):
+    archive = archive or Archive()
+    event_types = archive.manifest()["event_types"]
+    counts = {}
+    for data in archive.scan(["event_type"], campaign_id, start, end):
+        for code, total in zip(*np.unique(data["event_type"], return_counts=True)):
+            counts[event_types[code]] = counts.get(event_types[code], 0) + int(total)
+
+    def live_counts(alias):
+        live = ActivityEventReport.objects.using(alias)
+        if campaign_id is not None:
+            live = live.filter(campaign_id=campaign_id)
+        if start is not None:
+            live = live.filter(occurred_at__gte=start)
+        if end is not None:
+            live = live.filter(occurred_at__lt=end)
+        return {row["event_type"]: row["total"] for row in live.values("event_type").annotate(total=Count("id")).order_by()}
+
+    live = [live_counts(read_shard(campaign_id))] if campaign_id is not None else fan_out(live_counts)
+    return merge_counts([counts, *live])
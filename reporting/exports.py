@@ -0,0 +1,146 @@
+import csv
+import json
+import zlib
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from io import StringIO
+from itertools import chain
+import numpy as np
+from django.db.models import Q
+from django.utils import timezone
+from .archive import Archive
+from .models import ActivityEventReport
+from .sharding import fan_out, read_shard
+
+EXPORT_FIELDS = (
+    "source_event_id", "share_id", "campaign_id", "cycle_id", "field_rep_id",
+    "doctor_id", "event_type", "value", "occurred_at",
+)
+FORMATS = ("csv", "jsonl")
+REPORT_KEY = ("occurred_at", "id")
+CHUNK_SIZE = 5000
+FLUSH_BYTES = 64 * 1024
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def filter_reports(campaign_id=None, cycle_id=None, field_rep_id=None, since=None, until=None, event_types=None):
+    # One queryset per shard that can hold matching rows.
+    if campaign_id is not None:
+        querysets = [ActivityEventReport.objects.using(read_shard(campaign_id)).filter(campaign_id=campaign_id)]
+    else:
+        querysets = fan_out(ActivityEventReport.objects.using)
+    return [_filter(reports, cycle_id, field_rep_id, since, until, event_types) for reports in querysets]
+
+
+def archived_rows(campaign_id=None, cycle_id=None, field_rep_id=None, since=None, until=None, event_types=None, archive=None):
+    # Rows archive_reports moved out of the hot table, decoded back into EXPORT_FIELDS order.
+    archive = archive or Archive()
+    names = archive.manifest()["event_types"]
+    start = timezone.make_aware(datetime.combine(since, time.min)) if since is not None else None
+    end = timezone.make_aware(datetime.combine(until + timedelta(days=1), time.min)) if until is not None else None
+    wanted = [code for code, name in enumerate(names) if name in event_types] if event_types else None
+    for data in archive.scan(EXPORT_FIELDS, campaign_id, start, end):
+        mask = np.ones(len(data["source_event_id"]), dtype=bool)
+        if cycle_id is not None:
+            mask &= data["cycle_id"] == cycle_id
+        if field_rep_id is not None:
+            mask &= data["field_rep_id"] == field_rep_id
+        if wanted is not None:
+            mask &= np.isin(data["event_type"], wanted)
+        columns = [data[field][mask].tolist() for field in EXPORT_FIELDS]
+        for source_id, share_id, campaign, cycle, rep, doctor, event_type, value, occurred in zip(*columns):
+            yield (
+                source_id, None if share_id < 0 else share_id, campaign, cycle, rep, doctor,
+                names[event_type], value, EPOCH + timedelta(microseconds=occurred),
+            )
+
+
+def _filter(reports, cycle_id, field_rep_id, since, until, event_types):
+    if cycle_id is not None:
+        reports = reports.filter(cycle_id=cycle_id)
+    if field_rep_id is not None:
+        reports = reports.filter(field_rep_id=field_rep_id)
+    # Day bounds become datetime ranges so the occurred_at indexes apply.
+    if since is not None:
+        reports = reports.filter(occurred_at__gte=timezone.make_aware(datetime.combine(since, time.min)))
+    if until is not None:
+        reports = reports.filter(occurred_at__lt=timezone.make_aware(datetime.combine(until + timedelta(days=1), time.min)))
+    if event_types:
+        reports = reports.filter(event_type__in=event_types)
+    return reports
+
+
+def _after(key, values):
+    if len(key) == 1:
+        return Q(**{f"{key[0]}__gt": values[0]})
+    # The leading >= bound is what lets the database start an index range read at the previous chunk's end.
+    (first, second), (first_value, second_value) = key, values
+    return Q(**{f"{first}__gte": first_value}) & (Q(**{f"{first}__gt": first_value}) | Q(**{f"{second}__gt": second_value}))
+
+
+def keyset_page(queryset, fields, chunk_size, key=("id",), after=None):
+    page = queryset if after is None else queryset.filter(_after(key, after))
+    return page.order_by(*key).values_list(*key, *fields)[:chunk_size]
+
+
+def keyset_chunks(queryset, fields, chunk_size=CHUNK_SIZE, key=("id",)):
+    # Keyset chunks instead of one cursor: mysqlclient buffers a whole result set client-side.
+    # The key must be covered by an index the filter can use, or every chunk re-sorts the whole match.
+    # Each row is (*key, *fields).
+    after = None
+    while True:
+        chunk = list(keyset_page(queryset, fields, chunk_size, key, after))
+        if not chunk:
+            return
+        after = chunk[-1][:len(key)]
+        yield chunk
+
+
+def iter_rows(querysets, chunk_size=CHUNK_SIZE):
+    # (occurred_at, id) follows report_occurred_idx and report_campaign_occurred_idx; InnoDB and SQLite
+    # secondary indexes end in the primary key, so the id tie-break needs no sort either.
+    for reports in querysets:
+        for chunk in keyset_chunks(reports, EXPORT_FIELDS, chunk_size, key=REPORT_KEY):
+            for row in chunk:
+                yield row[len(REPORT_KEY):]
+
+
+def _csv_lines(rows):
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        writer.writerow(row[:-1] + (row[-1].isoformat(),))
+        if buffer.tell() >= FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _jsonl_lines(rows):
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(EXPORT_FIELDS, row[:-1] + (row[-1].isoformat(),)))) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            yield "".join(lines)
+            lines, size = [], 0
+    yield "".join(lines)
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(reports, fmt="csv", compress=False, chunk_size=CHUNK_SIZE, archived=()):
+    # Archived months come first, so rows stay in roughly chronological order.
+    lines = _csv_lines if fmt == "csv" else _jsonl_lines
+    chunks = (text.encode() for text in lines(chain(archived, iter_rows(reports, chunk_size))) if text)
+    return _gzip(chunks) if compress else chunks
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from reporting.archive import Archive, archive_month, closed_months
+
+
+class Command(BaseCommand):
+    help = "Move closed months of ActivityEventReport into columnar archive segments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--before", help="Archive months before YYYY-MM (default: REPORT_ARCHIVE_AFTER_MONTHS ago)")
+        parser.add_argument("--path", help="Archive directory (default: REPORT_ARCHIVE_DIR)")
+        parser.add_argument("--compress", action="store_true", help="zlib-compress columns (segments are then not memory-mapped)")
+
+    def handle(self, *args, **options):
+        before = options["before"]
+        if not before:
+            today = timezone.now().date()
+            months = today.year * 12 + today.month - 1 - settings.REPORT_ARCHIVE_AFTER_MONTHS
+            before = f"{months // 12:04d}-{months % 12 + 1:02d}"
+        archive = Archive(options["path"])
+        total = 0
+        for month in closed_months(before):
+            archived = archive_month(month, archive=archive, compress=options["compress"])
+            total += archived
+            if archived:
+                self.stdout.write(f"{month}: {archived} rows")
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} report rows before {before}."))
@@ -0,0 +1,46 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from reporting.exports import CHUNK_SIZE, FORMATS, archived_rows, filter_reports, stream_export
+
+
+class Command(BaseCommand):
+    help = "Stream filtered ActivityEventReport rows as CSV or JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=FORMATS, default="csv")
+        parser.add_argument("--output", default="-", help="File path, or - for stdout")
+        parser.add_argument("--gzip", action="store_true", help="gzip-compress the output")
+        parser.add_argument("--campaign", type=int)
+        parser.add_argument("--cycle", type=int)
+        parser.add_argument("--field-rep", type=int)
+        parser.add_argument("--since", type=date.fromisoformat, help="First day YYYY-MM-DD")
+        parser.add_argument("--until", type=date.fromisoformat, help="Last day YYYY-MM-DD")
+        parser.add_argument("--event-type", action="append", help="Repeat to export several event types")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        filters = {
+            "campaign_id": options["campaign"], "cycle_id": options["cycle"], "field_rep_id": options["field_rep"],
+            "since": options["since"], "until": options["until"], "event_types": options["event_type"],
+        }
+        chunks = stream_export(
+            filter_reports(**filters), options["format"], compress=options["gzip"], chunk_size=options["chunk_size"],
+            archived=archived_rows(**filters),
+        )
+        if options["output"] != "-":
+            with open(options["output"], "wb") as stream:
+                for chunk in chunks:
+                    stream.write(chunk)
+            return
+        # Through self.stdout so call_command(stdout=...) captures it; bytes go to the binary buffer when there is one.
+        stream = getattr(self.stdout._out, "buffer", None)
+        if stream is None:
+            if options["gzip"]:
+                raise CommandError("--gzip needs --output or a binary stdout")
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending="")
+            return
+        self.stdout.flush()
+        for chunk in chunks:
+            stream.write(chunk)
+        stream.flush()
@@ -0,0 +1,22 @@
+import json
+from django.core.management.base import BaseCommand
+from reporting.analytics import CHUNK_SIZE, DEFAULT_VIDEO_THRESHOLD, SEGMENT_FIELDS, compute_funnel
+
+
+class Command(BaseCommand):
+    help = "Compute the doctor engagement funnel for a campaign from the reporting DB"
+
+    def add_arguments(self, parser):
+        parser.add_argument("campaign_id", type=int)
+        parser.add_argument("--by", choices=sorted(SEGMENT_FIELDS), default="campaign")
+        parser.add_argument("--cycle", type=int)
+        parser.add_argument("--field-rep", type=int)
+        parser.add_argument("--video-threshold", type=float, default=DEFAULT_VIDEO_THRESHOLD)
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        result = compute_funnel(
+            options["campaign_id"], by=options["by"], cycle_id=options["cycle"], field_rep_id=options["field_rep"],
+            video_threshold=options["video_threshold"], chunk_size=options["chunk_size"],
+        )
+        self.stdout.write(json.dumps(result, indent=2))
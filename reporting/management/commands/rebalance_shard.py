@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.sync import SyncLocked, sync_lock
+from reporting.sharding import rebalance, shard_aliases, shard_for
+
+
+class Command(BaseCommand):
+    help = "Move a campaign's reporting rows and rollups to another reporting shard"
+
+    def add_arguments(self, parser):
+        parser.add_argument("campaign_id", type=int)
+        parser.add_argument("shard", help="Target database alias, e.g. reporting_shard_1")
+        parser.add_argument("--grace", type=float, help="Seconds to keep source rows after the switch (default REPORTING_SHARD_MAP_TTL)")
+
+    def handle(self, *args, **options):
+        if options["shard"] not in shard_aliases():
+            raise CommandError(f"Unknown shard {options['shard']}; configured: {', '.join(shard_aliases())}")
+        source = shard_for(options["campaign_id"])
+        try:
+            # Holding the sync lock keeps sync_reporting from writing to the old shard mid-move.
+            with sync_lock():
+                moved = rebalance(options["campaign_id"], options["shard"], grace=options["grace"])
+        except SyncLocked as exc:
+            raise CommandError(f"sync_reporting holds {exc}; stop it (including --follow) and retry.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {moved} reports for campaign {options['campaign_id']} from {source} to {options['shard']}."
+        ))
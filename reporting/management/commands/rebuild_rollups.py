@@ -0,0 +1,15 @@
+from datetime import date
+from django.core.management.base import BaseCommand
+from reporting.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute daily activity rollups from ActivityEventReport"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--campaign", type=int, help="Only rebuild this campaign id")
+        parser.add_argument("--since", type=date.fromisoformat, help="Only rebuild days on or after YYYY-MM-DD")
+
+    def handle(self, *args, **options):
+        written = rebuild(campaign_id=options["campaign"], since=options["since"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} rollup rows."))
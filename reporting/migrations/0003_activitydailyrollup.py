@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [("reporting", "0002_syncstate")]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('campaign_id', models.BigIntegerField()),
+                ('cycle_id', models.BigIntegerField()),
+                ('field_rep_id', models.BigIntegerField()),
+                ('day', models.DateField()),
+                ('event_type', models.CharField(max_length=30)),
+                ('event_count', models.BigIntegerField(default=0)),
+                ('value_sum', models.FloatField(default=0)),
+                ('value_max', models.FloatField(default=0)),
+            ],
+            options={'unique_together': {('campaign_id', 'cycle_id', 'field_rep_id', 'day', 'event_type')}},
+        )
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [("reporting", "0003_activitydailyrollup")]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activityeventreport',
+            index=models.Index(fields=['occurred_at'], name='report_occurred_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activityeventreport',
+            index=models.Index(fields=['campaign_id', 'occurred_at'], name='report_campaign_occurred_idx'),
+        ),
+    ]
@@ -0,0 +1,13 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [("reporting", "0004_report_indexes")]
+
+    operations = [
+        migrations.AddField(
+            model_name='activityeventreport',
+            name='share_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
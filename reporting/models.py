@@ -1,8 +1,16 @@
 from django.db import models
+from django.db.models import Max
+
+
+class ActivityEventReportQuerySet(models.QuerySet):
+    def watch_progress(self, event_type="video_progress"):
+        # Coalesced and milestone rows both carry the progress value, so the max is exact.
+        return self.filter(event_type=event_type).values("doctor_id", "cycle_id").annotate(progress=Max("value")).order_by()
 
 
 class ActivityEventReport(models.Model):
     source_event_id = models.BigIntegerField(unique=True)
+    share_id = models.BigIntegerField(null=True, blank=True)
     campaign_id = models.BigIntegerField()
     cycle_id = models.BigIntegerField()
     field_rep_id = models.BigIntegerField()
@@ -11,5 +19,43 @@ class ActivityEventReport(models.Model):
     value = models.FloatField(default=1)
     occurred_at = models.DateTimeField()
 
+    objects = ActivityEventReportQuerySet.as_manager()
+
     class Meta:
         ordering = ["-occurred_at"]
+        indexes = [
+            models.Index(fields=["occurred_at"], name="report_occurred_idx"),
+            models.Index(fields=["campaign_id", "occurred_at"], name="report_campaign_occurred_idx"),
+        ]
+
+
+class SyncState(models.Model):
+    name = models.CharField(max_length=64, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_event_id}"
+
+
+class ActivityDailyRollup(models.Model):
+    campaign_id = models.BigIntegerField()
+    cycle_id = models.BigIntegerField()
+    field_rep_id = models.BigIntegerField()
+    day = models.DateField()
+    event_type = models.CharField(max_length=30)
+    event_count = models.BigIntegerField(default=0)
+    value_sum = models.FloatField(default=0)
+    value_max = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ("campaign_id", "cycle_id", "field_rep_id", "day", "event_type")
+
+
+class CampaignShard(models.Model):
+    campaign_id = models.BigIntegerField(unique=True)
+    shard = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"campaign {self.campaign_id} -> {self.shard}"
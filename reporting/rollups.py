@@ -0,0 +1,84 @@
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .archive import first_live_day
+from .models import ActivityDailyRollup, ActivityEventReport
+from .sharding import shard_aliases, shard_for
+
+ROLLUP_KEY = ("campaign_id", "cycle_id", "field_rep_id", "day", "event_type")
+
+
+def summarize(reports):
+    totals = {}
+    for report in reports:
+        key = (report.campaign_id, report.cycle_id, report.field_rep_id, timezone.localdate(report.occurred_at), report.event_type)
+        count, total, peak = totals.get(key, (0, 0.0, None))
+        totals[key] = (count + 1, total + report.value, report.value if peak is None else max(peak, report.value))
+    return totals
+
+
+def apply_reports(reports, using="reporting"):
+    # Must run inside the transaction that inserted the reports so counts never drift.
+    totals = summarize(reports)
+    if not totals:
+        return 0
+    existing = {
+        tuple(getattr(rollup, field) for field in ROLLUP_KEY): rollup
+        for rollup in ActivityDailyRollup.objects.using(using).select_for_update().filter(
+            campaign_id__in={key[0] for key in totals},
+            day__in={key[3] for key in totals},
+        )
+    }
+    changed, created = [], []
+    for key, (count, total, peak) in totals.items():
+        rollup = existing.get(key)
+        if rollup is None:
+            created.append(ActivityDailyRollup(
+                **dict(zip(ROLLUP_KEY, key)), event_count=count, value_sum=total, value_max=peak
+            ))
+            continue
+        rollup.event_count += count
+        rollup.value_sum += total
+        rollup.value_max = max(rollup.value_max, peak)
+        changed.append(rollup)
+    ActivityDailyRollup.objects.using(using).bulk_update(changed, ["event_count", "value_sum", "value_max"], batch_size=1000)
+    ActivityDailyRollup.objects.using(using).bulk_create(created, batch_size=1000)
+    return len(totals)
+
+
+def rebuild(campaign_id=None, since=None, chunk_size=2000, using=None):
+    # Archived months no longer have report rows, so their rollups are kept instead of recomputed.
+    floor = first_live_day()
+    if floor is not None and (since is None or since < floor):
+        since = floor
+    if using is None:
+        aliases = [shard_for(campaign_id)] if campaign_id is not None else shard_aliases()
+        return sum(rebuild(campaign_id, since, chunk_size, using=alias) for alias in aliases)
+    rollups = ActivityDailyRollup.objects.using(using)
+    reports = ActivityEventReport.objects.using(using)
+    if campaign_id is not None:
+        rollups = rollups.filter(campaign_id=campaign_id)
+        reports = reports.filter(campaign_id=campaign_id)
+    if since is not None:
+        rollups = rollups.filter(day__gte=since)
+        reports = reports.filter(occurred_at__date__gte=since)
+    grouped = (
+        reports.annotate(day=TruncDate("occurred_at"))
+        .values(*ROLLUP_KEY)
+        .annotate(event_count=Count("id"), value_sum=Sum("value"), value_max=Max("value"))
+        .order_by()
+    )
+    written = 0
+    with transaction.atomic(using=using):
+        rollups.delete()
+        chunk = []
+        for row in grouped.iterator(chunk_size=chunk_size):
+            chunk.append(ActivityDailyRollup(**row))
+            if len(chunk) >= chunk_size:
+                ActivityDailyRollup.objects.using(using).bulk_create(chunk)
+                written += len(chunk)
+                chunk = []
+        ActivityDailyRollup.objects.using(using).bulk_create(chunk)
+        written += len(chunk)
+    return written
@@ -0,0 +1,95 @@
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from core.db_router import read_alias
+from .models import ActivityDailyRollup, ActivityEventReport, CampaignShard
+
+DIRECTORY = "reporting"
+SHARD_KEY = "campaign-shard:{}"
+SHARDED_MODELS = (ActivityEventReport, ActivityDailyRollup)
+MOVE_CHUNK_SIZE = 5000
+
+
+def shard_aliases():
+    return list(settings.REPORTING_SHARDS)
+
+
+def _pick_shard(campaign_id):
+    # Campaigns synced before sharding was enabled stay where their rows already are.
+    if ActivityEventReport.objects.using(DIRECTORY).filter(campaign_id=campaign_id).exists():
+        return DIRECTORY
+    shards = shard_aliases()
+    return shards[campaign_id % len(shards)]
+
+
+def shard_for(campaign_id, assign=False):
+    shards = shard_aliases()
+    if len(shards) == 1 or campaign_id is None:
+        return DIRECTORY
+    key = SHARD_KEY.format(campaign_id)
+    alias = cache.get(key)
+    if alias is None:
+        alias = CampaignShard.objects.using(DIRECTORY).filter(campaign_id=campaign_id).values_list("shard", flat=True).first()
+        if alias is None:
+            if not assign:
+                return DIRECTORY
+            alias = CampaignShard.objects.using(DIRECTORY).get_or_create(
+                campaign_id=campaign_id, defaults={"shard": _pick_shard(campaign_id)}
+            )[0].shard
+        cache.set(key, alias, settings.REPORTING_SHARD_MAP_TTL)
+    return alias
+
+
+def read_shard(campaign_id):
+    return read_alias(shard_for(campaign_id))
+
+
+def fan_out(query, merge=None):
+    # Runs query(alias) on every shard in turn; only cross-campaign reads should need this.
+    results = [query(read_alias(alias)) for alias in shard_aliases()]
+    return merge(results) if merge else results
+
+
+def merge_counts(results):
+    total = Counter()
+    for result in results:
+        total.update(result)
+    return dict(total)
+
+
+def _copy(model, rows, target):
+    for row in rows:
+        row.pk = None
+    model.objects.using(target).bulk_create(rows, ignore_conflicts=model is ActivityEventReport)
+
+
+def rebalance(campaign_id, target, grace=None, chunk_size=MOVE_CHUNK_SIZE):
+    if target not in shard_aliases():
+        raise ValueError(f"Unknown reporting shard {target!r}")
+    source = shard_for(campaign_id)
+    if source == target:
+        return 0
+    reports = ActivityEventReport.objects.using(source).filter(campaign_id=campaign_id)
+    moved, last_id = 0, 0
+    while True:
+        chunk = list(reports.filter(id__gt=last_id).order_by("id")[:chunk_size])
+        if not chunk:
+            break
+        last_id = chunk[-1].id
+        _copy(ActivityEventReport, chunk, target)
+        moved += len(chunk)
+    with transaction.atomic(using=target):
+        ActivityDailyRollup.objects.using(target).filter(campaign_id=campaign_id).delete()
+        _copy(ActivityDailyRollup, list(ActivityDailyRollup.objects.using(source).filter(campaign_id=campaign_id)), target)
+    CampaignShard.objects.using(DIRECTORY).update_or_create(campaign_id=campaign_id, defaults={"shard": target})
+    cache.delete(SHARD_KEY.format(campaign_id))
+    # Workers may still route to the old shard until their cached mapping expires.
+    time.sleep(settings.REPORTING_SHARD_MAP_TTL if grace is None else grace)
+    ActivityDailyRollup.objects.using(source).filter(campaign_id=campaign_id).delete()
+    while True:
+        ids = list(reports.order_by("id").values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            return moved
+        ActivityEventReport.objects.using(source).filter(id__in=ids).delete()
@@ -0,0 +1,47 @@
+from datetime import date
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from .analytics import DEFAULT_VIDEO_THRESHOLD, SEGMENT_FIELDS, compute_funnel
+from .exports import FORMATS, archived_rows, filter_reports, stream_export
+
+CONTENT_TYPES = {"csv": "text/csv; charset=utf-8", "jsonl": "application/x-ndjson"}
+
+
+def funnel(request):
+    try:
+        campaign_id = int(request.GET["campaign_id"])
+        cycle_id = int(request.GET["cycle_id"]) if request.GET.get("cycle_id") else None
+        field_rep_id = int(request.GET["field_rep_id"]) if request.GET.get("field_rep_id") else None
+        video_threshold = float(request.GET.get("video_threshold", DEFAULT_VIDEO_THRESHOLD))
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest("campaign_id is required; ids and video_threshold must be numeric")
+    by = request.GET.get("by", "campaign")
+    if by not in SEGMENT_FIELDS:
+        return HttpResponseBadRequest(f"by must be one of {', '.join(SEGMENT_FIELDS)}")
+    return JsonResponse(compute_funnel(
+        campaign_id, by=by, cycle_id=cycle_id, field_rep_id=field_rep_id, video_threshold=video_threshold
+    ))
+
+
+def export_reports(request):
+    fmt = request.GET.get("format", "csv")
+    if fmt not in FORMATS:
+        return HttpResponseBadRequest(f"format must be one of {', '.join(FORMATS)}")
+    try:
+        filters = {
+            "campaign_id": int(request.GET["campaign_id"]) if request.GET.get("campaign_id") else None,
+            "cycle_id": int(request.GET["cycle_id"]) if request.GET.get("cycle_id") else None,
+            "field_rep_id": int(request.GET["field_rep_id"]) if request.GET.get("field_rep_id") else None,
+            "since": date.fromisoformat(request.GET["since"]) if request.GET.get("since") else None,
+            "until": date.fromisoformat(request.GET["until"]) if request.GET.get("until") else None,
+            "event_types": request.GET.getlist("event_type"),
+        }
+    except ValueError:
+        return HttpResponseBadRequest("ids must be numeric; since and until must be YYYY-MM-DD")
+    compress = request.GET.get("gzip") == "1"
+    response = StreamingHttpResponse(
+        stream_export(filter_reports(**filters), fmt, compress=compress, archived=archived_rows(**filters)),
+        content_type="application/gzip" if compress else CONTENT_TYPES[fmt],
+    )
+    filename = f"activity-reports.{fmt}" + (".gz" if compress else "")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response